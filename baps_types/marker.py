@@ -1,12 +1,17 @@
 import json
-from typing import Dict, Optional, Union
+from typing import Optional, Union
 
 POSITIONS = ["start", "mid", "end"]
 PARAMS = ["name", "time", "position", "section"]
 
 
 class Marker:
-    marker: Dict
+    __slots__ = ("_name", "_time", "_position", "_section")
+
+    _name: str
+    _time: float
+    _position: str
+    _section: Optional[str]
 
     def __init__(self, new_marker: Union[str, dict]):
         marker: dict
@@ -34,33 +39,45 @@ class Marker:
         if not (marker["section"] is None or isinstance(marker["section"], str)):
             raise ValueError("Section name is not str or None.")
 
-        marker["time"] = float(marker["time"])
         # If everything checks out, let's save it.
-        self.marker = marker
+        self._name = marker["name"]
+        self._time = float(marker["time"])
+        self._position = marker["position"]
+        self._section = marker["section"]
 
     @property
     def __str__(self) -> str:
-        return json.dumps(self.marker)
+        return json.dumps(self.__dict__)
 
     @property
     def __dict__(self) -> dict:
-        return self.marker
+        # Same key order as WebStudio sends them in.
+        return {
+            "name": self._name,
+            "time": self._time,
+            "section": self._section,
+            "position": self._position,
+        }
+
+    # There's no real __dict__, so pickle / copy using the dict representation.
+    def __reduce__(self):
+        return (Marker, (self.__dict__,))
 
     @property
     def name(self) -> str:
-        return self.marker["name"]
+        return self._name
 
     @property
     def time(self) -> float:
-        return float(self.marker["time"])
+        return self._time
 
     @property
     def position(self) -> str:
-        return self.marker["position"]
+        return self._position
 
     @property
     def section(self) -> Optional[str]:
-        return self.marker["section"]
+        return self._section
 
     def same_type(self, o: object) -> bool:
         if not isinstance(o, Marker):
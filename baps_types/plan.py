@@ -26,17 +26,51 @@ def _time_ms():
 
 
 class PlanItem:
-    _timeslotitemid: str = "0"
-    _weight: int = 0
+    # Show plans can be big, and players run for a long time, so keep items compact.
+    __slots__ = (
+        "_timeslotitemid",
+        "_weight",
+        "_filename",
+        "_title",
+        "_artist",
+        "_trackid",
+        "_managedid",
+        "_length",
+        "_markers",
+        "_intro",
+        "_cue",
+        "_outro",
+        "_play_count",
+        "_played_at",
+        "_clean",
+        "_dict_cache",
+        "_json_cache",
+    )
+
+    _timeslotitemid: str
+    _weight: int
     _filename: Optional[str]
     _title: str
     _artist: Optional[str]
     _trackid: Optional[int]
     _managedid: Optional[int]
-    _markers: List[Marker] = []
+    _length: Optional[str]
+    _markers: List[Marker]
+    # The times of the main (not in a section) start / mid / end markers, worked out when the markers change.
+    _intro: float
+    _cue: float
+    _outro: float
     _play_count: int
     _played_at: int
     _clean: bool
+    # The serialised item, kept until something about the item changes.
+    _dict_cache: Optional[Dict[str, Any]]
+    _json_cache: Optional[str]
+
+    # Must be called whenever anything in __dict__ changes.
+    def _changed(self):
+        self._dict_cache = None
+        self._json_cache = None
 
     @property
     def weight(self) -> int:
@@ -44,7 +78,9 @@ class PlanItem:
 
     @weight.setter
     def weight(self, value: int):
-        self._weight = value
+        if value != self._weight:
+            self._weight = value
+            self._changed()
 
     @property
     def timeslotitemid(self) -> str:
@@ -53,6 +89,7 @@ class PlanItem:
     @timeslotitemid.setter
     def timeslotitemid(self, value):
         self._timeslotitemid = str(value)
+        self._changed()
 
     @property
     def filename(self) -> Optional[str]:
@@ -61,6 +98,7 @@ class PlanItem:
     @filename.setter
     def filename(self, value: Optional[str]):
         self._filename = value
+        self._changed()
 
     @property
     def play_count(self) -> int:
@@ -73,15 +111,18 @@ class PlanItem:
     def play_count_increment(self):
         self._play_count += 1
         self._played_at = _time_ms()
+        self._changed()
 
     def play_count_decrement(self):
         self._play_count = max(0, self._play_count - 1)
         if self._play_count == 0:
             self._played_at = 0
+        self._changed()
 
     def play_count_reset(self):
         self._play_count = 0
         self._played_at = 0
+        self._changed()
 
     @property
     def name(self) -> str:
@@ -121,40 +162,47 @@ class PlanItem:
 
     @property
     def intro(self) -> float:
-        markers = list(
-            filter(lambda m: m.position == "start" and m.section is None, self._markers)
-        )
-        # TODO: Handle multiple (shouldn't happen?)
-        if len(markers) > 0:
-            return markers[0].time
-        return 0
+        return self._intro
 
     @property
     def cue(self) -> float:
-        markers = list(
-            filter(lambda m: m.position == "mid" and m.section is None, self._markers)
-        )
-        # TODO: Handle multiple (shouldn't happen?)
-        if len(markers) > 0:
-            return markers[0].time
-        return 0
+        return self._cue
 
     @property
     def outro(self) -> float:
-        markers = list(
-            filter(lambda m: m.position == "end" and m.section is None, self._markers)
-        )
-        # TODO: Handle multiple (shouldn't happen?)
-        if len(markers) > 0:
-            return markers[0].time
-        return 0
+        return self._outro
+
+    # Must be called whenever the markers change, to work out the intro / cue / outro.
+    def _markers_changed(self):
+        times = {}
+        for marker in self._markers:
+            # TODO: Handle multiple (shouldn't happen?)
+            if marker.section is None and marker.position not in times:
+                times[marker.position] = marker.time
+        self._intro = times.get("start", 0)
+        self._cue = times.get("mid", 0)
+        self._outro = times.get("end", 0)
+        self._changed()
 
     @property
     def markers(self) -> List[dict]:
         return [repr.__dict__ for repr in self._markers]
 
+    # Note: This is shared with everyone that asks until the item changes, so don't change it!
     @property
     def __dict__(self):
+        if self._dict_cache is None:
+            self._dict_cache = self._to_dict()
+        return self._dict_cache
+
+    # The item as JSON, for building bigger JSON (like statuses) without encoding every item every time.
+    @property
+    def json(self) -> str:
+        if self._json_cache is None:
+            self._json_cache = json.dumps(self.__dict__)
+        return self._json_cache
+
+    def _to_dict(self) -> Dict[str, Any]:
         return {
             "weight": self.weight,
             "timeslotitemid": self.timeslotitemid,
@@ -177,6 +225,8 @@ class PlanItem:
         }
 
     def __init__(self, new_item: Dict[str, Any]):
+        self._dict_cache = None
+        self._json_cache = None
         self._timeslotitemid = str(new_item["timeslotitemid"])
         self._managedid = new_item["managedid"] if "managedid" in new_item else None
         self._trackid = (
@@ -196,6 +246,7 @@ class PlanItem:
             if "markers" in new_item
             else []
         )
+        self._markers_changed()
         self._play_count = new_item["play_count"] if "play_count" in new_item else 0
         self._played_at = new_item["played_at"] if "played_at" in new_item else 0
         self._clean = new_item["clean"] if "clean" in new_item else True
@@ -209,25 +260,31 @@ class PlanItem:
             )
             and new_item["intro"] > 0
         ):
-            marker = {
-                "name": "Intro",
-                "time": new_item["intro"],
-                "position": "start",
-                "section": None,
-            }
-            self.set_marker(Marker(json.dumps(marker)))
+            self.set_marker(
+                Marker(
+                    {
+                        "name": "Intro",
+                        "time": new_item["intro"],
+                        "position": "start",
+                        "section": None,
+                    }
+                )
+            )
         if (
             "cue" in new_item
             and (isinstance(new_item["cue"], int) or isinstance(new_item["cue"], float))
             and new_item["cue"] > 0
         ):
-            marker = {
-                "name": "Cue",
-                "time": new_item["cue"],
-                "position": "mid",
-                "section": None,
-            }
-            self.set_marker(Marker(json.dumps(marker)))
+            self.set_marker(
+                Marker(
+                    {
+                        "name": "Cue",
+                        "time": new_item["cue"],
+                        "position": "mid",
+                        "section": None,
+                    }
+                )
+            )
         # TODO: Convert / handle outro being from end of item.
         if (
             "outro" in new_item
@@ -237,13 +294,16 @@ class PlanItem:
             )
             and new_item["outro"] > 0
         ):
-            marker = {
-                "name": "Outro",
-                "time": new_item["outro"],
-                "position": "end",
-                "section": None,
-            }
-            self.set_marker(Marker(json.dumps(marker)))
+            self.set_marker(
+                Marker(
+                    {
+                        "name": "Outro",
+                        "time": new_item["outro"],
+                        "position": "end",
+                        "section": None,
+                    }
+                )
+            )
 
         # Fix any OS specific / or \'s
         if self.filename:
@@ -252,10 +312,17 @@ class PlanItem:
             else:
                 self._filename = self.filename.replace("/", "\\")
 
+    # There's no real __dict__, so pickle / copy using the dict representation.
+    def __reduce__(self):
+        return (PlanItem, (dict(self.__dict__),))
+
     def __eq__(self, o: object) -> bool:
         if not isinstance(o, PlanItem):
             return False
 
+        if o is self:
+            return True
+
         return o.__dict__ == self.__dict__
 
     def set_marker(self, new_marker: Marker):
@@ -278,6 +345,7 @@ class PlanItem:
             new_markers.append(new_marker)
 
         self._markers = new_markers
+        self._markers_changed()
 
         # Return updated item for easy chaining.
         return self
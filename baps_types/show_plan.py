@@ -0,0 +1,105 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Show Plan
+
+    A channel's show plan, kept in weighted order with the weights dense (weight == position),
+    so an item can be found by weight straight away, and by timeslotitemid with an index.
+
+    The items (not the plan) are what get stored in the player state, so every change here
+    is handed to the state as a new list with items().
+
+    Date:
+        October 2026
+"""
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from baps_types.plan import PlanItem
+
+
+class ShowPlan:
+    __slots__ = ("_items", "_index")
+
+    _items: List[PlanItem]
+    # timeslotitemid -> weight
+    _index: Dict[str, int]
+
+    # Sorts the given items into weighted order, correcting any duplicate weights / gaps.
+    def __init__(self, items: Iterable[PlanItem] = ()):
+        self._items = sorted(items, key=lambda item: item.weight)
+        self._index = {}
+        self._renumber(0)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[PlanItem]:
+        return iter(self._items)
+
+    # A copy of the items in weighted order, to store in the state.
+    def items(self) -> List[PlanItem]:
+        return list(self._items)
+
+    def get(self, weight: int) -> Optional[PlanItem]:
+        if 0 <= weight < len(self._items):
+            return self._items[weight]
+        return None
+
+    # Timeslotitemid can be a ghost (un-submitted item), so may be "IXXX", hence str.
+    def weight_of(self, timeslotitemid: str) -> Optional[int]:
+        return self._index.get(str(timeslotitemid))
+
+    def find(self, timeslotitemid: str) -> Optional[PlanItem]:
+        weight = self.weight_of(timeslotitemid)
+        return self._items[weight] if weight is not None else None
+
+    # Adds new items at their weights, shifting any items at / after them down.
+    # Items are added in weighted order (so they can be given in any order, ie a plan straight from MyRadio),
+    # and the weights only corrected once at the end.
+    def insert(self, new_items: Iterable[PlanItem]):
+        first_changed = len(self._items)
+        for item in sorted(new_items, key=lambda item: item.weight):
+            weight = min(max(item.weight, 0), len(self._items))
+            self._items.insert(weight, item)
+            first_changed = min(first_changed, weight)
+        self._renumber(first_changed)
+
+    def remove(self, weight: int) -> Optional[PlanItem]:
+        item = self.get(weight)
+        if not item:
+            return None
+        del self._items[weight]
+        if self._index.get(item.timeslotitemid) == weight:
+            del self._index[item.timeslotitemid]
+        self._renumber(weight)
+        return item
+
+    def move(self, weight: int, new_weight: int) -> bool:
+        item = self.get(weight)
+        if not item:
+            return False
+        new_weight = min(max(new_weight, 0), len(self._items) - 1)
+        del self._items[weight]
+        self._items.insert(new_weight, item)
+        self._renumber(min(weight, new_weight), max(weight, new_weight) + 1)
+        return True
+
+    # Swaps the item at weight for a new version of it (with the same timeslotitemid).
+    def replace(self, weight: int, item: PlanItem):
+        old_item = self._items[weight]
+        if self._index.get(old_item.timeslotitemid) == weight:
+            del self._index[old_item.timeslotitemid]
+        item.weight = weight
+        self._items[weight] = item
+        self._index[item.timeslotitemid] = weight
+
+    # Recorrects the weights (and index) of the items from start to (not including) end.
+    def _renumber(self, start: int, end: Optional[int] = None):
+        items = self._items
+        index = self._index
+        for weight in range(start, len(items) if end is None else end):
+            item = items[weight]
+            item.weight = weight
+            index[item.timeslotitemid] = weight
@@ -6,7 +6,8 @@ import time
 from setproctitle import setproctitle
 
 from helpers.logging_manager import LoggingManager
-from helpers.state_manager import StateManager
+from helpers.shared_config import SharedConfig
+from helpers.state_manager import StateChanges
 from controllers.controller import Controller
 
 
@@ -14,11 +15,11 @@ class MattchBox(Controller):
     ser: Optional[serial.Serial]
     port: Optional[str]
     next_port: Optional[str]
-    server_state: StateManager
+    server_state: SharedConfig
     logger: LoggingManager
 
     def __init__(
-        self, player_to_q: List[Queue], player_from_q: Queue, state: StateManager
+        self, player_to_q: List[Queue], player_from_q: Queue, state: SharedConfig
     ):
 
         process_title = "BAPSicle - ControllerHandler"
@@ -28,13 +29,10 @@ class MattchBox(Controller):
         self.ser = None
         self.logger = LoggingManager("ControllerMattchBox")
 
-        self.server_state = state  # This is a copy, will not update :/
-
-        # This doesn't run, the callback function gets lost
-        # due to state being a copy in the multiprocessing process.
-        # self.server_state.add_callback(self._state_handler)
+        self.server_state = state
 
         # Allow server config changes to trigger controller reload if required.
+        self.server_state.add_callback(self._state_handler, keys=["serial_port"])
         self.port = None
         self.next_port = self.server_state.get()["serial_port"]
         self.logger.log.info("Server config gives port as: {}".format(self.next_port))
@@ -44,10 +42,9 @@ class MattchBox(Controller):
 
         self.handler()
 
-    # This doesn't run, the callback function gets lost in StateManager.
-
-    def _state_handler(self):
-        new_port = self.server_state.get()["serial_port"]
+    # Called (from the config watcher thread) when the serial port config changes.
+    def _state_handler(self, changes: StateChanges):
+        new_port = changes["serial_port"][1]
         self.logger.log.info("Got server config update. New port: {}".format(new_port))
         if new_port != self.port:
             self.logger.log.info(
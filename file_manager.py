@@ -1,24 +1,30 @@
-from helpers.state_manager import StateManager
-from helpers.os_environment import isWindows, resolve_external_file_path
+from helpers.shared_config import SharedConfig
+from helpers.state_manager import StateChanges
+from helpers.status_stream import StatusTracker
 from setproctitle import setproctitle
 from multiprocessing import current_process, Queue
 from time import sleep
 import os
 import json
-from syncer import sync
 
 from helpers.logging_manager import LoggingManager
 from helpers.the_terminator import Terminator
+from helpers.http_pool import close_http_pool
+from helpers.media_index import media_key
+from helpers.music_cache import MusicCache
 from helpers.myradio_api import MyRadioAPI
-from helpers.normalisation import generate_normalised_file
+from helpers.normalisation import normalise_file
+from helpers.preloader import Preloader
 from baps_types.plan import PlanItem
 
 
 class FileManager:
     logger: LoggingManager
     api: MyRadioAPI
+    cache: MusicCache
+    preloader: Preloader
 
-    def __init__(self, channel_from_q: Queue, server_config: StateManager):
+    def __init__(self, channel_from_q: Queue, server_config: SharedConfig):
 
         self.logger = LoggingManager("FileManager")
         self.api = MyRadioAPI(self.logger, server_config)
@@ -28,11 +34,10 @@ class FileManager:
         current_process().name = process_title
 
         terminator = Terminator()
-        self.normalisation_mode = server_config.get()["normalisation_mode"]
-        if self.normalisation_mode != "on":
-            self.logger.log.info("Normalisation is disabled.")
-        else:
-            self.logger.log.info("Normalisation is enabled.")
+        self.normalisation_mode = None
+        self._set_normalisation_mode(server_config.get()["normalisation_mode"])
+        # Pick up normalisation being turned on / off without needing a restart.
+        server_config.add_callback(self._config_handler, keys=["normalisation_mode"])
         self.channel_count = server_config.get()["num_channels"]
         self.channel_received = None
         self.last_known_show_plan = [[]] * self.channel_count
@@ -40,6 +45,14 @@ class FileManager:
         self.known_channels_preloaded = [False] * self.channel_count
         self.known_channels_normalised = [False] * self.channel_count
         self.last_known_item_ids = [[]] * self.channel_count
+        # Pick up whatever's been downloaded (or normalised) since we last looked.
+        self.cache = MusicCache(server_config.get()["music_cache_max_mb"] * 1024 * 1024, index=self.api.media_index)
+        self.cache.sync()
+        self._log_cache_stats()
+        self.preloader = Preloader(
+            self.logger, self.api, server_config.get()["preload_concurrency"], self.cache
+        )
+        self.status_trackers = [StatusTracker() for _ in range(self.channel_count)]
         try:
 
             while not terminator.terminate:
@@ -55,8 +68,13 @@ class FileManager:
                 except Exception:
                     # No new messages
                     # Let's try preload / normalise some files now we're free of messages.
-                    preloaded = self.do_preload()
-                    normalised = self.do_normalise()
+                    try:
+                        preloaded = self.do_preload()
+                        normalised = self.do_normalise()
+                    except Exception:
+                        # ie the media index being busy, we'll try again in a bit.
+                        self.logger.log.exception("Failed to preload / normalise files.")
+                        preloaded = normalised = False
 
                     if not preloaded and not normalised:
                         # We didn't do any hard work, let's sleep.
@@ -73,7 +91,7 @@ class FileManager:
 
                         self.logger.log.debug("Got command {} for channel {}".format(command, channel))
 
-                        # If we have requested a new show plan, empty the music-tmp directory for the previous show.
+                        # If we have requested a new show plan, make room in the music cache for the next show.
                         if command == "GETPLAN":
 
                             if (
@@ -81,49 +99,21 @@ class FileManager:
                                     False] * self.channel_count
                                 and self.channel_received[channel] is False
                             ):
-                                # We've already received a delete trigger on a channel,
-                                # let's not delete the folder more than once.
-                                # If the channel was already in the process of being deleted, the user has
+                                # We've already received a trigger on a channel,
+                                # let's not go through the cache more than once.
+                                # If the channel was already in the process of being loaded, the user has
                                 # requested it again, so allow it.
 
                                 self.channel_received[channel] = True
                                 continue
 
-                            # Delete the previous show files!
-                            # Note: The players load into RAM. If something is playing over the load,
-                            # the source file can still be deleted.
-                            path: str = resolve_external_file_path(
-                                "/music-tmp/")
-
-                            if not os.path.isdir(path):
-                                self.logger.log.warning(
-                                    "Music-tmp folder is missing, not handling."
-                                )
-                                continue
+                            # Rather than deleting the previous show's files, keep them for next time,
+                            # removing the least recently used ones if there are too many.
+                            # Note: The players load into RAM, so removing a file that's playing is fine.
+                            self.evict_cache()
 
-                            files = [
-                                f
-                                for f in os.listdir(path)
-                                if os.path.isfile(os.path.join(path, f))
-                            ]
-                            for file in files:
-                                if isWindows():
-                                    filepath = path + "\\" + file
-                                else:
-                                    filepath = path + "/" + file
-                                self.logger.log.info(
-                                    "Removing file {} on new show load.".format(
-                                        filepath
-                                    )
-                                )
-                                try:
-                                    os.remove(filepath)
-                                except Exception:
-                                    self.logger.log.warning(
-                                        "Failed to remove, skipping. Likely file is still in use."
-                                    )
-                                    continue
                             self.channel_received[channel] = True
+                            self.preloader.clear()
                             self.known_channels_preloaded = [
                                 False] * self.channel_count
                             self.known_channels_normalised = [
@@ -131,16 +121,29 @@ class FileManager:
                             ] * self.channel_count
 
                         # If we receive a new status message, let's check for files which have not been pre-loaded.
-                        elif command == "STATUS":
+                        elif command in ["STATUS", "STATUSDELTA"]:
                             extra = message.split(":", 4)
                             if extra[3] != "OKAY":
                                 continue
 
-                            status = json.loads(extra[4])
-                            show_plan = status["show_plan"]
+                            tracker = self.status_trackers[channel]
+                            if command == "STATUS":
+                                tracker.apply_full(json.loads(extra[4]))
+                            else:
+                                delta = json.loads(extra[4])
+                                if "show_plan" not in delta:
+                                    # Still need to keep up with the sequence, but nothing else to do.
+                                    tracker.apply_delta(delta)
+                                    continue
+                                if not tracker.apply_delta(delta):
+                                    # We've missed something, the websocket server will ask for a full status,
+                                    # which we'll also get.
+                                    continue
+
+                            show_plan = tracker.status["show_plan"]
                             item_ids = []
                             for item in show_plan:
-                                item_ids += item["timeslotitemid"]
+                                item_ids.append(item["timeslotitemid"])
 
                             # If the new status update has a different order / list of items,
                             # let's update the show plan we know about
@@ -160,63 +163,112 @@ class FileManager:
         except Exception as e:
             self.logger.log.exception(
                 "Received unexpected exception: {}".format(e))
+        # We're a child process, so nothing will close the connections at exit for us.
+        close_http_pool()
         del self.logger
 
-    # Attempt to preload a file onto disk.
+    # Hands any items without files to the preloader, which downloads them in the background, a few at a time.
+    # Gives whether any have finished preloading since last time.
     def do_preload(self):
-        channel = self.next_channel_preload
-
         # All channels have preloaded all files, do nothing.
         if self.known_channels_preloaded == [True] * self.channel_count:
             return False  # Didn't preload anything
 
-        # Right, let's have a quick check in the status for shows without filenames, to preload them.
-        # Keep an eye on if we downloaded anything.
-        # If we didn't, we know that all items in this channel have been downloaded.
-        downloaded_something = False
-        for i in range(len(self.last_known_show_plan[channel])):
-
-            item_obj = PlanItem(self.last_known_show_plan[channel][i])
-
-            # We've not downloaded this file yet, let's do that.
-            if not item_obj.filename:
-                self.logger.log.info(
-                    "Checking pre-load on channel {}, weight {}: {}".format(
-                        channel, item_obj.weight, item_obj.name
-                    )
-                )
-
-                # Getting the file name will only pull the new file if the file doesn't
-                # already exist, so this is not too inefficient.
-                item_obj.filename, did_download = sync(
-                    self.api.get_filename(item_obj, True)
-                )
-                # Alright, we've done one, now let's give back control to process new statuses etc.
+        finished = self.preloader.get_finished()
+        preloaded_something = False
+        queued = 0
+        for channel in range(self.channel_count):
+            if self.known_channels_preloaded[channel]:
+                continue
 
-                # Save back the resulting item back in regular dict form
-                self.last_known_show_plan[channel][i] = item_obj.__dict__
+            # Keep an eye on if we're waiting for anything.
+            # If we aren't, we know that all items in this channel have been downloaded (or failed).
+            waiting = False
+            for i in range(len(self.last_known_show_plan[channel])):
+                item_obj = PlanItem(self.last_known_show_plan[channel][i])
+                key = media_key(item_obj)
+                if item_obj.filename or not key:
+                    continue
 
-                if did_download:
-                    downloaded_something = True
-                    self.logger.log.info(
-                        "File successfully preloaded: {}".format(
-                            item_obj.filename)
-                    )
-                    break
-                else:
-                    # We didn't download anything this time, file was already loaded.
-                    # Let's try the next one.
+                if key in finished:
+                    # Save back the resulting item back in regular dict form
+                    item_obj.filename = finished[key]
+                    if item_obj.filename:
+                        self.cache.add(key)
+                    self.last_known_show_plan[channel][i] = item_obj.__dict__
+                    preloaded_something = True
                     continue
 
-        # Tell the file manager that this channel is fully downloaded, this is so
-        # it can consider normalising once all channels have files.
-        self.known_channels_preloaded[channel] = not downloaded_something
+                # We've not downloaded this file yet (or the same track in another channel), let's do that.
+                if self.preloader.add(item_obj):
+                    queued += 1
+                waiting = True
 
-        self.next_channel_preload += 1
-        if self.next_channel_preload >= self.channel_count:
-            self.next_channel_preload = 0
+            # Tell the file manager that this channel is fully downloaded, this is so
+            # it can consider normalising once all channels have files.
+            self.known_channels_preloaded[channel] = not waiting
 
-        return downloaded_something
+        if queued:
+            stats = self.preloader.get_stats()
+            self.logger.log.info(
+                "Queued {} file(s) to preload, {} waiting, {} downloading.".format(
+                    queued, stats["queued"], stats["in_flight"]
+                )
+            )
+        if preloaded_something:
+            self.evict_cache()
+        return preloaded_something
+
+    # The files for every item in a loaded plan, which shouldn't be removed from the cache.
+    def _pinned(self):
+        pinned = set()
+        for show_plan in self.last_known_show_plan:
+            for item in show_plan:
+                key = media_key(PlanItem(item))
+                if key:
+                    pinned.add(key)
+        return pinned
+
+    # Removes the least recently used files from the music cache, until it's small enough.
+    def evict_cache(self):
+        pinned = self._pinned()
+        removed = self.cache.evict(pinned)
+        if removed:
+            self.logger.log.info("Removed {} least recently used file(s) from the music cache.".format(removed))
+        stats = self.cache.get_stats()
+        if stats["bytes"] > stats["max_bytes"]:
+            self.logger.log.warning(
+                "Music cache is over its limit, but the {} file(s) in loaded plans can't be removed.".format(
+                    len(pinned)
+                )
+            )
+        self._log_cache_stats()
+
+    def _log_cache_stats(self):
+        stats = self.cache.get_stats()
+        self.logger.log.info(
+            "Music cache: {} file(s), {:.0f} of {:.0f}MB, {:.0%} hit rate ({} hits, {} misses).".format(
+                stats["files"],
+                stats["bytes"] / 1024 / 1024,
+                stats["max_bytes"] / 1024 / 1024,
+                stats["hit_rate"],
+                stats["hits"],
+                stats["misses"],
+            )
+        )
+
+    # Called (from the config watcher thread) when the normalisation config changes.
+    def _config_handler(self, changes: StateChanges):
+        self._set_normalisation_mode(changes["normalisation_mode"][1])
+
+    def _set_normalisation_mode(self, normalisation_mode: str):
+        if normalisation_mode == self.normalisation_mode:
+            return
+        self.normalisation_mode = normalisation_mode
+        if self.normalisation_mode != "on":
+            self.logger.log.info("Normalisation is disabled.")
+        else:
+            self.logger.log.info("Normalisation is enabled.")
 
     # If we've preloaded everything, get to work normalising tracks before playback.
     def do_normalise(self):
@@ -246,6 +298,15 @@ class FileManager:
                     "Somehow got empty filename when all channels are preloaded."
                 )
                 continue  # Try next song.
+
+            # If it's a file we downloaded, the media index knows if it's been normalised, without looking.
+            key = media_key(item_obj)
+            media = self.cache.index.get(key) if key else None
+            if media and filename in (media.filename, media.normalised_filename):
+                if media.normalised_filename:
+                    item_obj.filename = media.normalised_filename
+                    self.last_known_show_plan[channel][i] = item_obj.__dict__
+                    continue
             elif not os.path.isfile(filename):
                 self.logger.log.exception(
                     "Filename for normalisation does not exist. This is bad."
@@ -259,7 +320,9 @@ class FileManager:
                     "Normalising on channel {}: {}".format(channel, filename)
                 )
                 # This will return immediately if we already have a normalised file.
-                item_obj.filename = generate_normalised_file(filename)
+                item_obj.filename, loudness = normalise_file(filename)
+                if media:
+                    self.cache.index.set_normalised(media.key, item_obj.filename, loudness)
                 # TODO Hacky
                 self.last_known_show_plan[channel][i] = item_obj.__dict__
                 normalised_something = True
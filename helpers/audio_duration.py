@@ -0,0 +1,91 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Audio Duration Probing
+
+    Works out how long audio files are from their headers alone, without decoding them.
+    WAV files are read here, MP3 (Xing / VBRI headers, or from the frames), OGG and FLAC go to mutagen.
+    Results are remembered until the file changes.
+
+    Doesn't need the mixer, so any process can use it.
+
+    Date:
+        October 2026
+"""
+import os
+import struct
+from functools import lru_cache
+from typing import BinaryIO, Optional
+
+import mutagen
+from mutagen.mp3 import MP3
+
+# How many files' durations to remember.
+DURATION_CACHE_SIZE = 1024
+
+# RIFF data sizes this big mean the writer didn't know (or couldn't fit) the size, so it's the rest of the file.
+_RIFF_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+# Returns the duration (secs) of an audio file, or None if it can't be worked out.
+def get_duration(filename: str) -> Optional[float]:
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return _probe(os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
+
+# The size and modified time are only here so a changed file isn't given the remembered duration.
+@lru_cache(maxsize=DURATION_CACHE_SIZE)
+def _probe(filename: str, size: int, mtime_ns: int) -> Optional[float]:
+    try:
+        with open(filename, "rb") as file:
+            header = file.read(12)
+            if header[:4] in (b"RIFF", b"RF64") and header[8:12] == b"WAVE":
+                return _wav_duration(file, size)
+
+        if filename.lower().endswith(".mp3"):
+            return MP3(filename).info.length
+
+        audio = mutagen.File(filename)
+        if audio is not None and audio.info and audio.info.length:
+            return audio.info.length
+    except Exception:
+        pass
+    return None
+
+
+# Reads the duration from the WAV "fmt " and "data" chunk headers. file must be just after the RIFF header.
+def _wav_duration(file: BinaryIO, file_size: int) -> Optional[float]:
+    byte_rate: Optional[int] = None
+    data_size: Optional[int] = None
+    # RF64 (for WAVs over 4GB) keeps the real data size in a "ds64" chunk.
+    ds64_data_size: Optional[int] = None
+
+    while byte_rate is None or data_size is None:
+        chunk_header = file.read(8)
+        if len(chunk_header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+        chunk_start = file.tell()
+
+        if chunk_id == b"fmt ":
+            # Format tag, channels, sample rate, then the bytes per second we want.
+            byte_rate = struct.unpack("<HHII", file.read(12))[3]
+        elif chunk_id == b"ds64":
+            ds64_data_size = struct.unpack("<QQ", file.read(16))[1]
+        elif chunk_id == b"data":
+            if chunk_size == _RIFF_UNKNOWN_SIZE:
+                chunk_size = ds64_data_size or (file_size - chunk_start)
+            # Don't trust it past the end of the file (ie it's still being recorded / truncated).
+            data_size = min(chunk_size, file_size - chunk_start)
+
+        # Chunks are padded to an even size.
+        file.seek(chunk_start + chunk_size + (chunk_size % 2))
+
+    if not byte_rate:
+        return None
+    return data_size / byte_rate
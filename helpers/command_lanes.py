@@ -0,0 +1,118 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Player Command Lanes
+
+    Players used to run their commands strictly in the order they came in, so a STOP
+    could be stuck behind a pile of slow show plan edits, and a presenter scrubbing
+    through an item had every single SEEK run in turn.
+
+    Commands waiting to be run are now sorted into lanes:
+        Transport (PLAY, PAUSE, STOP etc) - Jump ahead of any show plan edits waiting.
+        Plan (ADD, REMOVE, GETPLAN etc) - Run in order, after any transport commands.
+        Everything else (LOAD, SEEK, STATUS etc) - Stays in order with both of the above,
+            as it may depend on what came before it (ie loading an item that's just been added).
+    A run of the same SEEK or LOAD is coalesced, only the newest is run. The ones it replaced
+    are given to the player with it, so they can be answered too.
+
+    Date:
+        October 2026
+"""
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+# TODO ENUM
+TRANSPORT_COMMANDS = ["PLAY", "PAUSE", "PLAYPAUSE", "UNPAUSE", "STOP"]
+PLAN_COMMANDS = ["ADD", "REMOVE", "CLEAR", "GETPLAN", "SETMARKER", "SETPLAYED", "RESETPLAYED"]
+# Commands where only the newest of a run of them matters.
+COALESCED_COMMANDS = ["SEEK", "LOAD"]
+
+# A (source, message) pair, as sent to the player.
+Message = Tuple[str, str]
+# A command to run: (source, message, the older messages it replaced)
+Command = Tuple[str, str, List[Message]]
+
+
+# Commands that must run in order with everything around them start a new segment, followed by
+# the transport / plan commands that came in after. Those can be reordered amongst themselves.
+class _Segment:
+    __slots__ = ("head", "transport", "plan")
+
+    head: Optional[Command]
+    transport: Deque[Command]
+    plan: Deque[Command]
+
+    def __init__(self, head: Optional[Command] = None):
+        self.head = head
+        self.transport = deque()
+        self.plan = deque()
+
+
+class CommandLanes:
+    # How many commands have been replaced by newer ones.
+    coalesced: int
+    # How many transport commands have jumped ahead of plan edits.
+    prioritised: int
+
+    def __init__(self):
+        self.coalesced = 0
+        self.prioritised = 0
+        self.__segments: Deque[_Segment] = deque()
+        self.__length = 0
+
+    def __len__(self) -> int:
+        return self.__length
+
+    def add(self, source: str, message: str):
+        command_type = message.split(":")[0]
+        last = self.__segments[-1] if self.__segments else None
+
+        if command_type in TRANSPORT_COMMANDS or command_type in PLAN_COMMANDS:
+            if not last:
+                last = _Segment()
+                self.__segments.append(last)
+            if command_type in TRANSPORT_COMMANDS:
+                if last.plan:
+                    self.prioritised += 1
+                last.transport.append((source, message, []))
+            else:
+                last.plan.append((source, message, []))
+            self.__length += 1
+            return
+
+        # Replace the last command, if it's the same and nothing else has come in since.
+        if (
+            command_type in COALESCED_COMMANDS
+            and last
+            and last.head
+            and not last.transport
+            and not last.plan
+            and last.head[1].split(":")[0] == command_type
+        ):
+            old_source, old_message, replaced = last.head
+            last.head = (source, message, replaced + [(old_source, old_message)])
+            self.coalesced += 1
+            return
+
+        self.__segments.append(_Segment((source, message, [])))
+        self.__length += 1
+
+    # Gives the next command to run, or None if there aren't any.
+    def next(self) -> Optional[Command]:
+        while self.__segments:
+            segment = self.__segments[0]
+            if segment.head:
+                command = segment.head
+                segment.head = None
+            elif segment.transport:
+                command = segment.transport.popleft()
+            elif segment.plan:
+                command = segment.plan.popleft()
+            else:
+                self.__segments.popleft()
+                continue
+            self.__length -= 1
+            return command
+        return None
@@ -0,0 +1,200 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Download Lanes
+
+    Downloads for an item a presenter is loading right now (foreground) used to share the
+    studio's connection equally with the file manager preloading the rest of the show
+    (background), so the one that mattered could be stuck behind lots that didn't.
+
+    Downloads now go in one of two lanes:
+        Foreground (the players loading) - Go as fast as they can, and whilst any are going
+            (in any process), background downloads are paused.
+        Background (preloading) - Limited to the server's preload_bandwidth_kbps (if set),
+            and wait for any foreground downloads to finish.
+    Foreground downloads say they're going by touching a shared file every so often, so if
+    a player dies mid-download, the background ones only wait a moment longer.
+
+    A player can need a file the file manager is already preloading. Only one process downloads
+    a file at once, so the player waits for it, touching a file for that file (its "wanted" file)
+    as it does. A background download that sees its file is wanted carries on as a foreground one.
+
+    Date:
+        October 2026
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from helpers.os_environment import resolve_music_tmp_path
+
+# The file (in music-tmp) foreground downloads touch as they go.
+FOREGROUND_FILE_PATH = "locks/foreground"
+# The file foreground downloads waiting for someone else's download of the same file touch. ({} is its key.)
+WANTED_FILE_PATH = "locks/{}.wanted"
+# How often (secs) foreground downloads touch them.
+FOREGROUND_HEARTBEAT_S = 0.25
+# How long (secs) since it was last touched that foreground downloads are still thought to be going.
+FOREGROUND_HOLD_S = 2 * FOREGROUND_HEARTBEAT_S
+# How often (secs) background downloads check on the foreground ones.
+BACKGROUND_POLL_S = 0.05
+# How much (secs worth) background downloads can take in one go, after they've been idle.
+BACKGROUND_BURST_S = 0.1
+
+
+# Hands out bytes at a fixed rate, with a bit of burst.
+class TokenBucket:
+    rate: float
+
+    # Rate (bytes / sec), 0 for unlimited.
+    def __init__(self, rate: float = 0):
+        self.rate = rate
+        self.__tokens = 0.0
+        self.__updated = time.monotonic()
+
+    def set_rate(self, rate: float):
+        self.rate = rate
+
+    # Waits until the bytes can be had. Gives how long (secs) it waited.
+    async def take(self, count: int) -> float:
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self.__tokens = min(self.__tokens + (now - self.__updated) * self.rate, self.rate * BACKGROUND_BURST_S)
+        self.__updated = now
+        # Go into debt for them, so it's paid off before the next can have any.
+        self.__tokens -= count
+        if self.__tokens >= 0:
+            return 0.0
+        wait_s = -self.__tokens / self.rate
+        await asyncio.sleep(wait_s)
+        return wait_s
+
+
+class DownloadLanes:
+    # Bytes / sec background downloads (all of them, in this process) are limited to, 0 for unlimited.
+    background_limit: TokenBucket
+
+    def __init__(self):
+        self.background_limit = TokenBucket()
+        self.__foreground_filename = resolve_music_tmp_path(FOREGROUND_FILE_PATH)
+        self.__last_heartbeat = 0.0
+        self.__last_checked = 0.0
+        self.__foreground_active = False
+
+        self.__foreground_downloads = 0
+        self.__foreground_wait_s = 0.0
+        self.__foreground_max_wait_s = 0.0
+        self.__background_paused_s = 0.0
+        self.__background_limited_s = 0.0
+        self.__background_promoted_bytes = 0
+
+    # Says a foreground download is going. Force to say so now, rather than only every so often.
+    def foreground_heartbeat(self, force: bool = False):
+        now = time.time()
+        if not force and now - self.__last_heartbeat < FOREGROUND_HEARTBEAT_S:
+            return
+        self.__last_heartbeat = now
+        _touch(self.__foreground_filename, now)
+
+    # Whether any foreground downloads (in any process) are going.
+    def foreground_active(self) -> bool:
+        now = time.time()
+        if now - self.__last_checked >= BACKGROUND_POLL_S:
+            self.__last_checked = now
+            self.__foreground_active = _touched_since(self.__foreground_filename, now - FOREGROUND_HOLD_S)
+        return self.__foreground_active
+
+    # Says a foreground download is waiting for someone else's download of the file (key).
+    # Call every so often whilst waiting, and want_done() once it's finished.
+    def want(self, key: str):
+        _touch(self.__wanted_filename(key), time.time())
+
+    def want_done(self, key: str):
+        try:
+            os.remove(self.__wanted_filename(key))
+        except OSError:
+            pass
+
+    # Whether a foreground download (in any process) is waiting for the download of the file (key).
+    def wanted(self, key: str) -> bool:
+        return _touched_since(self.__wanted_filename(key), time.time() - FOREGROUND_HOLD_S)
+
+    @staticmethod
+    def __wanted_filename(key: str) -> str:
+        return resolve_music_tmp_path(WANTED_FILE_PATH.format(key))
+
+    # Called as a download (of the file key, if given) starts, waiting if it's a background one
+    # and there are foreground ones going.
+    async def start(self, background: bool, key: Optional[str] = None):
+        if not background or (key and self.wanted(key)):
+            self.foreground_heartbeat(force=True)
+            return
+        await self.__wait_for_foreground()
+
+    # Called as each chunk of a download (of the file key, if given) is read,
+    # holding it up if it's a background one that needs to be.
+    async def chunk(self, background: bool, count: int, key: Optional[str] = None):
+        if background and key and self.wanted(key):
+            # Someone needs it right now, so it's not a background download any more.
+            self.__background_promoted_bytes += count
+            background = False
+        if not background:
+            self.foreground_heartbeat()
+            return
+        await self.__wait_for_foreground()
+        self.__background_limited_s += await self.background_limit.take(count)
+
+    async def __wait_for_foreground(self):
+        if not self.foreground_active():
+            return
+        start = time.time()
+        while self.foreground_active():
+            await asyncio.sleep(BACKGROUND_POLL_S)
+        self.__background_paused_s += time.time() - start
+
+    # Records how long (secs) someone waited for a foreground download.
+    def foreground_waited(self, wait_s: float):
+        self.__foreground_downloads += 1
+        self.__foreground_wait_s += wait_s
+        self.__foreground_max_wait_s = max(self.__foreground_max_wait_s, wait_s)
+
+    # How long (secs) foreground downloads have been waited for (mean / max),
+    # and background ones have been paused for foreground ones, or held to their bandwidth limit,
+    # and how much (bytes) of background ones went as foreground ones because someone was waiting for them.
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            "foreground_downloads": self.__foreground_downloads,
+            "foreground_wait_mean_s": (
+                self.__foreground_wait_s / self.__foreground_downloads if self.__foreground_downloads else 0.0
+            ),
+            "foreground_wait_max_s": self.__foreground_max_wait_s,
+            "background_paused_s": self.__background_paused_s,
+            "background_limited_s": self.__background_limited_s,
+            "background_promoted_bytes": self.__background_promoted_bytes,
+        }
+
+
+def _touch(filename: str, now: float):
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "a"):
+            pass
+        os.utime(filename, (now, now))
+    except OSError:
+        pass
+
+
+def _touched_since(filename: str, since: float) -> bool:
+    try:
+        return os.path.getmtime(filename) >= since
+    except OSError:
+        return False
+
+
+# Bytes / sec for a limit in KB / sec (None / 0 for unlimited).
+def kbps_to_rate(kbps: Optional[float]) -> float:
+    return float(kbps) * 1024 if kbps else 0.0
@@ -0,0 +1,148 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    File Lock
+
+    A lock shared between all of BAPSicle's processes (the players, the file manager etc),
+    using the OS's locking on a lock file. Unlike a marker file, the OS lets the lock go
+    if the process holding it dies, so nobody is left waiting for it.
+    Whoever holds it writes their PID in the lock file, so others can say who they're waiting for.
+    Whoever holds it can also remove the lock file when it's done with it. Anyone that was waiting
+    on the removed file notices, and starts again with a new one.
+
+    Date:
+        October 2026
+"""
+import asyncio
+import os
+import time
+from typing import Callable, Optional
+
+from helpers.os_environment import isWindows
+
+if isWindows():
+    import msvcrt
+else:
+    import fcntl
+
+# How often (secs) to try again for a lock someone else has.
+FILE_LOCK_POLL_S = 0.05
+
+
+class FileLock:
+    filename: str
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.__file = None
+
+    @property
+    def locked(self) -> bool:
+        return self.__file is not None
+
+    # Takes the lock if nobody else has it. Returns whether we've got it.
+    def try_acquire(self) -> bool:
+        if self.__file:
+            raise RuntimeError("Already holding lock {}.".format(self.filename))
+
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        file = open(self.filename, "a+b")
+        try:
+            if isWindows():
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        try:
+            removed = not os.path.samestat(os.fstat(file.fileno()), os.stat(self.filename))
+        except OSError:
+            removed = True
+        if removed:
+            # Whoever had it removed the file we've locked, so it's not the lock anyone else is using any more.
+            self.__unlock(file)
+            file.close()
+            return False
+        self.__file = file
+        try:
+            # (On Windows, the locked byte is the first, so it's written by us, and can't be read by others.)
+            file.seek(0)
+            file.truncate()
+            file.write(str(os.getpid()).encode())
+            file.flush()
+        except OSError:
+            pass
+        return True
+
+    # Gives the PID of the process holding the lock (or that last held it), if it can be read.
+    def owner(self) -> Optional[int]:
+        try:
+            with open(self.filename, "rb") as file:
+                return int(file.read())
+        except (OSError, ValueError):
+            return None
+
+    # Waits (up to timeout secs, or forever if None) for the lock. Returns whether we've got it.
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        give_up_at = None if timeout is None else time.time() + timeout
+        while not self.try_acquire():
+            if give_up_at is not None and time.time() >= give_up_at:
+                return False
+            time.sleep(FILE_LOCK_POLL_S)
+        return True
+
+    # As acquire(), but lets anything else on the event loop carry on whilst waiting.
+    # Waiting (if given) is called every time it's tried again.
+    async def acquire_async(
+        self, timeout: Optional[float] = None, waiting: Optional[Callable[[], None]] = None
+    ) -> bool:
+        give_up_at = None if timeout is None else time.time() + timeout
+        while not self.try_acquire():
+            if give_up_at is not None and time.time() >= give_up_at:
+                return False
+            if waiting:
+                waiting()
+            await asyncio.sleep(FILE_LOCK_POLL_S)
+        return True
+
+    # Lets go of the lock. If remove, the lock file is removed too (ie when there won't be anything to lock for a while).
+    def release(self, remove: bool = False):
+        if not self.__file:
+            return
+        try:
+            if remove and not isWindows():
+                # Whilst we've still got it, so nobody else can have it in the meantime.
+                self.__remove()
+            self.__unlock(self.__file)
+        finally:
+            self.__file.close()
+            self.__file = None
+        if remove and isWindows():
+            # Windows doesn't let open files be removed, so it's only tried once we've let go.
+            # If anyone's opened it in the meantime, it's left there.
+            self.__remove()
+
+    def __remove(self):
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    @staticmethod
+    def __unlock(file):
+        if isWindows():
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
@@ -0,0 +1,135 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    HTTP Connection Pool
+
+    Every request to MyRadio used to open its own connection (and do its own TLS handshake
+    and DNS lookup), in a new aiohttp session, or with requests for the sync calls.
+
+    Each process now has one pool of keep-alive connections, in one aiohttp session running on
+    its own event loop thread. Requests from anywhere in the process (the player's threads,
+    sanic's event loop etc) are run on it, so they all share its connections and DNS cache.
+
+    Date:
+        October 2026
+"""
+import asyncio
+import atexit
+import os
+import ssl
+from concurrent.futures import Future
+from threading import Lock, Thread, current_thread
+from typing import Any, Coroutine, List, Optional, TypeVar
+
+import aiohttp
+
+# Most connections open at once, any more requests wait for one to be free.
+HTTP_POOL_MAX_CONNECTIONS = 8
+# How long (secs) an idle connection is kept open for the next request.
+HTTP_POOL_KEEPALIVE_S = 30
+# How long (secs) a DNS lookup is remembered.
+HTTP_POOL_DNS_CACHE_S = 300
+# How long (secs) to give requests still going to finish when closing.
+HTTP_POOL_CLOSE_TIMEOUT_S = 2
+
+T = TypeVar("T")
+
+
+class HTTPPool:
+    # SSL context to check servers with, the default (system CAs) if None.
+    def __init__(self, ssl_context: Optional[ssl.SSLContext] = None):
+        self.__ssl_context = ssl_context
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = Thread(target=self.__loop.run_forever, name="HTTP Pool", daemon=True)
+        self.__thread.start()
+        # The session has to be made on the loop it's used on.
+        self.__session: aiohttp.ClientSession = self.run(self.__create_session())
+
+    async def __create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_MAX_CONNECTIONS,
+            keepalive_timeout=HTTP_POOL_KEEPALIVE_S,
+            ttl_dns_cache=HTTP_POOL_DNS_CACHE_S,
+            ssl=self.__ssl_context,
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    # Only use this from coroutines running on the pool (see run() / run_async()).
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self.__session
+
+    @property
+    def closed(self) -> bool:
+        return not self.__loop.is_running()
+
+    # Runs the coroutine on the pool, waiting (blocking) for its result. For code that isn't async.
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        if current_thread() is self.__thread:
+            coro.close()
+            raise RuntimeError("Can't block on the HTTP pool from the pool itself, await run_async() instead.")
+        return asyncio.run_coroutine_threadsafe(coro, self.__loop).result()
+
+    # Starts the coroutine on the pool, without waiting for it.
+    def submit(self, coro: Coroutine[Any, Any, T]) -> "Future[T]":
+        return asyncio.run_coroutine_threadsafe(coro, self.__loop)
+
+    # Runs the coroutine on the pool, from any event loop (including the pool's own).
+    async def run_async(self, coro: Coroutine[Any, Any, T]) -> T:
+        if asyncio.get_running_loop() is self.__loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.__loop))
+
+    # Closes the connections, and stops the pool.
+    def close(self):
+        if self.closed:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.__session.close(), self.__loop).result(
+                timeout=HTTP_POOL_CLOSE_TIMEOUT_S
+            )
+        except Exception:
+            # We're going anyway, the OS will tidy up whatever's left.
+            pass
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join(timeout=HTTP_POOL_CLOSE_TIMEOUT_S)
+        if not self.__thread.is_alive():
+            self.__loop.close()
+
+
+_pool: Optional[HTTPPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = Lock()
+# Pools that came with a fork. They're left alone (not closed), as their connections are still the parent's.
+_inherited_pools: List[HTTPPool] = []
+
+
+# Gives this process's pool, starting it if need be.
+# Processes forked from one with a pool get their own, as the pool's thread doesn't come with them.
+def get_http_pool() -> HTTPPool:
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid != os.getpid():
+            _inherited_pools.append(_pool)
+            _pool = None
+        if _pool is None or _pool.closed:
+            _pool = HTTPPool()
+            _pool_pid = os.getpid()
+        return _pool
+
+
+# Closes this process's pool (if it has one). Done automatically at exit, but not for processes that os._exit().
+def close_http_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            if _pool_pid == os.getpid():
+                _pool.close()
+            else:
+                _inherited_pools.append(_pool)
+        _pool = None
+
+
+atexit.register(close_http_pool)
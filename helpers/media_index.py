@@ -0,0 +1,243 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Media Index
+
+    What we know about the files in music-tmp used to be worked out again whenever it was
+    needed, by going to the disk: whether the file's there, whether there's a normalised
+    version of it (and whether that's there), how long it is. What little was remembered was
+    only remembered by one process, until it restarted.
+
+    The media index is an SQLite database (music-tmp/media.db), with a row for each downloaded
+    file, keyed by its type and ID (ie "track-1234"): where it is, its size, SHA-1 and duration,
+    and if it's been normalised, the normalised version and how loud the original was.
+    Files are added by whichever process downloads them, and the music cache (see MusicCache)
+    keeps it in step with what's on disk. Every process can read it at the same time.
+
+    Date:
+        October 2026
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from threading import local
+from typing import Dict, Optional
+
+from baps_types.plan import PlanItem
+from helpers.audio_duration import get_duration
+from helpers.os_environment import resolve_music_tmp_path
+
+MEDIA_INDEX_FILENAME = "media.db"
+# Bump when the tables change. It's only a record of what's on disk, so an old one is just started again.
+MEDIA_INDEX_VERSION = 2
+# How long (secs) to wait for another process to finish writing, before giving up.
+MEDIA_INDEX_TIMEOUT_S = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    key TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL,
+    duration REAL,
+    normalised_filename TEXT,
+    normalised_size INTEGER,
+    loudness REAL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_filename ON media (filename);
+CREATE INDEX IF NOT EXISTS media_normalised_filename ON media (normalised_filename);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_COLUMNS = (
+    "key",
+    "filename",
+    "size",
+    "mtime_ns",
+    "sha1",
+    "duration",
+    "normalised_filename",
+    "normalised_size",
+    "loudness",
+    "last_used",
+)
+_SELECT = "SELECT {} FROM media".format(", ".join(_COLUMNS))
+
+
+# The key for an item's file, ie "track-1234", or None if it's not one from MyRadio.
+def media_key(item: PlanItem) -> Optional[str]:
+    if item.trackid:
+        return "track-{}".format(item.trackid)
+    if item.managedid:
+        return "managed-{}".format(item.managedid)
+    return None
+
+
+def file_sha1(filename: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+# What we know about a file.
+class MediaFile:
+    __slots__ = _COLUMNS
+
+    key: str
+    filename: str
+    size: int
+    mtime_ns: int
+    sha1: str
+    # Length of the audio (secs), if it could be worked out.
+    duration: Optional[float]
+    # The normalised version, if there is one.
+    normalised_filename: Optional[str]
+    normalised_size: Optional[int]
+    # How loud (dBFS) the original is, if it's been normalised.
+    loudness: Optional[float]
+    last_used: float
+
+    def __init__(self, *values):
+        for column, value in zip(_COLUMNS, values):
+            setattr(self, column, value)
+
+    # The file to play, the normalised version if there is one.
+    @property
+    def best_filename(self) -> str:
+        return self.normalised_filename or self.filename
+
+
+class MediaIndex:
+    path: str
+
+    # Path is the folder the database lives in, music-tmp unless given.
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or resolve_music_tmp_path()
+        self.__filename = os.path.join(self.path, MEDIA_INDEX_FILENAME)
+        # SQLite connections can't be shared between threads (or processes), so each gets its own.
+        self.__local = local()
+
+    def __connection(self) -> sqlite3.Connection:
+        if getattr(self.__local, "pid", None) != os.getpid():
+            os.makedirs(self.path, exist_ok=True)
+            # (Autocommit, every statement is its own transaction.)
+            connection = sqlite3.connect(self.__filename, timeout=MEDIA_INDEX_TIMEOUT_S, isolation_level=None)
+            # So readers don't hold up writers, or the other way round.
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            if connection.execute("PRAGMA user_version").fetchone()[0] != MEDIA_INDEX_VERSION:
+                connection.executescript(
+                    "DROP TABLE IF EXISTS media; DROP TABLE IF EXISTS counters;"
+                    + _SCHEMA
+                    + "PRAGMA user_version = {};".format(MEDIA_INDEX_VERSION)
+                )
+            self.__local.connection = connection
+            self.__local.pid = os.getpid()
+        return self.__local.connection
+
+    # Closes this thread's connection (others are closed when their thread goes).
+    def close(self):
+        if getattr(self.__local, "pid", None) == os.getpid():
+            self.__local.connection.close()
+        self.__local.pid = None
+
+    def get(self, key: str) -> Optional[MediaFile]:
+        row = self.__connection().execute(_SELECT + " WHERE key = ?", (key,)).fetchone()
+        return MediaFile(*row) if row else None
+
+    # The file that filename is (or is the normalised version of), if it's in the index.
+    def find(self, filename: str) -> Optional[MediaFile]:
+        row = self.__connection().execute(
+            _SELECT + " WHERE filename = ? OR normalised_filename = ?", (filename, filename)
+        ).fetchone()
+        return MediaFile(*row) if row else None
+
+    def get_all(self) -> Dict[str, MediaFile]:
+        return {row[0]: MediaFile(*row) for row in self.__connection().execute(_SELECT)}
+
+    # Records a file that's been downloaded (or found), giving what we now know about it.
+    # If it hasn't changed, it's just marked as used. If its contents have, the normalised version
+    # (made from the old contents) is removed. sha1 is the file's SHA-1 if it's known (ie from downloading it).
+    def add(self, key: str, filename: str, sha1: Optional[str] = None) -> Optional[MediaFile]:
+        try:
+            stat = os.stat(filename)
+            old = self.get(key)
+            if old and old.filename == filename and old.size == stat.st_size and old.mtime_ns == stat.st_mtime_ns:
+                self.touch(key)
+                return self.get(key)
+            sha1 = sha1 or file_sha1(filename)
+        except OSError:
+            return None
+
+        normalised_filename = normalised_size = loudness = duration = None
+        if old and old.sha1 == sha1:
+            normalised_filename, normalised_size, loudness = old.normalised_filename, old.normalised_size, old.loudness
+            duration = old.duration
+        else:
+            duration = get_duration(filename)
+            if old and old.normalised_filename:
+                # Made from what used to be there, so no good now.
+                try:
+                    os.remove(old.normalised_filename)
+                except OSError:
+                    pass
+
+        self.__connection().execute(
+            "INSERT OR REPLACE INTO media ({}) VALUES ({})".format(", ".join(_COLUMNS), ", ".join("?" * len(_COLUMNS))),
+            (
+                key,
+                filename,
+                stat.st_size,
+                stat.st_mtime_ns,
+                sha1,
+                duration,
+                normalised_filename,
+                normalised_size,
+                loudness,
+                time.time(),
+            ),
+        )
+        return self.get(key)
+
+    # Records the normalised version of a file (None if it's gone), and how loud (dBFS) the original is, if known.
+    def set_normalised(self, key: str, normalised_filename: Optional[str], loudness: Optional[float] = None):
+        normalised_size = None
+        if normalised_filename:
+            try:
+                normalised_size = os.path.getsize(normalised_filename)
+            except OSError:
+                normalised_filename = None
+        self.__connection().execute(
+            "UPDATE media SET normalised_filename = ?, normalised_size = ?, loudness = COALESCE(?, loudness) "
+            "WHERE key = ?",
+            (normalised_filename, normalised_size, loudness, key),
+        )
+
+    def set_duration(self, key: str, duration: float):
+        self.__connection().execute("UPDATE media SET duration = ? WHERE key = ?", (duration, key))
+
+    # Marks a file as used (ie for the music cache to keep it over ones that haven't been).
+    def touch(self, key: str):
+        self.__connection().execute("UPDATE media SET last_used = ? WHERE key = ?", (time.time(), key))
+
+    def remove(self, key: str):
+        self.__connection().execute("DELETE FROM media WHERE key = ?", (key,))
+
+    # Adds to one of the counters (ie the music cache's hits / misses).
+    def count(self, name: str, by: int = 1):
+        connection = self.__connection()
+        connection.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", (name,))
+        connection.execute("UPDATE counters SET value = value + ? WHERE name = ?", (by, name))
+
+    def get_counters(self) -> Dict[str, int]:
+        return dict(self.__connection().execute("SELECT name, value FROM counters").fetchall())
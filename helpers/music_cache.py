@@ -0,0 +1,186 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Music Cache
+
+    Every new show plan used to empty music-tmp, so the jingles, beds and playlist tracks that
+    are in nearly every show were downloaded again for each one.
+
+    Downloaded files are now kept between shows (and restarts), up to a size limit (the server's
+    music_cache_max_mb). Once it's over, the least recently used files are removed, apart from
+    anything in a plan that's loaded. What's in the cache (each file's SHA-1, size, when it was last
+    used, and its normalised version) is kept in the media index (see MediaIndex), along with the
+    hit rate. Normalised versions are picked up from music-tmp as they're made, and removed along
+    with their file. If a file's contents change (ie it's redownloaded), the normalised version
+    made from the old contents is removed.
+
+    Date:
+        October 2026
+"""
+import os
+import re
+import time
+from typing import Dict, Iterable, Optional
+
+from helpers.media_index import MediaIndex
+from helpers.file_lock import FileLock
+from helpers.myradio_api import DOWNLOAD_LOCK_PATH, PARTIAL_META_SUFFIX, PARTIAL_SUFFIX
+from helpers.os_environment import resolve_music_tmp_path
+
+# The most (MB) the files can take up, unless told otherwise. ~70 hours of 128kbps audio.
+MUSIC_CACHE_MAX_MB = 4096
+# How long (secs) an unfinished download is kept for (to be carried on with), before it's removed.
+MUSIC_CACHE_PARTIAL_MAX_AGE_S = 24 * 60 * 60
+
+# The files we look after, ie track-1234.mp3, and their normalised versions, ie track-1234-normalised.mp3.
+_FILE_PATTERN = re.compile(r"^((?:track|managed)-\d+)\.mp3$")
+_NORMALISED_PATTERN = re.compile(r"^((?:track|managed)-\d+)-normalised\.mp3$")
+# Their download locks, ie locks/track-1234.lock.
+_LOCK_PATTERN = re.compile(r"^(?:track|managed)-\d+\.lock$")
+
+
+# Files are known by their key (see media_key()), ie track-1234.
+# They live in music-tmp, unless given another path. (Anything in folders inside it isn't ours.)
+class MusicCache:
+    path: str
+    max_bytes: int
+    index: MediaIndex
+
+    def __init__(
+        self,
+        max_bytes: int = MUSIC_CACHE_MAX_MB * 1024 * 1024,
+        path: Optional[str] = None,
+        index: Optional[MediaIndex] = None,
+    ):
+        self.path = path or resolve_music_tmp_path()
+        self.max_bytes = max_bytes
+        self.index = index or MediaIndex(self.path)
+
+    def __filename(self, key: str) -> str:
+        return os.path.join(self.path, "{}.mp3".format(key))
+
+    # Gives the file for the key if we've got it (marking it as used), else None.
+    # Either way, it counts towards the hit rate, so only ask once for each file in a show.
+    def get(self, key: str) -> Optional[str]:
+        media = self.index.get(key)
+        self.index.count("hits" if media else "misses")
+        if not media:
+            return None
+        self.index.touch(key)
+        return media.filename
+
+    # Adds a file that's been downloaded (or marks it as used, if we've already got it).
+    def add(self, key: str):
+        self.index.add(key, self.__filename(key))
+
+    # Catches up with what's in music-tmp: picks up files (and normalised versions) the index doesn't know about
+    # (ie from before there was one), forgets about ones that have gone, and removes unfinished downloads
+    # that nobody's carried on with, and download locks nobody's holding.
+    def sync(self):
+        try:
+            entries = list(os.scandir(self.path))
+        except OSError:
+            return
+        self.__remove_locks()
+        now = time.time()
+        known = self.index.get_all()
+        seen = set()
+        normalised: Dict[str, str] = {}
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            match = _FILE_PATTERN.match(entry.name)
+            if match:
+                key = match.group(1)
+                seen.add(key)
+                stat = entry.stat()
+                media = known.get(key)
+                if not media or media.size != stat.st_size or media.mtime_ns != stat.st_mtime_ns:
+                    self.index.add(key, entry.path)
+                continue
+            match = _NORMALISED_PATTERN.match(entry.name)
+            if match:
+                normalised[match.group(1)] = entry.path
+                continue
+            if entry.name.endswith(PARTIAL_SUFFIX) or entry.name.endswith(PARTIAL_SUFFIX + PARTIAL_META_SUFFIX):
+                if now - entry.stat().st_mtime > MUSIC_CACHE_PARTIAL_MAX_AGE_S:
+                    self.__remove_file(entry.path)
+
+        for key in known:
+            if key not in seen:
+                self.index.remove(key)
+
+        for key, filename in normalised.items():
+            if key not in seen:
+                # Nothing to have made it from, so it could well be out of date.
+                self.__remove_file(filename)
+            elif not known.get(key) or known[key].normalised_filename != filename:
+                self.index.set_normalised(key, filename)
+
+        for key, media in known.items():
+            if key in seen and media.normalised_filename and key not in normalised:
+                self.index.set_normalised(key, None)
+
+    # Removes the least recently used files (and their normalised versions), apart from pinned ones
+    # (ie those in a loaded plan), until it's all small enough. Gives how many were removed.
+    def evict(self, pinned: Iterable[str] = ()) -> int:
+        self.sync()
+        pinned = set(pinned)
+        files = self.index.get_all()
+        total = sum(media.size + (media.normalised_size or 0) for media in files.values())
+        removed = 0
+        for media in sorted(files.values(), key=lambda media: media.last_used):
+            if total <= self.max_bytes:
+                break
+            if media.key in pinned:
+                continue
+            if media.normalised_filename and self.__remove_file(media.normalised_filename):
+                total -= media.normalised_size or 0
+                self.index.set_normalised(media.key, None)
+            if not self.__remove_file(media.filename):
+                # Probably open in a player on Windows, it can go next time.
+                continue
+            self.index.remove(media.key)
+            total -= media.size
+            removed += 1
+        return removed
+
+    # Download locks are removed once the download's finished, but not if the downloader died (or someone else
+    # had it open), so they'd pile up, one for every file ever downloaded.
+    def __remove_locks(self):
+        try:
+            entries = list(os.scandir(os.path.join(self.path, DOWNLOAD_LOCK_PATH)))
+        except OSError:
+            return
+        for entry in entries:
+            if _LOCK_PATTERN.match(entry.name):
+                lock = FileLock(entry.path)
+                if lock.try_acquire():
+                    lock.release(remove=True)
+
+    @staticmethod
+    def __remove_file(filename: str) -> bool:
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        return True
+
+    # How many files (and bytes, including normalised versions) there are, and how many times we've had them when asked.
+    def get_stats(self) -> Dict[str, float]:
+        files = self.index.get_all()
+        counters = self.index.get_counters()
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        return {
+            "files": len(files),
+            "bytes": sum(media.size + (media.normalised_size or 0) for media in files.values()),
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
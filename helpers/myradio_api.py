@@ -16,76 +16,223 @@
     Date:
         November 2020
 """
-from typing import Optional
+from typing import Any, Callable, Coroutine, Dict, Optional, Tuple, TypeVar
 import aiohttp
+import asyncio
+import hashlib
 import json
 from logging import INFO, ERROR, WARNING, DEBUG
 import os
-import requests
+import tempfile
 import time
 
 from baps_types.plan import PlanItem
-from helpers.os_environment import resolve_external_file_path
+from helpers.os_environment import resolve_music_tmp_path
+from helpers.download_lanes import DownloadLanes, kbps_to_rate
+from helpers.file_lock import FileLock
+from helpers.http_pool import HTTPPool, get_http_pool
 from helpers.logging_manager import LoggingManager
-from helpers.state_manager import StateManager
+from helpers.media_index import MediaIndex, media_key
+from helpers.shared_config import SharedConfig
+
+# Told (bytes downloaded so far, total bytes or None if the server didn't say) as a download goes.
+DownloadProgress = Callable[[int, Optional[int]], None]
+# How much of a download is read at a time, progress is reported after each.
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# Downloads are written to <file>.partial, which is kept if it's cut off, so the next try can carry on from it.
+# What the server said the file was (to check it's the same next time) is kept in <file>.partial.meta.
+PARTIAL_SUFFIX = ".partial"
+PARTIAL_META_SUFFIX = ".meta"
+# Most times to try a download in one go, as long as each try gets further than the last.
+DOWNLOAD_ATTEMPTS = 5
+# Where (in music-tmp) the locks for files being downloaded are kept.
+# (It's a folder, so they're not removed with the rest of music-tmp whilst someone might be holding them.)
+DOWNLOAD_LOCK_PATH = "locks/"
+
+# Where (in music-tmp) show plans fetched from MyRadio are kept for a bit, so all the channels loading a show can share them.
+# (It's a folder, so it's not emptied with the rest of music-tmp when a show is loaded.)
+PLAN_CACHE_PATH = "plans/"
+# How old (secs) a fetched show plan can be and still be given out, rather than asking MyRadio again.
+PLAN_CACHE_MAX_AGE_S = 5
+# How long (secs) to wait for someone else fetching the same show plan, before giving up and asking ourselves.
+PLAN_FETCH_WAIT_S = 15
+
+T = TypeVar("T")
 
 
 class MyRadioAPI:
     logger: LoggingManager
-    config: StateManager
+    config: SharedConfig
+    lanes: DownloadLanes
 
-    def __init__(self, logger: LoggingManager, config: StateManager):
+    def __init__(self, logger: LoggingManager, config: SharedConfig, pool: Optional[HTTPPool] = None):
         self.logger = logger
         self.config = config
+        self.__pool = pool
+        self.lanes = DownloadLanes()
+        self.media_index = MediaIndex()
+
+    # The pool the requests are made on. Unless given one, the one shared by the whole process.
+    @property
+    def pool(self) -> HTTPPool:
+        return self.__pool if self.__pool else get_http_pool()
+
+    # Runs one of the async calls (get_filename etc) from code that isn't async.
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        return self.pool.run(coro)
+
+    # Makes the request on the pool.
+    async def _request(self, url, method: str, data, timeout) -> Tuple[int, bytes]:
+        async with self.pool.session.request(
+            method, url, data=data, timeout=aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+        ) as response:
+            return response.status, await response.read()
+
+    # Streams the body into the file on the pool, a chunk at a time, so only a chunk is held in memory at once.
+    # If part of the file was downloaded before (and the server can say it's still the same file), carries on
+    # from there. Gives the SHA-1 (hex) of the whole file, or None if it failed or didn't all arrive.
+    # Key is the file's key (ie track-1234), so anyone waiting for it can hurry up a background download.
+    async def _download(
+        self, url, filename: str, timeout, progress: Optional[DownloadProgress], background: bool, key: Optional[str]
+    ) -> Optional[str]:
+        if background:
+            self.lanes.background_limit.set_rate(kbps_to_rate(self.config.get().get("preload_bandwidth_kbps")))
+        await self.lanes.start(background, key)
+
+        offset, validator = self._get_partial_download(filename)
+        # Compressed bodies can't be carried on from part way, so ask for it as it is.
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            # If-Range means we get the whole file again if it's changed, rather than the rest of a different one.
+            headers.update({"Range": "bytes={}-".format(offset), "If-Range": validator})
+
+        async with self.pool.session.get(
+            url, headers=headers, timeout=aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+        ) as response:
+            total = response.content_length
+            if response.status == 206:
+                start, total = self._parse_content_range(response.headers.get("Content-Range", ""))
+                if start != offset:
+                    self._logException("Server sent the wrong part of the file, starting again.")
+                    self._remove_partial_download(filename)
+                    return None
+                self._log("Carrying on download from {} bytes.".format(offset), DEBUG)
+            elif response.status == 200:
+                offset = 0
+            else:
+                if response.status == 416:
+                    # What we have doesn't fit the file any more, start again next time.
+                    self._remove_partial_download(filename)
+                self._logException("Failed to download file. Status code: " + str(response.status))
+                self._logException((await response.read()).decode(errors="replace"))
+                return None
+
+            self._save_partial_download_meta(filename, response.headers, total)
+            checksum = hashlib.sha1()
+            downloaded = offset
+            if offset:
+                with open(filename, "rb") as file:
+                    for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_BYTES), b""):
+                        checksum.update(chunk)
+
+            with open(filename, "ab" if offset else "wb") as file:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                    await self.lanes.chunk(background, len(chunk), key)
+                    file.write(chunk)
+                    checksum.update(chunk)
+                    downloaded += len(chunk)
+                    if progress:
+                        progress(downloaded, total)
+
+            if total is not None and downloaded != total:
+                self._logException("Download incomplete, got {} of {} bytes.".format(downloaded, total))
+                return None
+            return checksum.hexdigest()
+
+    # Gives how much of the file has been downloaded, and what it was (ETag / Last-Modified) if it can be carried on.
+    def _get_partial_download(self, filename: str) -> Tuple[int, Optional[str]]:
+        try:
+            with open(filename + PARTIAL_META_SUFFIX) as file:
+                meta = json.load(file)
+            offset = os.path.getsize(filename)
+        except (OSError, ValueError):
+            return 0, None
+        validator = meta.get("etag") or meta.get("last_modified")
+        if not validator or (meta.get("length") is not None and offset >= meta["length"]):
+            return 0, None
+        return offset, validator
+
+    # Remembers what the file being downloaded is, so it can be carried on from if the download's cut off.
+    def _save_partial_download_meta(self, filename: str, headers, length: Optional[int]):
+        etag = headers.get("ETag")
+        # Weak ETags can't be used to carry on part way through a file.
+        if etag and etag.startswith("W/"):
+            etag = None
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            # No way of knowing the file's the same next time, so it'll have to start again.
+            if os.path.isfile(filename + PARTIAL_META_SUFFIX):
+                os.remove(filename + PARTIAL_META_SUFFIX)
+            return
+        with open(filename + PARTIAL_META_SUFFIX, "w") as file:
+            json.dump({"etag": etag, "last_modified": last_modified, "length": length}, file)
+
+    def _remove_partial_download(self, filename: str):
+        for name in [filename, filename + PARTIAL_META_SUFFIX]:
+            if os.path.isfile(name):
+                os.remove(name)
+
+    # Gives (first byte, total bytes or None) from a "bytes <first>-<last>/<total>" Content-Range.
+    def _parse_content_range(self, content_range: str) -> Tuple[Optional[int], Optional[int]]:
+        try:
+            unit, byte_range = content_range.split(" ", 1)
+            if unit != "bytes":
+                return None, None
+            first, total = byte_range.split("/", 1)
+            return int(first.split("-")[0]), None if total == "*" else int(total)
+        except ValueError:
+            return None, None
 
     async def async_call(self, url, method="GET", data=None, timeout=10):
+        if method == "GET":
+            status_code = 200
+        elif method == "POST":
+            status_code = 201
+        elif method == "PUT":
+            data = None
+            status_code = 201
+        else:
+            return
 
-        async with aiohttp.ClientSession(read_timeout=timeout) as session:
-            if method == "GET":
-                func = session.get(url)
-                status_code = 200
-            elif method == "POST":
-                func = session.post(url, data=data)
-                status_code = 201
-            elif method == "PUT":
-                func = session.put(url)
-                status_code = 201
-            else:
-                return
-
-            async with func as response:
-                if response.status != status_code:
-                    self._logException(
-                        "Failed to get API request. Status code: "
-                        + str(response.status)
-                    )
-                    self._logException(str(await response.text()))
-                    return None  # Given the output was bad, don't forward it.
-                return await response.read()
+        status, body = await self.pool.run_async(
+            self._request(url, method, data, timeout)
+        )
+        if status != status_code:
+            self._logException("Failed to get API request. Status code: " + str(status))
+            self._logException(body.decode(errors="replace"))
+            return None  # Given the output was bad, don't forward it.
+        return body
 
     def call(self, url, method="GET", data=None, timeout=10, json_payload=True):
         if method == "GET":
-            r = requests.get(url, timeout=timeout)
+            data = None
             status_code = 200
         elif method == "POST":
-            r = requests.post(url, data, timeout=timeout)
             status_code = 201
         elif method == "PUT":
-            r = requests.put(url, data, timeout=timeout)
             status_code = 200
         else:
             return
 
-        if r.status_code != status_code:
-            self._logException(
-                "Failed to get API request. Status code: " + str(r.status_code)
-            )
-            self._logException(str(r.text))
-        return json.loads(r.text) if json_payload else r.text
+        status, body = self.run(self._request(url, method, data, timeout))
+        text = body.decode(errors="replace")
+        if status != status_code:
+            self._logException("Failed to get API request. Status code: " + str(status))
+            self._logException(text)
+        return json.loads(text) if json_payload else text
 
-    async def async_api_call(
-        self, url, api_version="v2", method="GET", data=None, timeout=10
-    ):
+    # Gives the full URL (with the API key) to request, or None if the API version isn't known.
+    def _api_url(self, url, api_version, method) -> Optional[str]:
         if api_version == "v2":
             url = "{}/v2{}".format(self.config.get()["myradio_api_url"], url)
         elif api_version == "non":
@@ -109,6 +256,13 @@ class MyRadioAPI:
             )
         )
 
+        return url
+
+    async def async_api_call(self, url, api_version="v2", method="GET", data=None, timeout=10):
+        url = self._api_url(url, api_version, method)
+        if not url:
+            return None
+
         request = None
         try:
             if method == "GET":
@@ -131,30 +285,38 @@ class MyRadioAPI:
 
         return request
 
-    def api_call(self, url, api_version="v2", method="GET", data=None, timeout=10):
+    # Streams the file at the URL into filename, telling progress (if given) how it's going.
+    # Carries on from what's already in filename, if it was left by a download of the same file that was cut off.
+    # Gives the file's SHA-1 (hex), or None if it failed (leaving whatever was written, to carry on from).
+    # Background downloads (ie preloading) give way to foreground ones (see DownloadLanes).
+    async def async_api_download(
+        self,
+        url,
+        filename: str,
+        api_version="non",
+        timeout=10,
+        progress: Optional[DownloadProgress] = None,
+        background: bool = False,
+        key: Optional[str] = None,
+    ) -> Optional[str]:
+        url = self._api_url(url, api_version, "GET")
+        if not url:
+            return None
 
-        if api_version == "v2":
-            url = "{}/v2{}".format(self.config.get()["myradio_api_url"], url)
-        elif api_version == "non":
-            url = "{}{}".format(self.config.get()["myradio_base_url"], url)
-        else:
-            self._logException("Invalid API version. Request not sent.")
+        try:
+            checksum = await self.pool.run_async(self._download(url, filename, timeout, progress, background, key))
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+            self._logException("Failed to download file.")
             return None
 
-        url_without_api_key = url
+        self._log("Finished download.")
+        return checksum
 
-        if "?" in url:
-            url += "&api_key={}".format(self.config.get()["myradio_api_key"])
-            url_without_api_key += "&api_key=REDACTED"
-        else:
-            url += "?api_key={}".format(self.config.get()["myradio_api_key"])
-            url_without_api_key += "?api_key=REDACTED"
+    def api_call(self, url, api_version="v2", method="GET", data=None, timeout=10):
 
-        self._log(
-            "Requesting API V2 URL with method {}: {}".format(
-                method, url_without_api_key
-            )
-        )
+        url = self._api_url(url, api_version, method)
+        if not url:
+            return None
 
         request = None
         if method == "GET":
@@ -201,8 +363,88 @@ class MyRadioAPI:
 
         return shows
 
-    async def get_showplan(self, timeslotid: int):
+    # When a show is loaded, every channel (each in its own process) asks for the show plan at once.
+    # Only one of them actually asks MyRadio, the rest wait for it and are given the same plan.
+    # Plans fetched up to max_age_s ago are given out too. With 0, only a fetch already going is shared.
+    async def get_showplan(self, timeslotid: int, max_age_s: float = PLAN_CACHE_MAX_AGE_S):
+        asked_at = time.time()
+        path = resolve_music_tmp_path(PLAN_CACHE_PATH)
+        cache_filename = os.path.join(path, "{}.json".format(timeslotid))
+        lock = FileLock(os.path.join(path, "{}.lock".format(timeslotid)))
+
+        if not await lock.acquire_async(timeout=PLAN_FETCH_WAIT_S):
+            self._log(
+                "Gave up waiting for show plan {} from someone else, fetching it.".format(timeslotid),
+                WARNING,
+            )
+        try:
+            plan = self._get_cached_showplan(cache_filename, asked_at - max_age_s)
+            if plan is not None:
+                self._log("Using show plan {} fetched by someone else.".format(timeslotid), DEBUG)
+                return plan
+
+            plan = await self._fetch_showplan(timeslotid)
+            if plan is not None:
+                self._cache_showplan(cache_filename, plan)
+            return plan
+        finally:
+            lock.release()
+
+    # Gives the cached show plan, if it was fetched after fetched_after, else None.
+    def _get_cached_showplan(self, cache_filename: str, fetched_after: float) -> Optional[Dict[str, Any]]:
+        try:
+            with open(cache_filename) as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if cached["fetched_at"] < fetched_after:
+            return None
+        return cached["plan"]
+
+    def _cache_showplan(self, cache_filename: str, plan: Dict[str, Any]):
+        # Write it somewhere else first, so nobody can read it half written.
+        handle, temp_filename = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(cache_filename))
+        try:
+            with os.fdopen(handle, "w") as file:
+                json.dump({"fetched_at": time.time(), "plan": plan}, file)
+            os.replace(temp_filename, cache_filename)
+        except Exception as e:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            self._logException("Failed to cache show plan: {}".format(e))
+        self._clean_showplan_cache(os.path.dirname(cache_filename))
+
+    # Removes show plans (and their locks) cached too long ago for anyone to be given them.
+    # Ones being fetched (or read) right now have their lock held, so are left alone.
+    def _clean_showplan_cache(self, path: str):
+        old = time.time() - PLAN_CACHE_MAX_AGE_S
+        try:
+            entries = [entry for entry in os.scandir(path) if entry.name.endswith(".lock")]
+        except OSError:
+            return
+        for entry in entries:
+            cache_filename = entry.path[: -len(".lock")] + ".json"
+            try:
+                fetched_at = os.path.getmtime(cache_filename)
+            except OSError:
+                # Never fetched (ie it failed), so go on when it was last tried.
+                try:
+                    fetched_at = entry.stat().st_mtime
+                except OSError:
+                    continue
+            if fetched_at >= old:
+                continue
+            lock = FileLock(entry.path)
+            if not lock.try_acquire():
+                continue
+            try:
+                if os.path.exists(cache_filename):
+                    os.remove(cache_filename)
+            except OSError:
+                pass
+            lock.release(remove=True)
 
+    async def _fetch_showplan(self, timeslotid: int) -> Optional[Dict[str, Any]]:
         url = "/timeslot/{}/showplan".format(timeslotid)
         request = await self.async_api_call(url)
 
@@ -227,9 +469,18 @@ class MyRadioAPI:
 
     # Audio Library
 
+    # Progress (if given) is told how the download is going, if the file needs downloading.
+    # Background (ie preloading) downloads give way to anyone that needs a file right now.
     async def get_filename(
-        self, item: PlanItem, did_download: bool = False, redownload=False
+        self,
+        item: PlanItem,
+        did_download: bool = False,
+        redownload=False,
+        progress: Optional[DownloadProgress] = None,
+        background: bool = False,
     ):
+        # (For how long whoever wanted it had to wait, including for anyone else that was downloading it.)
+        asked_at = time.time()
         format = "mp3"  # TODO: Maybe we want this customisable?
         if item.trackid:
             itemType = "track"
@@ -245,9 +496,7 @@ class MyRadioAPI:
             return (None, False) if did_download else None
 
         # Now check if the file already exists
-        path: str = resolve_external_file_path("/music-tmp/")
-
-        dl_suffix = ".downloading"
+        path: str = resolve_music_tmp_path()
 
         if not os.path.isdir(path):
             self._log("Music-tmp folder is missing, attempting to create.")
@@ -257,58 +506,95 @@ class MyRadioAPI:
                 self._logException("Failed to create music-tmp folder: {}".format(e))
                 return (None, False) if did_download else None
 
-        filename: str = resolve_external_file_path(
-            "/music-tmp/{}-{}.{}".format(itemType, id, format)
-        )
-
-        if not redownload:
-            # Check if we already downloaded the file. If we did, give that, unless we're forcing a redownload.
-            if os.path.isfile(filename):
-                self._log("Already got file: " + filename, DEBUG)
-                return (filename, False) if did_download else filename
-
-            # If something else (another channel, the preloader etc) is downloading the track, wait for it.
-            if os.path.isfile(filename + dl_suffix):
-                time_waiting_s = 0
-                self._log(
-                    "Waiting for download to complete from another worker. " + filename,
-                    DEBUG,
-                )
-                while time_waiting_s < 20:
-                    # TODO: Make something better here.
-                    # If the connectivity is super poor or we're loading reeaaaalllly long files,
-                    # this may be annoying, but this is just in case somehow the other api download gives up.
-                    if os.path.isfile(filename):
-                        # Now the file is downloaded successfully
-                        return (filename, False) if did_download else filename
-                    time_waiting_s += 1
-                    self._log("Still waiting", DEBUG)
-                    time.sleep(1)
-
-        # File doesn't exist, download it.
+        filename: str = resolve_music_tmp_path("{}-{}.{}".format(itemType, id, format))
+
+        # Check if we already downloaded the file. If we did, give that, unless we're forcing a redownload.
+        if not redownload and os.path.isfile(filename):
+            self._log("Already got file: " + filename, DEBUG)
+            return (filename, False) if did_download else filename
+
+        # Only one process (channel, the preloader etc) downloads a file at once, the rest wait for it.
+        # As the OS lets go of the lock if the downloader dies, there's no need for a timeout.
+        key = media_key(item)
+        lock = FileLock(os.path.join(resolve_music_tmp_path(DOWNLOAD_LOCK_PATH), "{}.lock".format(key)))
+        if not lock.try_acquire():
+            self._log(
+                "Waiting for download to complete from another worker (process {}). {}".format(
+                    lock.owner(), filename
+                ),
+                DEBUG,
+            )
+            if background:
+                await lock.acquire_async()
+            else:
+                # They might be preloading it, so tell them we need it now.
+                await lock.acquire_async(waiting=lambda: self.lanes.want(key))
+                self.lanes.want_done(key)
         try:
-            # Just create the file to stop other sources from trying to download too.
-            open(filename + dl_suffix, "a").close()
-        except Exception:
-            self.logger.log.exception("Couldn't create new temp file.")
-            return (None, False) if did_download else None
-
-        request = await self.async_api_call(url, api_version="non")
+            if not redownload and os.path.isfile(filename):
+                # Now the file is downloaded successfully
+                self._log("Another worker downloaded file: " + filename, DEBUG)
+                return (filename, False) if did_download else filename
 
-        if not request or not isinstance(request, (bytes, bytearray)):
-            # Remove the .downloading temp file given we gave up trying to download.
-            os.remove(filename + dl_suffix)
-            return (None, False) if did_download else None
+            # If they failed (or died), carry on from whatever they got.
+            return await self._download_file(
+                url, key, filename, did_download, redownload, progress, background
+            )
+        finally:
+            # There's nothing to lock until it's downloaded again, so don't leave one for every file.
+            lock.release(remove=True)
+            if not background:
+                self.lanes.foreground_waited(time.time() - asked_at)
+                self._log("Foreground download took {:.0f}ms.".format((time.time() - asked_at) * 1000))
+
+    # Downloads the file, for get_filename(), which holds the lock for it.
+    async def _download_file(
+        self,
+        url,
+        key: str,
+        filename: str,
+        did_download: bool,
+        redownload: bool,
+        progress: Optional[DownloadProgress],
+        background: bool,
+    ):
+        partial_filename = filename + PARTIAL_SUFFIX
+        if redownload:
+            # Something was wrong with the file, so don't trust anything left from before.
+            self._remove_partial_download(partial_filename)
+
+        # Keep trying whilst we're getting somewhere, as each try carries on from the last.
+        checksum = None
+        for _ in range(DOWNLOAD_ATTEMPTS):
+            got = self._get_partial_download(partial_filename)[0]
+            checksum = await self.async_api_download(
+                url, partial_filename, progress=progress, background=background, key=key
+            )
+            if checksum or self._get_partial_download(partial_filename)[0] <= got:
+                break
+            self._log("Download cut off, trying again.", WARNING)
 
         try:
-            with open(filename + dl_suffix, "wb") as file:
-                file.write(request)
-            os.rename(filename + dl_suffix, filename)
+            if checksum:
+                # Only now it's all there, so nobody can load it half written.
+                os.replace(partial_filename, filename)
+                self._remove_partial_download(partial_filename)
+            elif not self._get_partial_download(partial_filename)[0]:
+                # Nothing that can be carried on from next time.
+                self._remove_partial_download(partial_filename)
         except Exception as e:
             self._logException("Failed to write music file: {}".format(e))
+            checksum = None
+
+        if not checksum:
             return (None, False) if did_download else None
 
-        self._log("Successfully re/downloaded file.", DEBUG)
+        self._log("Successfully re/downloaded file, SHA-1 {}.".format(checksum), DEBUG)
+        try:
+            # So nobody else has to go looking for it (or hash it again).
+            self.media_index.add(key, filename, checksum)
+        except Exception as e:
+            self._logException("Failed to add file to the media index: {}".format(e))
         return (filename, True) if did_download else filename
 
     # Gets the list of managed music playlists.
@@ -1,4 +1,5 @@
 import os
+from typing import Optional, Tuple
 from pydub import AudioSegment, effects  # Audio leveling!
 
 # Stuff to help make BAPSicle play out leveled audio.
@@ -7,24 +8,29 @@ from pydub import AudioSegment, effects  # Audio leveling!
 
 
 def generate_normalised_file(filename: str):
+    return normalise_file(filename)[0]
+
+
+# As above, also returning how loud (dBFS) the original was, if it had to be normalised.
+def normalise_file(filename: str) -> Tuple[str, Optional[float]]:
     if not (isinstance(filename, str) and filename.endswith(".mp3")):
         raise ValueError("Invalid filename given.")
 
     # Already normalised.
     if filename.endswith("-normalised.mp3"):
-        return filename
+        return filename, None
 
     normalised_filename = "{}-normalised.mp3".format(filename.rsplit(".", 1)[0])
 
     # The file already exists, short circuit.
     if os.path.exists(normalised_filename):
-        return normalised_filename
+        return normalised_filename, None
 
     sound = AudioSegment.from_file(filename, "mp3")
     normalised_sound = effects.normalize(sound)
 
     normalised_sound.export(normalised_filename, bitrate="320k", format="mp3")
-    return normalised_filename
+    return normalised_filename, sound.dBFS
 
 
 # Returns either a normalised file path (based on filename), or the original if not available.
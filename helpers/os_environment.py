@@ -1,5 +1,6 @@
 import sys
 import os
+from typing import Optional
 
 # Check if we're running inside a pyinstaller bundled (it's an exe)
 
@@ -45,3 +46,13 @@ def resolve_external_file_path(relative_path: str):
         relative_path = "/" + relative_path
     # Pass through abspath to correct any /'s with \'s on Windows
     return os.path.abspath(os.getcwd() + relative_path)
+
+
+# Where downloaded music (and everything kept about it, ie the locks and the media index) lives.
+# Unless set (ie to a temporary folder, in the tests), it's music-tmp, alongside the logs and state.
+MUSIC_TMP_PATH: Optional[str] = None
+
+
+# Use this to resolve paths inside music-tmp.
+def resolve_music_tmp_path(relative_path: str = "") -> str:
+    return os.path.join(MUSIC_TMP_PATH or resolve_external_file_path("/music-tmp/"), relative_path)
@@ -0,0 +1,216 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Decoded Audio (PCM) Cache
+
+    Loading an item hands the mixer the compressed file, which gets decoded from scratch
+    every time: on retries, on output changes, and on every channel that loads the same jingle.
+
+    This keeps decoded copies of files as uncompressed WAVs, keyed by the hash of the file and
+    the mixer's output format, so they can go straight to the mixer. Files from MyRadio are
+    hashed as they're downloaded, so their hash comes from the media index (see MediaIndex),
+    and every player can find their decoded versions without reading the whole file.
+    The files are only ever written once (then renamed into place), so every player process can
+    read them at the same time, sharing them through the OS's file cache.
+    The least recently used files are removed once the cache gets too big (the server's pcm_cache_max_mb).
+
+    Decoding takes the whole file into memory, so WAVs (already decoded) and long files aren't.
+    It also takes a while, so players do it in the background, ready for the next time the file's loaded.
+
+    Date:
+        October 2026
+"""
+import hashlib
+import os
+import tempfile
+import wave
+from typing import Dict, Optional, Tuple
+
+from pygame import mixer
+
+from helpers.audio_duration import get_duration
+from helpers.media_index import MediaIndex
+from helpers.os_environment import resolve_music_tmp_path
+
+# Where (in music-tmp) the decoded files live.
+PCM_CACHE_PATH = "pcm/"
+# The most (MB) the cache can take up before the least recently used files are removed, unless told otherwise.
+# ~100 mins of audio.
+PCM_CACHE_MAX_MB = 1024
+# Files longer than this (secs) aren't decoded, it'd take too much memory (~10MB a min).
+PCM_CACHE_MAX_DURATION_S = 15 * 60
+# If we can't tell how long a file is, ones bigger than this (MB) aren't decoded. ~15 mins at 320kbps.
+PCM_CACHE_MAX_SOURCE_MB = 36
+
+# Older SDL_mixer versions can't seek in WAV files, which we need to do.
+_MIN_SDL_MIXER_VERSION = (2, 6, 0)
+
+
+# A decoded file, ready to be loaded by the mixer.
+class CachedPCM:
+    __slots__ = ("filename", "length")
+
+    filename: str
+    # Length of the audio (secs)
+    length: float
+
+    def __init__(self, filename: str, length: float):
+        self.filename = filename
+        self.length = length
+
+
+class PCMCache:
+    path: str
+    max_bytes: int
+
+    # Index is the media index to take the hashes of files from MyRadio from, if given.
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_bytes: int = PCM_CACHE_MAX_MB * 1024 * 1024,
+        index: Optional[MediaIndex] = None,
+    ):
+        self.path = path or resolve_music_tmp_path(PCM_CACHE_PATH)
+        self.max_bytes = max_bytes
+        self.index = index
+        # So we don't have to re-hash files we've seen before: (filename, size, modified time) -> hash.
+        self.__hashes: Dict[Tuple[str, int, int], str] = {}
+
+    # Whether the mixer can play (and seek) the decoded files. The mixer must be init'd.
+    @staticmethod
+    def is_supported() -> bool:
+        try:
+            return tuple(mixer.get_sdl_mixer_version()) >= _MIN_SDL_MIXER_VERSION
+        except Exception:
+            return False
+
+    # Whether a file should be decoded. WAVs already are, and long files would take too much memory.
+    @staticmethod
+    def should_cache(filename: str) -> bool:
+        if os.path.splitext(filename)[1].lower() in (".wav", ".wave"):
+            return False
+        duration = get_duration(filename)
+        if duration is not None:
+            return duration <= PCM_CACHE_MAX_DURATION_S
+        try:
+            return os.path.getsize(filename) <= PCM_CACHE_MAX_SOURCE_MB * 1024 * 1024
+        except OSError:
+            return False
+
+    # Gives the hash of a file's contents. Unless hash_file, only if it's already been worked out
+    # (by us, or as it was downloaded), else None.
+    def _hash(self, filename: str, hash_file: bool = True) -> Optional[str]:
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        if key not in self.__hashes:
+            indexed_hash = self._indexed_hash(filename, stat)
+            if indexed_hash:
+                self.__hashes[key] = indexed_hash
+                return indexed_hash
+            if not hash_file:
+                return None
+            sha1 = hashlib.sha1()
+            with open(filename, "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    sha1.update(chunk)
+            self.__hashes[key] = sha1.hexdigest()
+        return self.__hashes[key]
+
+    # The hash of a file in the media index, if it's (still) the one in there.
+    # A normalised version's hash is its original's, as it's made from (and removed along with) it.
+    def _indexed_hash(self, filename: str, stat: os.stat_result) -> Optional[str]:
+        if not self.index:
+            return None
+        media = self.index.find(filename)
+        if not media:
+            return None
+        if media.filename == filename and (media.size, media.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            return media.sha1
+        if media.normalised_filename == filename and media.normalised_size == stat.st_size:
+            return media.sha1 + "-normalised"
+        return None
+
+    # The cached filename for a file, in the mixer's current output format.
+    # Unless hash_file, None if the file hasn't been hashed yet.
+    def _cache_filename(self, filename: str, hash_file: bool = True) -> Optional[str]:
+        file_hash = self._hash(filename, hash_file)
+        if not file_hash:
+            return None
+        frequency, size, channels = mixer.get_init()
+        return os.path.join(self.path, "{}-{}-{}-{}.wav".format(file_hash, frequency, size, channels))
+
+    @staticmethod
+    def _length(cache_filename: str) -> float:
+        with wave.open(cache_filename, "rb") as file:
+            return file.getnframes() / file.getframerate()
+
+    # Returns the decoded version of a file if we've got it, else None.
+    # Hashing means reading the whole file, so unless hash_file, only files already hashed (ie by add()) are found.
+    def get(self, filename: str, hash_file: bool = True) -> Optional[CachedPCM]:
+        try:
+            cache_filename = self._cache_filename(filename, hash_file)
+            if not cache_filename:
+                return None
+            length = self._length(cache_filename)
+            # Mark it as recently used.
+            os.utime(cache_filename)
+        except (OSError, EOFError, wave.Error):
+            return None
+        return CachedPCM(cache_filename, length)
+
+    # Decodes a file into the cache, returning the decoded version. Slow, and the whole file is decoded into memory.
+    def add(self, filename: str) -> CachedPCM:
+        if not self.should_cache(filename):
+            raise ValueError("Not decoding {}, it's a WAV or too long.".format(filename))
+        cache_filename = self._cache_filename(filename)
+        frequency, size, channels = mixer.get_init()
+
+        # Decodes the whole file into the mixer's format.
+        frames = mixer.Sound(filename).get_raw()
+
+        os.makedirs(self.path, exist_ok=True)
+        # Write it somewhere else first, so nobody else can see it half written.
+        handle, temp_filename = tempfile.mkstemp(suffix=".tmp", dir=self.path)
+        try:
+            with os.fdopen(handle, "wb") as temp_file:
+                with wave.open(temp_file, "wb") as file:
+                    file.setnchannels(channels)
+                    file.setsampwidth(abs(size) // 8)
+                    file.setframerate(frequency)
+                    file.writeframes(frames)
+            os.replace(temp_filename, cache_filename)
+        except Exception:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+
+        self.evict(keep=cache_filename)
+        frame_bytes = channels * abs(size) // 8
+        return CachedPCM(cache_filename, len(frames) / frame_bytes / frequency)
+
+    def get_or_add(self, filename: str) -> CachedPCM:
+        return self.get(filename) or self.add(filename)
+
+    # Removes the least recently used files (apart from keep), until the cache is small enough.
+    def evict(self, keep: Optional[str] = None):
+        files = []
+        total = 0
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name.endswith(".wav"):
+                stat = entry.stat()
+                total += stat.st_size
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # Probably open in a player on Windows, it can go next time.
+                continue
+            total -= size
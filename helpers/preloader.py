@@ -0,0 +1,178 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Preloader
+
+    The file manager used to preload a show's files one at a time, going round the channels,
+    and napping for 200ms whenever it wasn't downloading anything, so a big show took a while.
+
+    Items handed to the preloader are downloaded in the background, on the MyRadio API's HTTP
+    pool, a few (the server's preload_concurrency) at once. Anything more waits in a queue.
+    The same track in more than one channel is only downloaded once, and anything already in
+    the music cache (see MusicCache) isn't downloaded at all. They're background downloads, so
+    give way to any a player needs right now (see DownloadLanes).
+
+    Date:
+        October 2026
+"""
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from threading import Lock
+import time
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from baps_types.plan import PlanItem
+from helpers.logging_manager import LoggingManager
+from helpers.media_index import media_key
+from helpers.music_cache import MusicCache
+from helpers.myradio_api import MyRadioAPI
+
+# How many files to download at once, unless told otherwise.
+PRELOAD_CONCURRENCY = 4
+
+
+class Preloader:
+    logger: LoggingManager
+    api: MyRadioAPI
+    concurrency: int
+    cache: Optional[MusicCache]
+
+    def __init__(
+        self,
+        logger: LoggingManager,
+        api: MyRadioAPI,
+        concurrency: int = PRELOAD_CONCURRENCY,
+        cache: Optional[MusicCache] = None,
+    ):
+        self.logger = logger
+        self.api = api
+        self.concurrency = max(1, concurrency)
+        self.cache = cache
+
+        self.__lock = Lock()
+        # Items are known by their file's key (see media_key()).
+        self.__queue: Deque[Tuple[str, PlanItem]] = deque()
+        # Everything queued or downloading.
+        self.__waiting: Set[str] = set()
+        self.__in_flight = 0
+        # The file for everything that's finished, or None if it failed.
+        self.__finished: Dict[str, Optional[str]] = {}
+        # Bumped by clear(), so anything that was already downloading is forgotten about when it finishes.
+        self.__generation = 0
+
+        # How it's getting on, since it last had nothing to do.
+        self.__busy_since: Optional[float] = None
+        self.__busy_until: Optional[float] = None
+        self.__done = 0
+        self.__downloaded = 0
+        self.__failed = 0
+        self.__cached = 0
+
+    # Queues the item's file to be downloaded, unless it already has been (or is being), or it's in the cache.
+    # Gives whether it was queued.
+    # (Only add things from one thread, as the cache isn't thread safe.)
+    def add(self, item: PlanItem) -> bool:
+        key = media_key(item)
+        with self.__lock:
+            if not key or key in self.__waiting or key in self.__finished:
+                return False
+
+        filename = self.cache.get(key) if self.cache else None
+        with self.__lock:
+            if filename:
+                self.__finished[key] = filename
+                self.__cached += 1
+                return False
+            if self.__busy_since is None or self.__busy_until is not None:
+                self.__busy_since = time.time()
+                self.__busy_until = None
+                self.__done = self.__downloaded = self.__failed = 0
+            self.__waiting.add(key)
+            self.__queue.append((key, item))
+        self.__start()
+        return True
+
+    # Gives the file for each item that's finished (None if it failed), by its file's key.
+    def get_finished(self) -> Dict[str, Optional[str]]:
+        with self.__lock:
+            return dict(self.__finished)
+
+    # How it's going: files waiting, downloading, finished (done / downloaded / failed)
+    # and how quickly (files / sec) it's got through them, since it last had nothing to do.
+    # Also how many didn't need preloading as they were in the cache, since it was last cleared.
+    def get_stats(self) -> Dict[str, float]:
+        with self.__lock:
+            busy_s = 0.0
+            if self.__busy_since is not None:
+                busy_s = (self.__busy_until or time.time()) - self.__busy_since
+            return {
+                "queued": len(self.__queue),
+                "in_flight": self.__in_flight,
+                "done": self.__done,
+                "downloaded": self.__downloaded,
+                "failed": self.__failed,
+                "files_per_s": self.__done / busy_s if busy_s else 0.0,
+                "cached": self.__cached,
+            }
+
+    # Forgets everything (ie for a new show). Anything already downloading is left to finish, but ignored.
+    def clear(self):
+        with self.__lock:
+            self.__queue.clear()
+            self.__waiting.clear()
+            self.__finished.clear()
+            self.__generation += 1
+            self.__cached = 0
+
+    # Starts downloading whatever's next in the queue, up to the concurrency limit.
+    def __start(self):
+        starting: List[Tuple[str, PlanItem, int]] = []
+        with self.__lock:
+            while self.__queue and self.__in_flight < self.concurrency:
+                key, item = self.__queue.popleft()
+                self.__in_flight += 1
+                starting.append((key, item, self.__generation))
+
+        # (Outside the lock, the callback's run straight away if it's already done.)
+        for key, item, generation in starting:
+            self.logger.log.info("Preloading {}: {}".format(key, item.name))
+            future = self.api.pool.submit(self.api.get_filename(item, True, background=True))
+            future.add_done_callback(partial(self.__finish, key, generation))
+
+    # Called (on the API's pool) when a download finishes.
+    def __finish(self, key: str, generation: int, future: "Future"):
+        try:
+            filename, did_download = future.result()
+        except Exception:
+            self.logger.log.exception("Failed to preload {}.".format(key))
+            filename, did_download = None, False
+
+        summary = None
+        with self.__lock:
+            self.__in_flight -= 1
+            if generation == self.__generation:
+                self.__waiting.discard(key)
+                self.__finished[key] = filename
+                if filename:
+                    self.__done += 1
+                    self.__downloaded += int(did_download)
+                else:
+                    self.__failed += 1
+
+            if not self.__queue and not self.__in_flight and self.__busy_since is not None:
+                self.__busy_until = time.time()
+                busy_s = self.__busy_until - self.__busy_since
+                summary = "Preloaded {} files ({} downloaded) in {:.1f}s, {:.1f} files/s, {} failed.".format(
+                    self.__done, self.__downloaded, busy_s, self.__done / busy_s if busy_s else 0, self.__failed
+                )
+
+        if filename:
+            self.logger.log.info("File successfully preloaded: {}".format(filename))
+        else:
+            self.logger.log.warning("Failed to preload {}.".format(key))
+        if summary:
+            self.logger.log.info(summary)
+        self.__start()
@@ -0,0 +1,173 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Shared Memory Server Config
+
+    The server config lives in a StateManager in the ProxyManager's process.
+    Reading it through the proxy is a round trip to that process (and a copy of the whole
+    config) every time, so every change is also published into a block of shared memory,
+    which every process can read locally.
+
+    Changes still go through the proxy, so there's only ever one writer.
+
+    Date:
+        October 2026
+"""
+import json
+import struct
+import time
+from multiprocessing.shared_memory import SharedMemory
+from threading import Thread
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from helpers.logging_manager import LoggingManager
+from helpers.state_manager import StateChanges, StateManager, StateSnapshot
+
+# How big the shared config block is. The config is only a few hundred bytes of JSON.
+SHARED_CONFIG_SIZE = 64 * 1024
+# How often (secs) subscribers check for config changes.
+SHARED_CONFIG_WATCH_PERIOD_S = 0.2
+
+# Header of the shared block: sequence number, length of the JSON config after it.
+# The sequence number is odd while the config is being written, and goes up by 2 each change.
+_HEADER = struct.Struct("=QI")
+
+
+# Creates the shared memory block for the server config. Whoever creates it must unlink() it.
+# This must be done before starting the processes that use it, so they share our resource tracker.
+# Otherwise, their own tracker will delete the block as soon as they exit.
+def create_shared_config_memory() -> SharedMemory:
+    memory = SharedMemory(create=True, size=SHARED_CONFIG_SIZE)
+    _HEADER.pack_into(memory.buf, 0, 0, 0)
+    return memory
+
+
+# Attaches to an existing shared config block.
+# All of BAPSicle's processes are started by the server, so they share its resource tracker, which
+# only cleans up blocks that haven't been unlink()ed once every process has exited.
+def _attach(name: str) -> SharedMemory:
+    return SharedMemory(name=name)
+
+
+# Writes the config into the shared block. Lives in the ProxyManager's process, next to the StateManager.
+class SharedConfigPublisher:
+    def __init__(self, memory_name: str):
+        self.memory = _attach(memory_name)
+
+    def publish(self, state: Dict[str, Any]):
+        payload = json.dumps(dict(state)).encode()
+        if _HEADER.size + len(payload) > self.memory.size:
+            raise ValueError(
+                "Server config is too big for shared memory ({} bytes).".format(len(payload))
+            )
+
+        seq = _HEADER.unpack_from(self.memory.buf, 0)[0]
+        # Odd sequence number, so readers know to wait for us to finish.
+        _HEADER.pack_into(self.memory.buf, 0, seq + 1, 0)
+        self.memory.buf[_HEADER.size: _HEADER.size + len(payload)] = payload
+        _HEADER.pack_into(self.memory.buf, 0, seq + 2, len(payload))
+
+
+# Registered with the ProxyManager, to make the server config StateManager in the manager's process.
+def create_shared_state_manager(
+    name, logger: LoggingManager, default_state: Dict[str, Any], memory_name: str
+) -> StateManager:
+    state = StateManager(name, logger, default_state)
+    publisher = SharedConfigPublisher(memory_name)
+    publisher.publish(state.get())
+    state.add_callback(lambda changes: publisher.publish(state.get()))
+    return state
+
+
+# Handed to every process instead of the StateManager proxy.
+# get() reads the shared block locally, update() goes through the proxy as before.
+class SharedConfig:
+    def __init__(self, state: StateManager, memory_name: str):
+        self.__proxy = state
+        self.__memory_name = memory_name
+        self.__memory: Optional[SharedMemory] = None
+        self.__seq = -1
+        self.__snapshot = StateSnapshot()
+        self.__callbacks: List[Tuple[Callable[[StateChanges], Any], Optional[Set[str]]]] = []
+        self.__watcher: Optional[Thread] = None
+
+    # Only the proxy and where to find the shared block can be sent to other processes.
+    def __getstate__(self):
+        return {"proxy": self.__proxy, "memory_name": self.__memory_name}
+
+    def __setstate__(self, state):
+        self.__init__(state["proxy"], state["memory_name"])
+
+    def _read_seq(self) -> int:
+        if not self.__memory:
+            self.__memory = _attach(self.__memory_name)
+        return _HEADER.unpack_from(self.__memory.buf, 0)[0]
+
+    def get(self) -> StateSnapshot:
+        seq = self._read_seq()
+        while seq != self.__seq:
+            if seq % 2 == 1:
+                # Mid-write, try again in a moment.
+                time.sleep(0)
+                seq = self._read_seq()
+                continue
+
+            assert self.__memory
+            length = _HEADER.unpack_from(self.__memory.buf, 0)[1]
+            payload = bytes(self.__memory.buf[_HEADER.size: _HEADER.size + length])
+
+            # If it's changed while we were reading, try again.
+            new_seq = self._read_seq()
+            if new_seq != seq:
+                seq = new_seq
+                continue
+
+            self.__snapshot = StateSnapshot(json.loads(payload), seq // 2)
+            self.__seq = seq
+
+        return self.__snapshot
+
+    def version(self) -> int:
+        return self.get().version
+
+    def update(self, key: str, value: Any, index: int = -1):
+        self.__proxy.update(key, value, index)
+
+    # Calls function (from a separate thread) with the changes whenever the config changes.
+    # Works the same as StateManager.add_callback()
+    def add_callback(
+        self, function: Callable[[StateChanges], Any], keys: Optional[List[str]] = None
+    ):
+        self.__callbacks.append((function, set(keys) if keys is not None else None))
+        if not self.__watcher:
+            # Make sure we only tell them about changes from now on.
+            self.__watcher = Thread(target=self._watch, args=(self.get(),), daemon=True)
+            self.__watcher.start()
+
+    # Notified is the config the callbacks were last told about. It's kept apart from what get() last read,
+    # as anyone calling get() in the meantime would make the watcher think nothing has changed.
+    def _watch(self, notified: StateSnapshot):
+        while True:
+            time.sleep(SHARED_CONFIG_WATCH_PERIOD_S)
+            new = self.get()
+            if new.version == notified.version:
+                continue
+            old, notified = notified, new
+            changes: StateChanges = {
+                key: (old.get(key), new.get(key))
+                for key in set(old.keys()) | set(new.keys())
+                if old.get(key) != new.get(key)
+            }
+            for callback, keys in self.__callbacks:
+                callback_changes = {
+                    key: change for key, change in changes.items() if keys is None or key in keys
+                }
+                if not callback_changes:
+                    continue
+                try:
+                    callback(callback_changes)
+                except Exception:
+                    # Subscribers are expected to log their own problems, just keep the others going.
+                    pass
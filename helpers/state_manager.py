@@ -2,9 +2,10 @@ import json
 import os
 from logging import DEBUG, INFO
 import time
+from contextlib import contextmanager
 from datetime import datetime
-from copy import copy
-from typing import Any, Dict, List
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from setproctitle import setproctitle
 from multiprocessing import current_process
 
@@ -12,14 +13,81 @@ from baps_types.plan import PlanItem
 from helpers.logging_manager import LoggingManager
 from helpers.os_environment import resolve_external_file_path
 
+# In journal mode, how often (secs) the journal is fsync'd to disk.
+JOURNAL_FSYNC_PERIOD_S = 1
+# In journal mode, how many entries the journal can grow to before it's compacted into the state file.
+JOURNAL_COMPACT_ENTRIES = 1000
+
+
+# Turn state values into JSON friendly ones (PlanItem -> dict)
+def _to_json(value: Any) -> Any:
+    if isinstance(value, PlanItem):
+        return value.__dict__
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    return value
+
+
+# Turn JSON values back into state values (dict -> PlanItem)
+# Index is set if value is a single item of the list stored under key.
+def _from_json(key: str, value: Any, index: int = -1) -> Any:
+    if key == "loaded_item":
+        return PlanItem(value) if value else None
+    if key == "show_plan":
+        if index > -1:
+            return PlanItem(value)
+        return [PlanItem(obj) for obj in value]
+    return value
+
+
+# A read-only version of the state, handed out to readers without copying.
+# Every change to the state produces a new snapshot with a higher version, so readers can hold onto
+# one as long as they like, and compare versions to see if anything has changed since.
+# Note: Only the dict is read-only, lists / PlanItems inside it are shared, so copy them before changing.
+class StateSnapshot(dict):
+    __slots__ = ("version",)
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None, version: int = 0):
+        super().__init__(state or {})
+        self.version = version
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError(
+            "State snapshots are read-only, use StateManager.update() to change the state."
+        )
+
+    __setitem__ = _read_only
+    __delitem__ = _read_only
+    __ior__ = _read_only
+    clear = _read_only
+    pop = _read_only
+    popitem = _read_only
+    setdefault = _read_only
+    update = _read_only
+
+    # A new snapshot with one key changed.
+    def _replace(self, key: str, value: Any) -> "StateSnapshot":
+        snapshot = StateSnapshot(self, self.version + 1)
+        dict.__setitem__(snapshot, key, value)
+        return snapshot
+
+    # Copies (and proxies sending the state to other processes) get a normal dict they can do what they like with.
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+# Callbacks are given the changes since they were last called, as {key: (old_value, new_value)}
+StateChanges = Dict[str, Tuple[Any, Any]]
+
 
 class StateManager:
     filepath: str
     logger: LoggingManager
-    callbacks: List[Any] = []
-    __state = {}
+    # List of (callback, keys it cares about (None for all))
+    callbacks: List[Tuple[Callable[[StateChanges], Any], Optional[Set[str]]]]
+    __state = StateSnapshot()
     # Dict of times that params can be updated after, if the time is before current time, it can be written immediately.
-    __rate_limit_params_until = {}
+    __rate_limit_params_until: Dict[str, float]
     __rate_limit_period_s = 0
 
     def __init__(
@@ -29,7 +97,34 @@ class StateManager:
         default_state: Dict[str, Any] = None,
         rate_limit_params=[],
         rate_limit_period_s=5,
+        journal: bool = False,
+        journal_fsync_period_s: float = JOURNAL_FSYNC_PERIOD_S,
+        journal_compact_entries: int = JOURNAL_COMPACT_ENTRIES,
     ):
+        self.callbacks = []
+        self.__rate_limit_params_until = {}
+        # What each key that has changed since the callbacks were last called used to be.
+        self.__changed_from: Dict[str, Any] = {}
+
+        # In journal mode, instead of rewriting the whole state file on every change,
+        # the changed keys are appended to a journal file, which is compacted back into
+        # the state file every so often in the background.
+        self.__journal = journal
+        self.__journal_fsync_period_s = journal_fsync_period_s
+        self.__journal_compact_entries = journal_compact_entries
+        self.__journal_file = None
+        self.__journal_entries = 0
+        self.__journal_last_fsync = 0.0
+        self.__journal_lock = Lock()
+        self.__compacting = False
+        # Keys (and list indexes, if only some items of a list changed) not yet written to the journal.
+        self.__unsaved: Dict[str, Optional[Set[int]]] = {}
+
+        # How many transactions we're currently nested inside, and whether any of them
+        # have changed something that needs writing to file / telling the callbacks about.
+        self.__transaction_depth = 0
+        self.__transaction_dirty = False
+
         # When a StateManager is shared via proxy to other processes, it has a thread itself.
         process_title = "BAPSicle - StateManager Proxy"
         setproctitle(process_title)
@@ -48,12 +143,15 @@ class StateManager:
 
         self.filepath = resolve_external_file_path("/state/" + name + ".json")
         self._log("State file path set to: " + self.filepath)
+        self.journal_path = resolve_external_file_path("/state/" + name + ".journal")
+        # While the journal is being compacted, it's moved here, so new changes can go into a fresh journal.
+        self.compacting_path = self.journal_path + ".compacting"
 
         if not os.path.isfile(self.filepath):
             self._log("No existing state file found.")
             try:
                 # Try creating the file.
-                open(self.filepath, "x")
+                open(self.filepath, "x").close()
             except Exception:
                 self._logException("Failed to create state file.")
                 return
@@ -62,40 +160,42 @@ class StateManager:
         with open(self.filepath, "r") as file:
             file_raw = file.read()
 
+        file_state: Optional[Dict[str, Any]] = None
         if file_raw == "":
             self._log("State file is empty. Setting default state.")
             self.state = default_state
         else:
             try:
-                file_state: Dict[str, Any] = json.loads(file_raw)
+                file_state = json.loads(file_raw)
 
                 # Turn from JSON -> PlanItem
                 if "channel" in file_state:
-                    file_state["loaded_item"] = (
-                        PlanItem(file_state["loaded_item"])
-                        if file_state["loaded_item"]
-                        else None
-                    )
-                    file_state["show_plan"] = [
-                        PlanItem(obj) for obj in file_state["show_plan"]
-                    ]
+                    for key in ["loaded_item", "show_plan"]:
+                        file_state[key] = _from_json(key, file_state[key])
 
                 # Now feed the loaded state into the initialised state manager.
                 self.state = file_state
 
-                # If there are any new config options in the default state, save them.
-                # Uses update() to save them to file too.
-                if default_state:
-                    for key in default_state.keys():
-                        if key not in file_state.keys():
-                            self.update(key, default_state[key])
-
             except Exception:
                 self._logException(
                     "Failed to parse state JSON. Resetting to default state."
                 )
+                file_state = None
                 self.state = default_state
 
+        if self.__journal:
+            # Anything in the journal happened after the state file was written, so apply it on top.
+            # Then write it all into a fresh state file, so we can start with an empty journal.
+            self._replay_journal()
+            self._compact(background=False)
+
+        # If there are any new config options in the default state, save them.
+        # Uses update() to save them to file too.
+        if file_state and default_state:
+            for key in default_state.keys():
+                if key not in self.__state.keys():
+                    self.update(key, default_state[key])
+
         # Now setup the rate limiting
         # Essentially rate limit all values to "now" to start with, allowing the first update
         # of all vars to succeed.
@@ -104,45 +204,178 @@ class StateManager:
         self.__rate_limit_period_s = rate_limit_period_s
 
     @property
-    def state(self):
-        return copy(self.__state)
+    def state(self) -> StateSnapshot:
+        return self.__state
 
     # Useful for pipeproxy, since it can't read attributes direct.
-    def get(self):
+    def get(self) -> StateSnapshot:
         return self.state
 
     @state.setter
     def state(self, state):
-        self.__state = copy(state)
+        self.__state = StateSnapshot(state, self.__state.version + 1)
 
-    def write_to_file(self, state):
+    # Goes up every time the state changes, so readers can tell if they're out of date.
+    def version(self) -> int:
+        return self.__state.version
+
+    # Turns the whole state into the JSON to store in the state file.
+    def _dump_state(self, state) -> Optional[str]:
 
         # Make sure we're not manipulating state
-        state_to_json = copy(state)
+        state_to_json = {key: _to_json(value) for key, value in state.items()}
 
         now = datetime.now()
 
         current_time = now.strftime("%H:%M:%S")
         state_to_json["last_updated"] = current_time
 
-        # Not the biggest fan of this, but maybe I'll get a better solution for this later
-        if "channel" in state_to_json:  # If its a channel object
-            state_to_json["loaded_item"] = (
-                state_to_json["loaded_item"].__dict__
-                if state_to_json["loaded_item"]
-                else None
-            )
-            state_to_json["show_plan"] = [
-                repr.__dict__ for repr in state_to_json["show_plan"]
-            ]
         try:
-            state_json = json.dumps(state_to_json, indent=2, sort_keys=True)
+            return json.dumps(state_to_json, indent=2, sort_keys=True)
         except Exception:
             self._logException("Failed to dump JSON state.")
-        else:
+            return None
+
+    def write_to_file(self, state):
+        state_json = self._dump_state(state)
+        if state_json is not None:
             with open(self.filepath, "w") as file:
                 file.write(state_json)
 
+    # Replaces the state file in one go, so a crash mid-write can't leave a half written file.
+    def _write_snapshot(self, state_json: str):
+        temp_path = self.filepath + ".tmp"
+        with open(temp_path, "w") as file:
+            file.write(state_json)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.filepath)
+
+    # Applies the changes recorded in the journal(s) on top of the state loaded from the state file.
+    def _replay_journal(self):
+        state = dict(self.state)
+        replayed = 0
+        # The compacting journal (if we died mid compaction) is always older than the live one.
+        for path in [self.compacting_path, self.journal_path]:
+            if not os.path.isfile(path):
+                continue
+            with open(path, "r") as file:
+                for line in file:
+                    try:
+                        changes = json.loads(line)
+                        for change in changes:
+                            key = change[0]
+                            if len(change) > 2:
+                                index = change[2]
+                                items = list(state[key])
+                                items[index] = _from_json(key, change[1], index)
+                                state[key] = items
+                            else:
+                                state[key] = _from_json(key, change[1])
+                    except Exception:
+                        # Most likely we died half way through writing this entry, nothing after it is useful.
+                        self._logException(
+                            "Failed to replay journal entry, ignoring the rest of {}.".format(path)
+                        )
+                        break
+                    replayed += 1
+        self.state = state
+        self._log("Replayed {} journal entries.".format(replayed))
+
+    # Writes the changed keys since the last write to the journal.
+    def _write_to_journal(self):
+        state = self.state
+        changes = []
+        for key, indexes in self.__unsaved.items():
+            if key not in state:
+                continue
+            if indexes is None:
+                changes.append([key, _to_json(state[key])])
+            else:
+                for index in sorted(indexes):
+                    changes.append([key, _to_json(state[key][index]), index])
+        self.__unsaved = {}
+
+        if not changes:
+            return
+
+        try:
+            line = json.dumps(changes) + "\n"
+        except Exception:
+            self._logException("Failed to dump JSON journal entry.")
+            return
+
+        with self.__journal_lock:
+            if not self.__journal_file:
+                self.__journal_file = open(self.journal_path, "a")
+            self.__journal_file.write(line)
+            self.__journal_file.flush()
+            self.__journal_entries += 1
+
+            if self._currentTimeS - self.__journal_last_fsync >= self.__journal_fsync_period_s:
+                os.fsync(self.__journal_file.fileno())
+                self.__journal_last_fsync = self._currentTimeS
+
+            should_compact = (
+                self.__journal_entries >= self.__journal_compact_entries
+                and not self.__compacting
+            )
+
+        if should_compact:
+            self._compact()
+
+    # Rolls the journal into a fresh state file.
+    # In the background, the old journal is kept until the new state file is safely written,
+    # so that it can be replayed again if we die part way through.
+    def _compact(self, background: bool = True):
+        state_json = self._dump_state(self.state)
+        if state_json is None:
+            return
+
+        if not background:
+            self._write_snapshot(state_json)
+            with self.__journal_lock:
+                self._close_journal()
+                for path in [self.compacting_path, self.journal_path]:
+                    if os.path.isfile(path):
+                        os.remove(path)
+            return
+
+        with self.__journal_lock:
+            if self.__compacting:
+                return
+            self.__compacting = True
+            self._close_journal()
+            os.replace(self.journal_path, self.compacting_path)
+
+        def _finish_compacting():
+            try:
+                self._write_snapshot(state_json)
+                os.remove(self.compacting_path)
+            except Exception:
+                self._logException("Failed to compact journal.")
+            finally:
+                self.__compacting = False
+
+        Thread(target=_finish_compacting, daemon=True).start()
+
+    # Writes out anything not yet in the journal, and closes it. It's reopened if there are more changes.
+    def close(self):
+        if not self.__journal:
+            return
+        self._write_to_journal()
+        with self.__journal_lock:
+            self._close_journal()
+
+    # Must be called with the journal lock held.
+    def _close_journal(self):
+        if self.__journal_file:
+            self.__journal_file.flush()
+            os.fsync(self.__journal_file.fileno())
+            self.__journal_file.close()
+            self.__journal_file = None
+        self.__journal_entries = 0
+
     def update(self, key: str, value: Any, index: int = -1):
         update_file = True
         if key in self.__rate_limit_params_until.keys():
@@ -210,12 +443,20 @@ class StateManager:
                     DEBUG,
                 )
                 return
+            if key not in self.__changed_from:
+                self.__changed_from[key] = state_to_update[key]
+            # Copy the list, so anyone holding an older snapshot doesn't see it change underneath them.
+            list_items = list(list_items)
             list_items[index] = value
-            state_to_update[key] = list_items
+            self.__state = state_to_update._replace(key, list_items)
+            if self.__journal and self.__unsaved.get(key, set()) is not None:
+                self.__unsaved.setdefault(key, set()).add(index)
         else:
-            state_to_update[key] = value
-
-        self.state = state_to_update
+            if key not in self.__changed_from:
+                self.__changed_from[key] = state_to_update.get(key)
+            self.__state = state_to_update._replace(key, value)
+            if self.__journal:
+                self.__unsaved[key] = None
 
         if update_file:
             self._log(
@@ -224,21 +465,70 @@ class StateManager:
                 ),
                 DEBUG,
             )
+            if self.__transaction_depth > 0:
+                # We're batching up changes, the write / callbacks will happen once at the end.
+                self.__transaction_dirty = True
+                return
+
             # Either a routine write, or state has changed.
-            # Update the file
-            self.write_to_file(state_to_update)
-            # Now tell any callback functions.
-            for callback in self.callbacks:
-                try:
-                    callback()
-                except Exception as e:
-                    self.logger.log.critical(
-                        "Failed to execute status callback: {}".format(e)
-                    )
+            self._commit()
+
+    # Batches up any updates made inside it, so the state is written to file and the
+    # callbacks are fired once at the end, instead of once per key.
+    # Transactions can be nested, only the outermost one commits.
+    # Note: This can't be used via a proxy, it's for StateManagers owned by the process using them.
+    @contextmanager
+    def transaction(self):
+        self.__transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self.__transaction_depth -= 1
+            if self.__transaction_depth == 0 and self.__transaction_dirty:
+                self.__transaction_dirty = False
+                self._commit()
+
+    # Update the file and tell any callback functions that the state has changed.
+    def _commit(self):
+        if self.__journal:
+            self._write_to_journal()
+        else:
+            self.write_to_file(self.state)
+
+        # This includes any changes that weren't written at the time due to rate limiting.
+        state = self.state
+        changes: StateChanges = {
+            key: (old_value, state.get(key)) for key, old_value in self.__changed_from.items()
+        }
+        self.__changed_from = {}
+
+        for callback, keys in self.callbacks:
+            if keys is not None:
+                if keys.isdisjoint(changes.keys()):
+                    # Nothing they care about has changed.
+                    continue
+                callback_changes = {key: changes[key] for key in keys if key in changes}
+            else:
+                callback_changes = changes
+            try:
+                callback(callback_changes)
+            except Exception as e:
+                self.logger.log.critical(
+                    "Failed to execute status callback: {}".format(e)
+                )
+
+    # Calls function with the changes whenever the state changes.
+    # If keys are given, it's only called when one of those keys changes, and only told about those.
+    def add_callback(
+        self, function: Callable[[StateChanges], Any], keys: Optional[List[str]] = None
+    ):
+        self._log("Adding callback: {} for keys {}".format(str(function), keys))
+        self.callbacks.append((function, set(keys) if keys is not None else None))
 
-    def add_callback(self, function):
-        self._log("Adding callback: {}".format(str(function)))
-        self.callbacks.append(function)
+    def remove_callback(self, function: Callable[[StateChanges], Any]):
+        self.callbacks = [
+            callback for callback in self.callbacks if callback[0] != function
+        ]
 
     def _log(self, text: str, level: int = INFO):
         self.logger.log.log(level, "State Manager: " + text)
@@ -0,0 +1,138 @@
+"""
+    BAPSicle Server
+    Next-gen audio playout server for University Radio York playout,
+    based on WebStudio interface.
+
+    Status Stream
+
+    Players used to broadcast their whole status (show plan and all) on every change.
+    Now they only send their full status when asked for it (or when they start), and otherwise
+    send patches ("deltas") of just what has changed. Each delta has a sequence number, so anyone
+    following along can tell if they've missed one, and ask for the full status again.
+
+    Full status:
+        <channel>:<source>:STATUS:OKAY:{<the usual status>, "status_seq": <seq>}
+    Delta (to be applied on top of the status / delta with seq - 1):
+        <channel>:ALL:STATUSDELTA:OKAY:{
+            "seq": <seq>,
+            "changes": {<key>: <new value>, ...},
+            "show_plan": {"length": <new plan length>, "items": [[<index>, <new item>], ...]}  (If it changed)
+        }
+
+    Date:
+        October 2026
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from baps_types.plan import PlanItem
+
+# The key in full statuses giving the sequence number of the last delta they include.
+STATUS_SEQ_KEY = "status_seq"
+
+
+def _status_value(value: Any) -> Any:
+    if isinstance(value, PlanItem):
+        return value.__dict__
+    return value
+
+
+# Used by the Player to work out what has changed since it last told everyone.
+class StatusDeltaEncoder:
+    seq: int
+
+    def __init__(self):
+        self.seq = 0
+        # What everyone following the deltas currently thinks the status is.
+        self.__sent: Dict[str, Any] = {}
+        self.__sent_plan: List[Dict[str, Any]] = []
+
+    # Gives a delta (as JSON) of the changes to state since the last one, or None if nothing changed.
+    # If check_plan is False, the show plan is assumed not to have changed.
+    def delta(self, state: Dict[str, Any], check_plan: bool = True) -> Optional[str]:
+        changes: Dict[str, Any] = {}
+        for key, value in state.items():
+            if key == "show_plan":
+                continue
+            value = _status_value(value)
+            if key not in self.__sent or self.__sent[key] != value:
+                changes[key] = value
+                self.__sent[key] = value
+
+        plan_json: Optional[str] = None
+        if check_plan and "show_plan" in state:
+            plan: List[PlanItem] = state["show_plan"]
+            sent_plan = self.__sent_plan
+            # Items keep the same __dict__ until they change, so most of the time this is just an "is" check.
+            items = [
+                "[{}, {}]".format(index, item.json)
+                for index, item in enumerate(plan)
+                if index >= len(sent_plan)
+                or (sent_plan[index] is not item.__dict__ and sent_plan[index] != item.__dict__)
+            ]
+            if items or len(plan) != len(sent_plan):
+                plan_json = '"show_plan": {{"length": {}, "items": [{}]}}'.format(
+                    len(plan), ", ".join(items)
+                )
+            self.__sent_plan = [item.__dict__ for item in plan]
+
+        if not changes and not plan_json:
+            return None
+
+        self.seq += 1
+        delta_json = json.dumps({"seq": self.seq, "changes": changes})
+        if plan_json:
+            # The plan items keep their own JSON ready, so stick that on the end.
+            delta_json = "{}, {}}}".format(delta_json[:-1], plan_json)
+        return delta_json
+
+    # Adds the sequence number to a full status JSON.
+    # Make sure any delta() has been sent out first, so it's the same as what the deltas say.
+    def full(self, status_json: str) -> str:
+        return '{{"{}": {}, {}'.format(STATUS_SEQ_KEY, self.seq, status_json[1:])
+
+
+# Used by anyone following a Player's status deltas, to keep a copy of the full status.
+class StatusTracker:
+    status: Optional[Dict[str, Any]]
+    seq: Optional[int]
+    # Whether we've asked for a full status, because we're out of sync.
+    awaiting_full: bool
+
+    def __init__(self):
+        self.status = None
+        self.seq = None
+        self.awaiting_full = False
+
+    @property
+    def in_sync(self) -> bool:
+        return self.status is not None
+
+    def apply_full(self, status: Dict[str, Any]):
+        self.status = status
+        self.seq = status.get(STATUS_SEQ_KEY)
+        self.awaiting_full = False
+
+    # Returns False (and forgets the status) if we've missed a delta, the full status needs getting again.
+    def apply_delta(self, delta: Dict[str, Any]) -> bool:
+        if self.status is None or self.seq is None or delta["seq"] != self.seq + 1:
+            self.status = None
+            self.seq = None
+            return False
+
+        # Don't change the old status dict, someone could still be using it.
+        status = dict(self.status)
+        status.update(delta["changes"])
+
+        if "show_plan" in delta:
+            length = delta["show_plan"]["length"]
+            show_plan = status["show_plan"][:length]
+            show_plan += [None] * (length - len(show_plan))
+            for index, item in delta["show_plan"]["items"]:
+                show_plan[index] = item
+            status["show_plan"] = show_plan
+
+        self.seq = delta["seq"]
+        status[STATUS_SEQ_KEY] = self.seq
+        self.status = status
+        return True
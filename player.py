@@ -23,45 +23,85 @@
 import os
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
 from helpers.os_environment import isLinux
-# It's the only one we could get to work.
-if isLinux():
+# It's the only one we could get to work. (Unless we've been told to use something else, ie a null output for tests.)
+if isLinux() and not os.environ.get("SDL_AUDIODRIVER"):
     os.putenv('SDL_AUDIODRIVER', 'pulseaudio')
 
-from queue import Empty
+from queue import Empty, SimpleQueue
 import multiprocessing
 import setproctitle
-import copy
 import json
 import time
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from pygame import mixer, error
-from mutagen.mp3 import MP3
-from syncer import sync
-from threading import Timer
+from threading import Thread, Timer
 from datetime import datetime
 
 from helpers.normalisation import get_normalised_filename_if_available, get_original_filename_from_normalised
+from helpers.http_pool import close_http_pool
+from helpers.media_index import MediaFile, media_key
 from helpers.myradio_api import MyRadioAPI
-from helpers.state_manager import StateManager
+from helpers.state_manager import StateChanges, StateManager
+from helpers.shared_config import SharedConfig
+from helpers.status_stream import StatusDeltaEncoder
+from helpers.command_lanes import CommandLanes
+from helpers.pcm_cache import PCM_CACHE_MAX_MB, PCMCache
+from helpers.audio_duration import get_duration
 from helpers.logging_manager import LoggingManager
 from baps_types.plan import PlanItem
 from baps_types.marker import Marker
+from baps_types.show_plan import ShowPlan
 import package
 
 # TODO ENUM
 VALID_MESSAGE_SOURCES = ["WEBSOCKET", "UI", "CONTROLLER", "TEST", "ALL"]
 TRACKLISTING_DELAYED_S = 20
 
+# How often (secs) clients are told the playback position whilst playing.
+POS_UPDATES_FREQ_S = 0.2
+# How long (secs) the main loop will block waiting for commands when nothing is playing.
+IDLE_WAIT_S = 1
+# The shortest time (secs) the main loop will block for. Stops us spinning whilst waiting for an item to end.
+MIN_WAIT_S = 0.01
+# How often (secs) the main loop checks whether a file being downloaded for a load has arrived.
+LOAD_POLL_S = 0.05
+# How often (secs) clients are told how a load's download is going.
+LOAD_PROGRESS_FREQ_S = 0.5
+
+# The stages of getting an item loaded into the mixer.
+# TODO ENUM
+LOAD_STATE_UNLOADED = "unloaded"  # Nothing in the mixer.
+LOAD_STATE_DOWNLOADING = "downloading"  # Waiting for the file to download in the background.
+LOAD_STATE_LOADING = "loading"  # In the mixer, but not yet checked that it'll play.
+LOAD_STATE_VERIFIED = "verified"  # Checked it'll play, ready to go.
+LOAD_STATE_FAILED = "failed"  # The mixer couldn't load / play it.
+
 
 class Player:
     out_q: multiprocessing.Queue
+    # Commands waiting to be run, and how many have been dropped (from unknown sources).
+    commands: CommandLanes
+    commands_dropped: int = 0
     last_msg: str
     last_msg_source: str
+    # Older (source, message)s that the command being run replaced. They get the same answer.
+    last_msg_replaced: List[Tuple[str, str]] = []
     last_time_update = None
+    last_pos_sent: Optional[float] = None
+    # The last status JSON we generated, and the state version it was for.
+    last_status: Optional[str] = None
+    last_status_version: Optional[int] = None
 
     state: StateManager
+    # The show plan, kept indexed alongside the one in the state.
+    show_plan: ShowPlan
     logger: LoggingManager
     api: MyRadioAPI
+    status_stream: StatusDeltaEncoder
+    pcm_cache: PCMCache
+    # Files waiting to be (or being) decoded into the PCM cache in the background.
+    pcm_decodes: SimpleQueue
+    pcm_decoding: Set[str]
 
     running: bool = False
 
@@ -70,6 +110,25 @@ class Player:
     tracklist_start_timer: Optional[Timer] = None
     tracklist_end_timer: Optional[Timer] = None
 
+    # Where we've got to loading the loaded item. The item is only checked when it's loaded into the mixer,
+    # so commands can just look at this. The "loaded" state is True when it's verified.
+    load_state: str = LOAD_STATE_UNLOADED
+    # Files that aren't here yet are downloaded in the background, so the channel keeps answering commands.
+    # Each load gets a new id, so a download for a load that's since been replaced / unloaded is ignored.
+    load_id: int = 0
+    # Finished downloads: (load id, plan item, filename or None if it failed, load attempt it's for)
+    load_results: SimpleQueue
+
+    # The look-ahead for auto advance. Whilst an item plays, the next one is got ready and
+    # queued up in the mixer, so it starts the moment this one ends.
+    # The plan item we last tried to get ready (so we don't keep retrying one that failed).
+    prepared_for: Optional[PlanItem] = None
+    # The plan item queued in the mixer, and its length.
+    queued_item: Optional[PlanItem] = None
+    queued_length: float = 0
+    # The last mixer position (ms). It starts again from 0 when the queued item starts.
+    last_mixer_pos: int = 0
+
     # The default state that should be set if there is no previous state info.
     __default_state = {
         "initialised": False,
@@ -91,6 +150,15 @@ class Player:
         "live": True,
         "tracklist_mode": "off",
         "tracklist_id": None,
+        # How many commands have been coalesced / prioritised (see helpers/command_lanes.py), or dropped.
+        "commands_coalesced": 0,
+        "commands_prioritised": 0,
+        "commands_dropped": 0,
+        # How many of this channel's files have had to be waited for (downloaded, or waited for someone else
+        # to download), and how long (secs) for (see helpers/download_lanes.py).
+        "foreground_downloads": 0,
+        "foreground_wait_mean_s": 0.0,
+        "foreground_wait_max_s": 0.0,
     }
 
     # These tell the StateManager which variables we don't care about really accurate history for.
@@ -98,6 +166,18 @@ class Player:
     # But we will rate limit (a few secs) saving updates to these variables to the state JSON file.
     __rate_limited_params = ["pos", "pos_offset", "pos_true", "remaining"]
 
+    # Changes to these don't need to be sent out to clients straight away.
+    # (They can still see them by asking for a STATUS)
+    __status_ignored_params = [
+        "tracklist_id",
+        "commands_coalesced",
+        "commands_prioritised",
+        "commands_dropped",
+        "foreground_downloads",
+        "foreground_wait_mean_s",
+        "foreground_wait_max_s",
+    ]
+
     # Checks if the mixer is init'd. It will throw an exception if not.
     @property
     def isInit(self):
@@ -122,42 +202,47 @@ class Player:
     def isLoaded(self):
         return self.state.get()["loaded"]
 
-    # Checks if a file has been loaded
-    # This should be run with a long test before client requests for status etc.
-    # Short tests are used in other logic in the player, without fussing over full playback tests.
-    def _checkIsLoaded(self, short_test: bool = False):
+    def _set_load_state(self, load_state: str):
+        self.load_state = load_state
+        self.state.update("loaded", load_state == LOAD_STATE_VERIFIED)
 
+    # Checks that an item just loaded into the mixer will actually play.
+    # This is only done once per load (including reloads after output changes), not on every command.
+    def _verify_load(self) -> bool:
         loaded = True
 
         if not self.state.get()["loaded_item"] or not self.isInit:
             loaded = False
         elif not self.isPlaying:
-            # Because this function can be called very often, only some (less
-            # frequent) checks will initiate a full trial of loading success, for
-            # efficiency.
-            if not short_test:
-                # We're not playing now, so we can quickly test run
-                # If that works, we're truely loaded.
+            # We're not playing now, so we can quickly test run
+            # If that works, we're truely loaded.
+            try:
+                mixer.music.set_volume(0)
+                mixer.music.play(0)
+            except Exception:
                 try:
-                    mixer.music.set_volume(0)
-                    mixer.music.play(0)
+                    mixer.music.set_volume(1)
                 except Exception:
-                    try:
-                        mixer.music.set_volume(1)
-                    except Exception:
-                        self.logger.log.exception(
-                            "Failed to reset volume after attempting loaded test."
-                        )
-                        pass
-                    loaded = False
-                finally:
-                    mixer.music.stop()
+                    self.logger.log.exception(
+                        "Failed to reset volume after attempting loaded test."
+                    )
+                    pass
+                loaded = False
+            finally:
+                mixer.music.stop()
 
-                mixer.music.set_volume(1)
+            mixer.music.set_volume(1)
 
-        self.state.update("loaded", loaded)
+        self._set_load_state(LOAD_STATE_VERIFIED if loaded else LOAD_STATE_FAILED)
         return loaded
 
+    # A cheap check (no test playing) that nothing has happened to the mixer since the item was verified.
+    def _check_load_state(self):
+        if self.load_state == LOAD_STATE_VERIFIED and (
+            not self.state.get()["loaded_item"] or not self.isInit
+        ):
+            self._set_load_state(LOAD_STATE_UNLOADED)
+
     # Is the player at a cue marker point?
     @property
     def isCued(self):
@@ -171,23 +256,32 @@ class Player:
     # Returns the state of the player as a nice friendly JSON dump.
     @property
     def status(self):
-        # Get a copy of the server state.
-        state = self.state.state
+        state = self.state.get()
 
-        # Not the biggest fan of this, but maybe I'll get a better solution for this later
-        # Convert objects to a nice JSON friendly dicts.
-        state["loaded_item"] = (
-            state["loaded_item"].__dict__ if state["loaded_item"] else None
+        # Nothing has changed since we last made one, no need to do it again.
+        if self.last_status is not None and self.last_status_version == state.version:
+            return self.last_status
+
+        # The plan items keep their own JSON ready, so stick that on the end of the rest of the state.
+        state_json = {
+            key: value
+            for key, value in state.items()
+            if key not in ["loaded_item", "show_plan"]
+        }
+        res = '{}, "loaded_item": {}, "show_plan": [{}]}}'.format(
+            json.dumps(state_json)[:-1],
+            state["loaded_item"].json if state["loaded_item"] else "null",
+            ", ".join([item.json for item in state["show_plan"]]),
         )
-        state["show_plan"] = [repr.__dict__ for repr in state["show_plan"]]
-
-        res = json.dumps(state)
+        self.last_status = res
+        self.last_status_version = state.version
         return res
 
     # Audio Playout Related Methods
 
     # Loads a plan item into the player, ready for playing.
-    # This includes some retry logic to try and double-down on ensuring it plays successfully.
+    # If the file needs downloading, that's done in the background and this returns straight away,
+    # clients are told how it goes with LOADING, LOADPROGRESS, LOADED and LOADFAILED messages.
 
     def load(self, weight: int):
         if not self.isPlaying:
@@ -204,15 +298,8 @@ class Player:
             )
             self.set_output(loaded_state["output"])
 
-            showplan = loaded_state["show_plan"]
-
-            loaded_item: Optional[PlanItem] = None
-
             # Go find the show plan item of the weight we've been asked to load.
-            for i in range(len(showplan)):
-                if showplan[i].weight == weight:
-                    loaded_item = showplan[i]
-                    break
+            loaded_item: Optional[PlanItem] = self.show_plan.get(weight)
 
             # If we didn't find it, exit.
             if loaded_item is None:
@@ -222,130 +309,264 @@ class Player:
 
             # This item exists, so we're comitting to load this item.
             self.state.update("loaded_item", loaded_item)
+            self._retAll("LOADING:{}".format(weight))
 
-            # The file_manager helper may have pre-downloaded the file already, or we've played it before.
-            reload = False
-            if loaded_item.filename == "" or loaded_item.filename is None:
-                self.logger.log.info(
-                    "Filename is not specified, loading from API.")
-                reload = True
-            elif not os.path.exists(loaded_item.filename):
-                self.logger.log.warn(
-                    "Filename given doesn't exist. Re-loading from API."
+            # If we haven't got the file, get the API to download it, we'll carry on once it's done.
+            if not self._resolve_filename(loaded_item, download=False):
+                self._start_download(loaded_item)
+                return True
+
+            return self._load_file(loaded_item)
+
+        return False
+
+    # Loads the item's file into the mixer.
+    # This includes some retry logic to try and double-down on ensuring it plays successfully.
+    # load_attempt is the attempt to start from, ie when carrying on after downloading the file again.
+    def _load_file(self, loaded_item: PlanItem, load_attempt: int = 1) -> bool:
+        first_attempt = load_attempt
+        # Given we've just messed around with filenames etc, update the item again.
+        self.state.update("loaded_item", loaded_item)
+        if self.show_plan.get(loaded_item.weight) is loaded_item:
+            self.state.update("show_plan", index=loaded_item.weight, value=loaded_item)
+
+        # Let's have 5 attempts at loading the item audio
+        while load_attempt <= 5:
+            original_file = None
+            if load_attempt == 3:
+                # Ok, we tried twice already to load the file.
+                # Let's see if we can recover from this.
+                # Try swapping the normalised version out for the original.
+                original_file = get_original_filename_from_normalised(
+                    loaded_item.filename
                 )
-                reload = True
+                self.logger.log.warning("3rd attempt. Trying the non-normalised file: {}".format(original_file))
 
-            # Ask the API for the file if we need it.
-            if reload:
-                file = sync(self.api.get_filename(item=loaded_item))
-                loaded_item.filename = str(file) if file else None
+            if load_attempt == 4 and first_attempt < 4:
+                # well, we've got so far that the normalised and original files didn't load.
+                # Take a last ditch effort to download the original file again. We'll carry on once it's done.
+                self.logger.log.warning("4th attempt. Trying to redownload the file.")
+                self._start_download(loaded_item, redownload=True, load_attempt=4)
+                return True
 
-            # If the API still couldn't get the file, RIP.
-            if not loaded_item.filename:
-                return False
+            if original_file:
+                loaded_item.filename = original_file
 
-            # Swap with a normalised version if it's ready, else returns original.
-            loaded_item.filename = get_normalised_filename_if_available(
-                loaded_item.filename
-            )
+            load_attempt += 1
+            try:
+                self.logger.log.info(
+                    "Attempt {} Loading file: {}".format(load_attempt - 1, loaded_item.filename))
+                mixer_filename, length = self._get_mixer_file(loaded_item.filename)
+                self._set_load_state(LOAD_STATE_LOADING)
+                mixer.music.load(mixer_filename)
+            except Exception:
+                # We couldn't load that file.
+                self.logger.log.exception(
+                    "Couldn't load file: " + str(loaded_item.filename)
+                )
+                continue  # Try loading again.
 
-            # Given we've just messed around with filenames etc, update the item again.
+            try:
+                self.state.update("length", length or self._get_length(loaded_item))
+            except Exception:
+                self.logger.log.exception(
+                    "Failed to update the length of item.")
+                continue  # Try loading again.
+
+            # Everything worked, we made it!
+            # Write the loaded item again once more, to confirm the filename if we've reattempted.
             self.state.update("loaded_item", loaded_item)
-            for i in range(len(showplan)):
-                if showplan[i].weight == weight:
-                    self.state.update("show_plan", index=i, value=loaded_item)
-                break
-
-            load_attempt = 0
-
-            # Let's have 5 attempts at loading the item audio
-            while load_attempt < 5:
-                load_attempt += 1
-
-                original_file = None
-                if load_attempt == 3:
-                    # Ok, we tried twice already to load the file.
-                    # Let's see if we can recover from this.
-                    # Try swapping the normalised version out for the original.
-                    original_file = get_original_filename_from_normalised(
-                        loaded_item.filename
-                    )
-                    self.logger.log.warning("3rd attempt. Trying the non-normalised file: {}".format(original_file))
 
-                if load_attempt == 4:
-                    # well, we've got so far that the normalised and original files didn't load.
-                    # Take a last ditch effort to download the original file again.
-                    file = sync(self.api.get_filename(item=loaded_item, redownload=True))
-                    if file:
-                        original_file = str(file)
-                    self.logger.log.warning("4rd attempt. Trying to redownload the file, got: {}".format(original_file))
+            # Now just double check that pygame could actually play it (silently)
+            if not self._verify_load():
+                self.logger.log.error(
+                    "Pygame loaded file without error, but never actually loaded."
+                )
+                continue  # Try loading again.
 
-                if original_file:
-                    loaded_item.filename = original_file
+            # If the track has a cue point, let's jump to that, ready.
+            if loaded_item.cue > 0:
+                self.seek(loaded_item.cue)
+            else:
+                self.seek(0)
 
-                try:
-                    self.logger.log.info(
-                        "Attempt {} Loading file: {}".format(load_attempt, loaded_item.filename))
-                    mixer.music.load(loaded_item.filename)
-                except Exception:
-                    # We couldn't load that file.
-                    self.logger.log.exception(
-                        "Couldn't load file: " + str(loaded_item.filename)
-                    )
-                    continue  # Try loading again.
+            self._retAll("LOADED:{}".format(loaded_item.weight))
 
-                try:
-                    if loaded_item.filename.endswith(".mp3"):
-                        song = MP3(loaded_item.filename)
-                        self.state.update("length", song.info.length)
-                    else:
-                        # WARNING! Pygame / SDL can't seek .wav files :/
-                        self.state.update(
-                            "length",
-                            mixer.Sound(
-                                loaded_item.filename).get_length() / 1000,
-                        )
-                except Exception:
-                    self.logger.log.exception(
-                        "Failed to update the length of item.")
-                    continue  # Try loading again.
+            if self.state.get()["play_on_load"]:
+                self.unpause()
 
-                # Everything worked, we made it!
-                # Write the loaded item again once more, to confirm the filename if we've reattempted.
-                self.state.update("loaded_item", loaded_item)
+            return True
 
-                # Now just double check that pygame could actually play it (silently)
-                self._checkIsLoaded()
-                if not self.isLoaded:
-                    self.logger.log.error(
-                        "Pygame loaded file without error, but never actually loaded."
-                    )
-                    continue  # Try loading again.
+        # Even though we failed, make sure state is up to date with latest failure.
+        # We're comitting to load this item.
+        self.state.update("loaded_item", loaded_item)
+        self._set_load_state(LOAD_STATE_FAILED)
+        self._retAll("LOADFAILED:{}".format(loaded_item.weight))
+        return False
 
-                # If the track has a cue point, let's jump to that, ready.
-                if loaded_item.cue > 0:
-                    self.seek(loaded_item.cue)
-                else:
-                    self.seek(0)
+    # Makes sure the item's file is ready to load, asking the API for it if we need (and are allowed) to.
+    # Returns the filename, or None if we couldn't get it.
+    def _resolve_filename(self, item: PlanItem, download: bool = True) -> Optional[str]:
+        # The file_manager helper may have pre-downloaded the file already, or we've played it before,
+        # in which case the media index knows where it (and any normalised version) is, without going to look.
+        media = self._get_media(item)
+        if media:
+            item.filename = media.best_filename
+            return item.filename
+
+        reload = False
+        if item.filename == "" or item.filename is None:
+            self.logger.log.info(
+                "Filename is not specified, loading from API.")
+            reload = True
+        elif not os.path.exists(item.filename):
+            self.logger.log.warn(
+                "Filename given doesn't exist. Re-loading from API."
+            )
+            reload = True
+
+        # Ask the API for the file if we need it.
+        if reload:
+            if not download:
+                return None
+            file = self.api.run(self.api.get_filename(item=item))
+            item.filename = str(file) if file else None
+
+        if not item.filename:
+            return None
+
+        # Swap with a normalised version if it's ready, else returns original.
+        item.filename = get_normalised_filename_if_available(item.filename)
+        return item.filename
+
+    # What the media index knows about the item's file, if it's one from MyRadio that's been downloaded.
+    # Not if the item's been given some other file, that one's its business.
+    def _get_media(self, item: PlanItem) -> Optional[MediaFile]:
+        key = media_key(item)
+        if not key:
+            return None
+        try:
+            media = self.api.media_index.get(key)
+        except Exception:
+            self.logger.log.exception("Failed to look up {} in the media index.".format(key))
+            return None
+        if media and item.filename not in (None, "", media.filename, media.normalised_filename):
+            return None
+        return media
+
+    # Downloads the item's file in a background thread. The main loop carries on loading it once it's done.
+    def _start_download(self, item: PlanItem, redownload: bool = False, load_attempt: int = 1):
+        self._set_load_state(LOAD_STATE_DOWNLOADING)
+        load_id = self.load_id
+        last_progress = 0.0
+
+        def progress(downloaded: int, total: Optional[int]):
+            nonlocal last_progress
+            if time.time() - last_progress >= LOAD_PROGRESS_FREQ_S or downloaded == total:
+                last_progress = time.time()
+                self._retAll(
+                    "LOADPROGRESS:{}:{}:{}".format(item.weight, downloaded, total or "")
+                )
 
-                if loaded_state["play_on_load"]:
-                    self.unpause()
+        def download():
+            file = None
+            try:
+                file = self.api.run(
+                    self.api.get_filename(item=item, redownload=redownload, progress=progress)
+                )
+            except Exception:
+                self.logger.log.exception("Failed to download file for item: {}".format(item.name))
+            self.load_results.put((load_id, item, str(file) if file else None, load_attempt))
 
-                return True
+        self.logger.log.info("Downloading file for {} in the background.".format(item.name))
+        Thread(target=download, name="Player Download", daemon=True).start()
 
-            # Even though we failed, make sure state is up to date with latest failure.
-            # We're comitting to load this item.
-            self.state.update("loaded_item", loaded_item)
-            self._checkIsLoaded()
+    # Carries on with a load once its file has finished downloading.
+    def _finish_download(self):
+        try:
+            load_id, item, filename, load_attempt = self.load_results.get_nowait()
+        except Empty:
+            return
 
-        return False
+        # Something else has been loaded / unloaded since, so we don't need it any more.
+        if load_id != self.load_id or self.load_state != LOAD_STATE_DOWNLOADING:
+            return
+
+        with self.state.transaction():
+            if load_attempt == 1:
+                if not filename:
+                    # If the API couldn't get the file, RIP.
+                    self.logger.log.error("Failed to download file for item: {}".format(item.name))
+                    self.state.update("loaded_item", item)
+                    self._set_load_state(LOAD_STATE_FAILED)
+                    self._retAll("LOADFAILED:{}".format(item.weight))
+                    return
+                item.filename = filename
+                # Swap with a normalised version if it's ready, else keeps the original.
+                media = self._get_media(item)
+                item.filename = media.best_filename if media else get_normalised_filename_if_available(filename)
+            elif filename:
+                item.filename = filename
+            self.logger.log.info("Download finished, got: {}".format(filename))
+            self._load_file(item, load_attempt)
+
+    # Gives the file to hand the mixer for an item's file (the decoded version, if we've got it), and its length if known.
+    # Decoding takes a while, so if we haven't got it, it's decoded in the background, ready for next time.
+    def _get_mixer_file(self, filename: str) -> Tuple[str, Optional[float]]:
+        if PCMCache.is_supported():
+            try:
+                if self.pcm_cache.should_cache(filename):
+                    pcm = self.pcm_cache.get(filename, hash_file=False)
+                    if pcm:
+                        return pcm.filename, pcm.length
+                    if filename not in self.pcm_decoding:
+                        self.pcm_decoding.add(filename)
+                        self.pcm_decodes.put(filename)
+            except Exception:
+                self.logger.log.exception(
+                    "Failed to get decoded version of {}, using the original.".format(filename)
+                )
+        return filename, None
+
+    # Decodes files into the PCM cache, one at a time, off the main loop.
+    def _decode_pcm(self):
+        while True:
+            filename = self.pcm_decodes.get()
+            try:
+                self.pcm_cache.get_or_add(filename)
+            except Exception:
+                self.logger.log.exception("Failed to decode {} into the PCM cache.".format(filename))
+            finally:
+                self.pcm_decoding.discard(filename)
+
+    # Works out the length (secs) of an item's file, remembering it in the media index if it's in there.
+    # (The normalised version is the same length as the original.)
+    def _get_length(self, item: PlanItem) -> float:
+        media = self._get_media(item)
+        if media and media.duration:
+            return media.duration
+
+        length = get_duration(item.filename)
+        if length is None:
+            # Not a format we can read the headers of, so decode the whole thing and see.
+            length = mixer.Sound(item.filename).get_length() / 1000
+        if media and item.filename == media.filename:
+            try:
+                self.api.media_index.set_duration(media.key, length)
+            except Exception:
+                self.logger.log.exception("Failed to save the length of {} to the media index.".format(media.key))
+        return length
 
     # Remove the currently loaded item from the player.
     # Not much reason to do this, but if it makes you happy.
     def unload(self):
         if not self.isPlaying:
             try:
+                # Forget about any file still downloading for the last load.
+                self.load_id += 1
+                self._clear_queue()
                 mixer.music.unload()
+                self._set_load_state(LOAD_STATE_UNLOADED)
                 self.state.update("paused", False)
                 self.state.update("loaded_item", None)
             except Exception:
@@ -369,6 +590,8 @@ class Player:
             return False
         try:
             mixer.music.play(0, pos)
+            # The mixer position starts again from 0, anything queued is kept.
+            self.last_mixer_pos = 0
             self.state.update("pos_offset", pos)
         except Exception:
             self.logger.log.exception("Failed to play at pos: " + str(pos))
@@ -387,6 +610,9 @@ class Player:
         except Exception:
             self.logger.log.exception("Failed to pause.")
             return False
+        finally:
+            # Stopping the mixer throws away anything queued.
+            self._clear_queue()
 
         self.stopped_manually = True
         self.state.update("paused", True)
@@ -408,7 +634,7 @@ class Player:
             # Increment Played count
             loaded_item = state["loaded_item"]
             if loaded_item:
-                loaded_item.play_count_increment()
+                self._mark_played(loaded_item)
                 self.state.update("loaded_item", loaded_item)
 
             return True
@@ -421,6 +647,9 @@ class Player:
         except Exception:
             self.logger.log.exception("Failed to stop playing.")
             return False
+        finally:
+            # Stopping the mixer throws away anything queued.
+            self._clear_queue()
         self.state.update("paused", False)
 
         # When it wasn't _ended() calling this, end the tracklist.
@@ -508,6 +737,9 @@ class Player:
 
     # De-initialises the pygame mixer.
     def quit(self):
+        self._clear_queue()
+        # Whatever was loaded will need loading (and checking) again.
+        self._set_load_state(LOAD_STATE_UNLOADED)
         try:
             mixer.quit()
             self.state.update("paused", False)
@@ -555,7 +787,8 @@ class Player:
     def get_plan(self, show_plan_id: int):
         # Call the API
         # sync turns the asyncronous API into syncronous.
-        plan = sync(self.api.get_showplan(show_plan_id))
+        # The other channels are loading the same plan, only one of us actually asks MyRadio for it.
+        plan = self.api.run(self.api.get_showplan(show_plan_id))
 
         # Empty the channel plan so we can put the updated items in.
         self.clear_channel_plan()
@@ -582,18 +815,12 @@ class Player:
     # These will be in dict format, we'll validate them and turn them into proper plan objects.
     # TODO Allow just moving an item inside the channel instead of removing and adding.
     def add_to_plan(self, new_items: List[Dict[str, Any]]) -> bool:
-        plan_copy: List[PlanItem] = copy.copy(self.state.get()["show_plan"])
+        new_item_objs: List[PlanItem] = []
 
         for new_item in new_items:
             new_item_obj = PlanItem(new_item)
             new_item_obj = self._check_ghosts(new_item_obj)
-
-            # Shift any plan items after the new position down one to make space.
-            for item in plan_copy:
-                if item.weight >= new_item_obj.weight:
-                    item.weight += 1
-
-            plan_copy += [new_item_obj]  # Add the new item.
+            new_item_objs.append(new_item_obj)
 
             loaded_item = self.state.get()["loaded_item"]
             if loaded_item:
@@ -624,35 +851,18 @@ class Player:
 
                 # self.state.update("loaded_item", loaded_item)
 
-        # Just in case somehow we've ended up with items with the same weights (or gaps)
-        # We'll correct them.
-        # This function also orders and saves the updated plan copy we've given it.
-        self._fix_and_update_weights(plan_copy)
+        # Shifts any plan items after the new positions down to make space, all in one go.
+        self.show_plan.insert(new_item_objs)
+        self._update_plan()
 
         return True
 
     # Removes an item from the show plan with the given weight (index)
     def remove_from_plan(self, weight: int) -> bool:
-        plan_copy: List[PlanItem] = copy.copy(self.state.get()["show_plan"])
-        found: Optional[PlanItem] = None
-
-        # Give some helpful debug
-        before = []
-        for item in plan_copy:
-            before += (item.weight, item.name)
-
-        self.logger.log.debug(
-            "Weights before removing weight {}:\n{}".format(weight, before)
-        )
-
-        # Look for the item with the correct weight
-        for i in plan_copy:
-            if i.weight == weight:
-                found = i
-                plan_copy.remove(i)
+        found: Optional[PlanItem] = self.show_plan.remove(weight)
 
         if found:
-            self._fix_and_update_weights(plan_copy)
+            self._update_plan()
 
             # If we removed the loaded item from this channel, update it's weight
             # So we know how/not to autoadvance.
@@ -682,7 +892,8 @@ class Player:
 
     # Empties the channel's plan.
     def clear_channel_plan(self) -> bool:
-        self.state.update("show_plan", [])
+        self.show_plan = ShowPlan()
+        self._update_plan()
         return True
 
     # PlanItems can have markers. These are essentially bookmarked positions in the audio.
@@ -713,18 +924,17 @@ class Player:
         ):
             set_loaded = True
 
-        # Loop over the show plan items. When you find the timeslotitemid the marker is for, update it.
+        # Find the show plan item with the timeslotitemid the marker is for, and update it.
         # This is instead of weight, since the client asking doesn't know the weight of the item (or which channel it is)
         # So all channels will look and update if necessary.
-        plan_copy: List[PlanItem] = copy.copy(self.state.get()["show_plan"])
-        for i in range(len(self.state.get()["show_plan"])):
-
-            item = plan_copy[i]
-
-            if str(item.timeslotitemid) == str(timeslotitemid):
+        weight = self.show_plan.weight_of(timeslotitemid)
+        if weight is not None:
+            item = self.show_plan.get(weight)
+            if item:
                 try:
                     new_item = item.set_marker(marker)
-                    self.state.update("show_plan", new_item, index=i)
+                    self.show_plan.replace(weight, new_item)
+                    self.state.update("show_plan", new_item, index=weight)
 
                 except Exception as e:
                     self.logger.log.error(
@@ -754,20 +964,26 @@ class Player:
     # This marks an item as played, or not.
     # A weight of -1 will affect all items in the channel
     def set_played(self, weight: int, played: bool):
-        plan: List[PlanItem] = self.state.get()["show_plan"]
         if weight == -1:
-            for item in plan:
+            for item in self.show_plan:
                 item.play_count_increment() if played else item.play_count_reset()
-            self.state.update("show_plan", plan)
-        elif len(plan) > weight:
-            plan[weight].play_count_increment() if played else plan[
-                weight
-            ].play_count_reset()
-            self.state.update("show_plan", plan[weight], weight)
-        else:
+            self._update_plan()
+            return True
+
+        item = self.show_plan.get(weight)
+        if not item:
             return False
+        item.play_count_increment() if played else item.play_count_reset()
+        self.state.update("show_plan", item, weight)
         return True
 
+    # Increments an item's played count, making sure its entry in the show plan is sent out again.
+    # (It may have been removed from the plan since being loaded.)
+    def _mark_played(self, item: PlanItem):
+        item.play_count_increment()
+        if self.show_plan.get(item.weight) is item:
+            self.state.update("show_plan", item, item.weight)
+
     # Tells the player that the fader is live on-air, so it can tell tracklisting from PFL
     def set_live(self, live: bool):
 
@@ -965,56 +1181,222 @@ class Player:
         self.stop()
         self._retAll("STOPPED")  # Tell clients that we've stopped playing.
 
-    # This runs every main loop, to update anything that changes often / automatically.
-    def _updateState(self, pos: Optional[float] = None):
-        # Is pygame still happy?
-        isInit = self.isInit
-        self.state.update("initialised", isInit)
-        if isInit:
-            if pos is not None:
-                # Seeking sets the position like this when not playing.
-                self.state.update("pos", pos)  # Reset back to 0 if stopped.
-                self.state.update("pos_offset", 0)
-            elif self.isPlaying:
-                # This is the bit that makes the time actually progress during playback.
-                # Get one last update in, incase we're about to pause/stop it.
-                self.state.update("pos", max(0, mixer.music.get_pos() / 1000))
-
-            # If the state is changing from playing to not playing, and the user didn't stop it, the item must have ended.
-            if (
-                self.state.get()["playing"]
-                and not self.isPlaying
-                and not self.stopped_manually
-            ):
-                self._ended()
-
-            self.state.update("playing", self.isPlaying)
-
-            self.state.update(
-                "pos_true",
-                min(
-                    self.state.get()["length"],
-                    self.state.get()["pos"] + self.state.get()["pos_offset"],
-                ),
+    # Which item auto advance will load when the loaded item ends, if any.
+    def _next_auto_advance_item(self) -> Optional[PlanItem]:
+        state = self.state.get()
+        loaded_item = state["loaded_item"]
+        # Repeat one plays the same item again, and items removed from the channel (weight -1) don't auto advance.
+        if (
+            not loaded_item
+            or not state["auto_advance"]
+            or state["repeat"] == "one"
+            or loaded_item.weight < 0
+        ):
+            return None
+        next_item = self.show_plan.get(loaded_item.weight + 1)
+        if not next_item and state["repeat"] == "all":
+            next_item = self.show_plan.get(0)
+        return next_item
+
+    # Which item can be started straight after the loaded item ends, without going through load().
+    # That's only if load() would have played it from the very start anyway.
+    def _gapless_next_item(self) -> Optional[PlanItem]:
+        if not self.state.get()["play_on_load"]:
+            return None
+        next_item = self._next_auto_advance_item()
+        # The mixer can only start queued items from the beginning, not a cue point.
+        if next_item and next_item.cue > 0:
+            return None
+        return next_item
+
+    # Whilst playing, gets the next item ready (file, length) and queues it up in the mixer.
+    def _prepare_next(self):
+        next_item = self._gapless_next_item()
+        if next_item is self.prepared_for:
+            return
+        self.prepared_for = next_item
+        if not next_item:
+            return
+
+        try:
+            # Downloading here would hold up the main loop, so only queue it if we've already got the file.
+            filename = self._resolve_filename(next_item, download=False)
+            if not filename:
+                self.logger.log.warning(
+                    "Haven't got the file for the next item, it will be loaded once this one ends."
+                )
+                return
+            mixer_filename, length = self._get_mixer_file(filename)
+            length = length or self._get_length(next_item)
+            mixer.music.queue(mixer_filename)
+        except Exception:
+            self.logger.log.exception(
+                "Failed to queue up the next item: " + str(next_item.filename)
             )
+            return
+
+        self.logger.log.info("Queued up the next item: {}".format(filename))
+        self.queued_item = next_item
+        self.queued_length = length
+        # The filename may have changed.
+        self.state.update("show_plan", next_item, index=next_item.weight)
+
+    # The mixer has moved onto the item we queued, so the loaded item has ended.
+    def _queued_item_started(self):
+        next_item = self.queued_item
+        self._clear_queue()
+
+        if next_item is not self._gapless_next_item():
+            # The plan has changed since we queued it, so stop it, and auto advance the usual way.
+            self.logger.log.info("Queued item is no longer the next item, stopping it.")
+            mixer.music.stop()
+            return
+
+        self._potentially_end_tracklist()
 
-            self.state.update(
-                "remaining",
-                max(0, (self.state.get()["length"] -
-                    self.state.get()["pos_true"])),
+        loaded_item = self.state.get()["loaded_item"]
+        self.logger.log.info(
+            "Playback ended of {}, weight {}. Auto advanced to weight {} without a gap.".format(
+                loaded_item.name, loaded_item.weight, next_item.weight
             )
+        )
+
+        self.state.update("loaded_item", next_item)
+        self.state.update("length", self.queued_length)
+        self.state.update("pos_offset", 0)
+        self.state.update("paused", False)
+        # Increment Played count
+        self._mark_played(next_item)
+        self._potentially_tracklist()
+        self.stopped_manually = False
+
+    # Forgets about anything queued in the mixer. (Stopping or loading the mixer throws it away.)
+    def _clear_queue(self):
+        self.queued_item = None
+        self.prepared_for = None
+
+    # This runs every main loop, to update anything that changes often / automatically.
+    def _updateState(self, pos: Optional[float] = None):
+        # Batch all the changes up, so clients only get one status update.
+        with self.state.transaction():
+            # Is pygame still happy?
+            isInit = self.isInit
+            self.state.update("initialised", isInit)
+            if isInit:
+                if pos is not None:
+                    # Seeking sets the position like this when not playing.
+                    self.state.update("pos", pos)  # Reset back to 0 if stopped.
+                    self.state.update("pos_offset", 0)
+                elif self.isPlaying:
+                    mixer_pos = mixer.music.get_pos()
+                    if self.queued_item and mixer_pos < self.last_mixer_pos:
+                        self._queued_item_started()
+                    self.last_mixer_pos = mixer_pos
+
+                    # This is the bit that makes the time actually progress during playback.
+                    # Get one last update in, incase we're about to pause/stop it.
+                    self.state.update("pos", max(0, mixer_pos / 1000))
+
+                # If the state is changing from playing to not playing, and the user didn't stop it, the item must have ended.
+                if (
+                    self.state.get()["playing"]
+                    and not self.isPlaying
+                    and not self.stopped_manually
+                ):
+                    self._ended()
+
+                self.state.update("playing", self.isPlaying)
+
+                if self.isPlaying:
+                    self._prepare_next()
+
+                self.state.update(
+                    "pos_true",
+                    min(
+                        self.state.get()["length"],
+                        self.state.get()["pos"] + self.state.get()["pos_offset"],
+                    ),
+                )
+
+                self.state.update(
+                    "remaining",
+                    max(0, (self.state.get()["length"] -
+                        self.state.get()["pos_true"])),
+                )
 
     # Sends the current playback position to clients, so they can update their UI frequently.
-    # Run on every main loop, but rate limited.
+    # Run on every main loop, but rate limited, and only when the position has actually moved.
     def _ping_times(self):
+        pos_true = self.state.get()["pos_true"]
+        if pos_true == self.last_pos_sent:
+            return
 
-        UPDATES_FREQ_SECS = 0.2
         if (
             self.last_time_update is None
-            or self.last_time_update + UPDATES_FREQ_SECS < time.time()
+            or self.last_time_update + POS_UPDATES_FREQ_S < time.time()
         ):
             self.last_time_update = time.time()
-            self._retAll("POS:" + str(self.state.get()["pos_true"]))
+            self.last_pos_sent = pos_true
+            self._retAll("POS:" + str(pos_true))
+
+    # Works out how long the main loop can block waiting for a command before it needs to
+    # wake up by itself, either to tell clients the new position, to catch the item ending,
+    # or to carry on with a load once its file has downloaded.
+    def _get_wait_timeout(self) -> float:
+        if self.load_state == LOAD_STATE_DOWNLOADING:
+            # Check back soon, to carry on loading once the file's downloaded.
+            return LOAD_POLL_S
+
+        if not self.isPlaying:
+            # Nothing is changing on its own, so we only need waking for new commands.
+            return IDLE_WAIT_S
+
+        timeout = POS_UPDATES_FREQ_S
+        if self.last_time_update is not None:
+            timeout = self.last_time_update + POS_UPDATES_FREQ_S - time.time()
+
+        # Wake up right as the item should end, so auto advance etc isn't delayed.
+        state = self.state.get()
+        if state["length"] > 0:
+            timeout = min(timeout, state["remaining"])
+
+        return max(MIN_WAIT_S, timeout)
+
+    # Picks up any new command messages from clients. If there's nothing to run, waits for one,
+    # but wakes up in time for the next position update / end of the item if we're playing.
+    def _read_commands(self, in_q: multiprocessing.Queue):
+        try:
+            if not len(self.commands):
+                self._add_command(in_q.get(timeout=self._get_wait_timeout()))
+            # Grab everything else that's come in, so it can be sorted into lanes.
+            while True:
+                self._add_command(in_q.get_nowait())
+        except Empty:
+            pass
+
+        state = self.state.get()
+        download_stats = self.api.lanes.get_stats()
+        for key, value in [
+            ("commands_coalesced", self.commands.coalesced),
+            ("commands_prioritised", self.commands.prioritised),
+            ("commands_dropped", self.commands_dropped),
+            ("foreground_downloads", download_stats["foreground_downloads"]),
+            ("foreground_wait_mean_s", download_stats["foreground_wait_mean_s"]),
+            ("foreground_wait_max_s", download_stats["foreground_wait_max_s"]),
+        ]:
+            if state[key] != value:
+                self.state.update(key, value)
+
+    def _add_command(self, message: str):
+        source = message.split(":")[0]
+        if source not in VALID_MESSAGE_SOURCES:
+            self.commands_dropped += 1
+            self.logger.log.warn(
+                "Message from unknown sender source: {}".format(
+                    source)
+            )
+            return
+        self.commands.add(source, message.split(":", 1)[1])
 
     # Broadcast a message to all other modules of the BAPSicle server.
     def _retAll(self, msg):
@@ -1025,7 +1407,8 @@ class Player:
     def _retMsg(
         self, msg: Any, okay_str: bool = False, custom_prefix: Optional[str] = None
     ):
-        response = "{}:".format(self.state.get()["channel"])
+        channel = self.state.get()["channel"]
+        response = "{}:".format(channel)
         # Make sure to add the message source back, so that it can be sent to the correct destination in the main server.
         if custom_prefix:
             response += custom_prefix
@@ -1042,10 +1425,17 @@ class Player:
             response += "FAIL"
 
         if self.out_q:
-            if "STATUS:" not in response:
+            if "STATUS:" not in response and "STATUSDELTA:" not in response:
                 # Don't fill logs with status pushes, it's a mess.
                 self.logger.log.debug(("Sending: {}".format(response)))
             self.out_q.put(response)
+
+            # Anything the command replaced gets the same answer.
+            if not custom_prefix:
+                result = response[len("{}:{}:{}:".format(channel, self.last_msg_source, self.last_msg)):]
+                for source, message in self.last_msg_replaced:
+                    self.out_q.put("{}:{}:{}:{}".format(channel, source, message, result))
+                self.last_msg_replaced = []
         else:
             self.logger.log.exception(
                 "Message return Queue is missing!!!! Can't send message."
@@ -1053,38 +1443,25 @@ class Player:
 
     # Send the current status to all other modules/clients. Used for updating
     # all client UIs when one of them causes a change etc.
-    def _send_status(self):
-        self._retMsg(str(self.status), okay_str=True,
-                     custom_prefix="ALL:STATUS:")
-
-    # Takes an input show plan, checks and corrects duplicate / gaps in weights, and stores it.
-    def _fix_and_update_weights(self, plan: List[PlanItem]):
-        def _sort_weight(e: PlanItem):
-            return e.weight
-
-        before = []
-        for item in plan:
-            before += (item.weight, item.name)
-
-        self.logger.log.debug("Weights before fixing:\n{}".format(before))
-
-        plan.sort(key=_sort_weight)  # Sort into weighted order.
-
-        sorted = []
-        for item in plan:
-            sorted += (item.weight, item.name)
-
-        self.logger.log.debug("Weights after sorting:\n{}".format(sorted))
-
-        for i in range(len(plan)):
-            plan[i].weight = i  # Recorrect the weights on the channel.
+    # Only what has changed is sent, as a delta on the last one (see helpers/status_stream.py)
+    def _send_status(self, changes: StateChanges):
+        delta = self.status_stream.delta(
+            self.state.get(), check_plan="show_plan" in changes
+        )
+        if delta:
+            self._retMsg(delta, okay_str=True, custom_prefix="ALL:STATUSDELTA:")
 
-        fixed = []
-        for item in plan:
-            fixed += (item.weight, item.name)
+    # The full status, with the sequence number of the last delta that it matches.
+    def _full_status(self) -> str:
+        # Make sure anyone following the deltas is up to date with this status first.
+        delta = self.status_stream.delta(self.state.get())
+        if delta:
+            self._retMsg(delta, okay_str=True, custom_prefix="ALL:STATUSDELTA:")
+        return self.status_stream.full(self.status)
 
-        self.logger.log.debug("Weights after sorting:\n{}".format(fixed))
-        self.state.update("show_plan", plan)
+    # Stores the show plan in the state, after it has been changed.
+    def _update_plan(self):
+        self.state.update("show_plan", self.show_plan.items())
 
     # Player start up. This is called from the BAPSicle server.py.
     def __init__(
@@ -1092,7 +1469,7 @@ class Player:
         channel: int,
         in_q: multiprocessing.Queue,
         out_q: multiprocessing.Queue,
-        server_state: StateManager,
+        server_state: SharedConfig,
     ):
 
         process_title = "BAPSicle - Player: Channel " + str(channel)
@@ -1106,18 +1483,45 @@ class Player:
             "Player" + str(channel), debug=package.BETA)
 
         self.api = MyRadioAPI(self.logger, server_state)
+        self.commands = CommandLanes()
+        self.load_results = SimpleQueue()
+        self.pcm_cache = PCMCache(
+            max_bytes=server_state.get().get("pcm_cache_max_mb", PCM_CACHE_MAX_MB) * 1024 * 1024,
+            index=self.api.media_index,
+        )
+        self.pcm_decodes = SimpleQueue()
+        self.pcm_decoding = set()
+        Thread(target=self._decode_pcm, name="Player PCM Cache", daemon=True).start()
 
         self.state = StateManager(
             "Player" + str(channel),
             self.logger,
             self.__default_state,
             self.__rate_limited_params,
+            journal=True,
         )
 
         self.state.update("start_time", datetime.now().timestamp())
+        for key in [
+            "commands_coalesced",
+            "commands_prioritised",
+            "commands_dropped",
+            "foreground_downloads",
+            "foreground_wait_mean_s",
+            "foreground_wait_max_s",
+        ]:
+            self.state.update(key, 0)
 
         # When the state changes, use _send_status() to tell all clients.
-        self.state.add_callback(self._send_status)
+        self.status_stream = StatusDeltaEncoder()
+        self.state.add_callback(
+            self._send_status,
+            keys=[
+                key
+                for key in self.__default_state.keys()
+                if key not in self.__status_ignored_params
+            ],
+        )
 
         self.state.update("channel", channel)
         # tracklist mode is shared between all players, so grab that from the server config.
@@ -1128,8 +1532,8 @@ class Player:
         )  # Channel Fader is live until controller says it isn't.
 
         # Just in case there's any weights somehow messed up, let's fix them.
-        plan_copy: List[PlanItem] = copy.copy(self.state.get()["show_plan"])
-        self._fix_and_update_weights(plan_copy)
+        self.show_plan = ShowPlan(self.state.get()["show_plan"])
+        self._update_plan()
 
         loaded_state = self.state.state
 
@@ -1167,150 +1571,143 @@ class Player:
         else:
             self.logger.log.info("No file was previously loaded to resume.")
 
+        # Let everyone know where we're starting from, so they can follow the deltas.
+        self._retMsg(self._full_status(), okay_str=True, custom_prefix="ALL:STATUS:")
+
         # The main loop. This keeps running till something tells it to stop.
         try:
             while self.running:
+                # Carry on with any load that was waiting for its file to download.
+                self._finish_download()
                 # Update the state for playback position changes etc
                 self._updateState()
                 # If we need to, tell clients of the position updates
                 self._ping_times()
-                try:
-                    # Try and get a new command message from clients
-                    message = in_q.get_nowait()
-                    source = message.split(":")[0]
-                    if source not in VALID_MESSAGE_SOURCES:
-                        self.last_msg_source = ""
-                        self.last_msg = ""
-                        self.logger.log.warn(
-                            "Message from unknown sender source: {}".format(
-                                source)
-                        )
-                        continue
-
-                    self.last_msg_source = source
-                    self.last_msg = message.split(":", 1)[1]
+                # Pick up any new command messages from clients.
+                self._read_commands(in_q)
+                command = self.commands.next()
+                # If nothing came in before the timeout, skip message processing.
+                # The state will be updated at the top of the next loop.
+                if command:
+                    self.last_msg_source, self.last_msg, self.last_msg_replaced = command
 
                     self.logger.log.debug(
                         "Recieved message from source {}: {}".format(
                             self.last_msg_source, self.last_msg
                         )
                     )
-                except Empty:
-                    # The incomming message queue was empty,
-                    # skip message processing
 
-                    # If we're getting no messages, sleep.
-                    # But if we do have messages, once we've done with one, we'll check for the next one more quickly.
-                    time.sleep(0.05)
-                else:
-
-                    # We got a message.
-
-                    # Check if we're successfully loaded
-                    # This is here so that we can check often, but not every single loop
-                    # Only when user gives input.
-                    self._checkIsLoaded()
-
-                    # Output re-inits the mixer, so we can do this any time.
-                    if self.last_msg.startswith("OUTPUT"):
-                        split = self.last_msg.split(":")
-                        self._retMsg(self.set_output(split[1]))
-
-                    # Only process these commands if we're properly initialised.
-                    elif self.isInit:
-                        message_types: Dict[
-                            str, Callable[..., Any]
-                        ] = {  # TODO Check Types
-                            "STATUS": lambda: self._retMsg(self.status, True),
-                            # Audio Playout
-                            # Unpause, so we don't jump to 0, we play from the current pos.
-                            "PLAY": lambda: self._retMsg(self.unpause()),
-                            "PAUSE": lambda: self._retMsg(self.pause()),
-                            "PLAYPAUSE": lambda: self._retMsg(
-                                self.unpause() if not self.isPlaying else self.pause()
-                            ),  # For the hardware controller.
-                            "UNPAUSE": lambda: self._retMsg(self.unpause()),
-                            "STOP": lambda: self._retMsg(
-                                self.stop(user_initiated=True)
-                            ),
-                            "SEEK": lambda: self._retMsg(
-                                self.seek(float(self.last_msg.split(":")[1]))
-                            ),
-                            "AUTOADVANCE": lambda: self._retMsg(
-                                self.set_auto_advance(
-                                    (self.last_msg.split(":")[1] == "True")
-                                )
-                            ),
-                            "REPEAT": lambda: self._retMsg(
-                                self.set_repeat(self.last_msg.split(":")[1])
-                            ),
-                            "PLAYONLOAD": lambda: self._retMsg(
-                                self.set_play_on_load(
-                                    (self.last_msg.split(":")[1] == "True")
-                                )
-                            ),
-                            # Show Plan Items
-                            "GETPLAN": lambda: self._retMsg(
-                                self.get_plan(int(self.last_msg.split(":")[1]))
-                            ),
-                            "LOAD": lambda: self._retMsg(
-                                self.load(int(self.last_msg.split(":")[1]))
-                            ),
-                            "LOADED?": lambda: self._retMsg(self.isLoaded),
-                            "UNLOAD": lambda: self._retMsg(self.unload()),
-                            "ADD": lambda: self._retMsg(
-                                self.add_to_plan([
-                                    json.loads(
-                                        ":".join(self.last_msg.split(":")[1:]))
-                                ])
-                            ),
-                            "REMOVE": lambda: self._retMsg(
-                                self.remove_from_plan(
-                                    int(self.last_msg.split(":")[1]))
-                            ),
-                            "CLEAR": lambda: self._retMsg(self.clear_channel_plan()),
-                            "SETMARKER": lambda: self._retMsg(
-                                self.set_marker(
-                                    self.last_msg.split(":")[1],
-                                    self.last_msg.split(":", 2)[2],
-                                )
-                            ),
-                            "RESETPLAYED": lambda: self._retMsg(
-                                self.set_played(
-                                    weight=int(self.last_msg.split(":")[1]),
-                                    played=False,
-                                )
-                            ),
-                            "SETPLAYED": lambda: self._retMsg(
-                                self.set_played(
-                                    weight=int(self.last_msg.split(":")[1]), played=True
-                                )
-                            ),
-                            "SETLIVE": lambda: self._retMsg(
-                                self.set_live(
-                                    self.last_msg.split(":")[1] == "True")
-                            ),
-                        }
-
-                        message_type: str = self.last_msg.split(":")[0]
-
-                        # From the list above, work out which command type we have, and run it's handling function.
-                        if message_type in message_types.keys():
-                            message_types[message_type]()
-
-                        elif self.last_msg == "QUIT":
-                            self._retMsg(True)
-                            self.running = False
-                            continue
-
-                        else:
-                            self._retMsg("Unknown Command")
-                    else:
-                        # We're not initialised, return a failed status if they asked for one, or just say the command failed
-                        if self.last_msg == "STATUS":
-                            self._retMsg(self.status)
+                    # Batch up all the changes this command makes, so clients get one status update.
+                    with self.state.transaction():
+
+                        # We got a message.
+
+                        # Check nothing's happened to the loaded item since it was verified.
+                        # This is here so that we can check often, but not every single loop
+                        # Only when user gives input.
+                        self._check_load_state()
+
+                        # Output re-inits the mixer, so we can do this any time.
+                        if self.last_msg.startswith("OUTPUT"):
+                            split = self.last_msg.split(":")
+                            self._retMsg(self.set_output(split[1]))
+
+                        # Only process these commands if we're properly initialised.
+                        elif self.isInit:
+                            message_types: Dict[
+                                str, Callable[..., Any]
+                            ] = {  # TODO Check Types
+                                "STATUS": lambda: self._retMsg(self._full_status(), True),
+                                # Audio Playout
+                                # Unpause, so we don't jump to 0, we play from the current pos.
+                                "PLAY": lambda: self._retMsg(self.unpause()),
+                                "PAUSE": lambda: self._retMsg(self.pause()),
+                                "PLAYPAUSE": lambda: self._retMsg(
+                                    self.unpause() if not self.isPlaying else self.pause()
+                                ),  # For the hardware controller.
+                                "UNPAUSE": lambda: self._retMsg(self.unpause()),
+                                "STOP": lambda: self._retMsg(
+                                    self.stop(user_initiated=True)
+                                ),
+                                "SEEK": lambda: self._retMsg(
+                                    self.seek(float(self.last_msg.split(":")[1]))
+                                ),
+                                "AUTOADVANCE": lambda: self._retMsg(
+                                    self.set_auto_advance(
+                                        (self.last_msg.split(":")[1] == "True")
+                                    )
+                                ),
+                                "REPEAT": lambda: self._retMsg(
+                                    self.set_repeat(self.last_msg.split(":")[1])
+                                ),
+                                "PLAYONLOAD": lambda: self._retMsg(
+                                    self.set_play_on_load(
+                                        (self.last_msg.split(":")[1] == "True")
+                                    )
+                                ),
+                                # Show Plan Items
+                                "GETPLAN": lambda: self._retMsg(
+                                    self.get_plan(int(self.last_msg.split(":")[1]))
+                                ),
+                                "LOAD": lambda: self._retMsg(
+                                    self.load(int(self.last_msg.split(":")[1]))
+                                ),
+                                "LOADED?": lambda: self._retMsg(self.isLoaded),
+                                "UNLOAD": lambda: self._retMsg(self.unload()),
+                                "ADD": lambda: self._retMsg(
+                                    self.add_to_plan([
+                                        json.loads(
+                                            ":".join(self.last_msg.split(":")[1:]))
+                                    ])
+                                ),
+                                "REMOVE": lambda: self._retMsg(
+                                    self.remove_from_plan(
+                                        int(self.last_msg.split(":")[1]))
+                                ),
+                                "CLEAR": lambda: self._retMsg(self.clear_channel_plan()),
+                                "SETMARKER": lambda: self._retMsg(
+                                    self.set_marker(
+                                        self.last_msg.split(":")[1],
+                                        self.last_msg.split(":", 2)[2],
+                                    )
+                                ),
+                                "RESETPLAYED": lambda: self._retMsg(
+                                    self.set_played(
+                                        weight=int(self.last_msg.split(":")[1]),
+                                        played=False,
+                                    )
+                                ),
+                                "SETPLAYED": lambda: self._retMsg(
+                                    self.set_played(
+                                        weight=int(self.last_msg.split(":")[1]), played=True
+                                    )
+                                ),
+                                "SETLIVE": lambda: self._retMsg(
+                                    self.set_live(
+                                        self.last_msg.split(":")[1] == "True")
+                                ),
+                            }
+
+                            message_type: str = self.last_msg.split(":")[0]
+
+                            # From the list above, work out which command type we have, and run it's handling function.
+                            if message_type in message_types.keys():
+                                message_types[message_type]()
+
+                            elif self.last_msg == "QUIT":
+                                self._retMsg(True)
+                                self.running = False
+                                continue
+
+                            else:
+                                self._retMsg("Unknown Command")
                         else:
-                            self._retMsg(False)
+                            # We're not initialised, return a failed status if they asked for one,
+                            # or just say the command failed
+                            if self.last_msg == "STATUS":
+                                self._retMsg(self._full_status())
+                            else:
+                                self._retMsg(False)
 
         # Catch the player being killed externally.
         except KeyboardInterrupt:
@@ -1324,6 +1721,9 @@ class Player:
         self.logger.log.info("Quiting player " + str(channel))
         self.quit()
         self._retAll("QUIT")
+        # os._exit() doesn't run the atexit handlers, so close the connections (and the journal) ourselves.
+        close_http_pool()
+        self.state.close()
         del self.logger
         os._exit(0)
 
@@ -33,15 +33,15 @@ class PlayerHandler:
                     command = message.split(":")[1]
 
                     # Let the file manager manage the files based on status and loading new show plan triggers.
-                    if command == "GETPLAN" or command == "STATUS":
+                    if command in ["GETPLAN", "STATUS", "STATUSDELTA"]:
                         file_to_q.put(q_msg)
 
                     # TODO ENUM
                     if source in ["ALL", "WEBSOCKET"]:
                         websocket_to_q.put(q_msg)
                     if source in ["ALL", "UI"]:
-                        if not message.split(":")[1] == "POS":
-                            # We don't care about position update spam
+                        if message.split(":")[1] not in ["POS", "STATUSDELTA", "LOADPROGRESS"]:
+                            # We don't care about position update / status delta / download progress spam
                             ui_to_q.put(q_msg)
                     if source in ["ALL", "CONTROLLER"]:
                         controller_to_q.put(q_msg)
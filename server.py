@@ -31,7 +31,11 @@ if not isMacOS():
 
 import package
 from typing import Dict, List
-from helpers.state_manager import StateManager
+from helpers.shared_config import (
+    SharedConfig,
+    create_shared_config_memory,
+    create_shared_state_manager,
+)
 from helpers.logging_manager import LoggingManager
 from websocket_server import WebsocketServer
 from web_server import WebServer
@@ -72,6 +76,10 @@ class BAPSicleServer:
         "running_state": "running",
         "tracklist_mode": "off",
         "normalisation_mode": "off",
+        "preload_concurrency": 4,
+        "preload_bandwidth_kbps": 0,
+        "music_cache_max_mb": 4096,
+        "pcm_cache_max_mb": 1024,
     }
 
     player_to_q: List[Queue] = []
@@ -216,11 +224,17 @@ class BAPSicleServer:
 
         # Since we're passing the StateManager across processes, it must be made a manager.
         # PLEASE NOTE: You can't read attributes directly, use state.get()["var"] and state.update("var", "val")
-        ProxyManager.register("StateManager", StateManager)
+        # Every change is also published to shared memory, so that get() can be read locally by every process.
+        # (The memory must be made before starting any processes, see create_shared_config_memory())
+        self.config_memory = create_shared_config_memory()
+        ProxyManager.register("StateManager", create_shared_state_manager)
         manager = ProxyManager()
         manager.start()
-        self.state: StateManager = manager.StateManager(
-            "BAPSicleServer", self.logger, self.default_state
+        self.state = SharedConfig(
+            manager.StateManager(
+                "BAPSicleServer", self.logger, self.default_state, self.config_memory.name
+            ),
+            self.config_memory.name,
         )
 
         self.state.update("running_state", "running")
@@ -334,6 +348,10 @@ class BAPSicleServer:
 
         del self.player
 
+        # Everyone that was using the config has gone now.
+        self.config_memory.close()
+        self.config_memory.unlink()
+
         print("Stopped all processes.")
 
 
@@ -0,0 +1,261 @@
+import unittest
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional
+
+from helpers.logging_manager import LoggingManager
+from helpers.state_manager import StateManager
+
+test_dir = os.path.dirname(os.path.realpath(__file__)) + "/"
+resource_dir = test_dir + "resources/"
+with open(resource_dir + "1sec.mp3", "rb") as track_file:
+    TRACK = track_file.read()
+
+
+# A server config (as the server's StateManager would give) for talking to MyRadio at url.
+# State is anything else the test needs in it.
+def stand_in_config(name: str, logger: LoggingManager, url: str = "", **state: Any) -> StateManager:
+    config = StateManager(
+        name,
+        logger,
+        default_state={
+            "myradio_api_url": url,
+            "myradio_base_url": url,
+            "myradio_api_key": "test",
+            "myradio_api_tracklist_source": "",
+            **state,
+        },
+    )
+    # (It's kept from the last run, so the defaults might not be used.)
+    config.update("myradio_api_url", url)
+    config.update("myradio_base_url", url)
+    for key, value in state.items():
+        config.update(key, value)
+    return config
+
+
+# A file the stand-in MyRadio serves.
+class StandInFile:
+    body: bytes
+    # Headers (ie ETag / Last-Modified) that say which version of the file it is. With them, Range requests
+    # are answered with the rest of the file, if If-Range says it's the same version.
+    validators: Dict[str, str]
+    # Drops the connection after sending this many bytes of each response, if set.
+    drop_after: Optional[int]
+
+    def __init__(self, body: bytes, validators: Optional[Dict[str, str]] = None, drop_after: Optional[int] = None):
+        self.body = body
+        self.validators = validators or {}
+        self.drop_after = drop_after
+
+
+# Stands in for MyRadio (the API, and the audio files), on localhost.
+# What it serves, and how, is set by the test (and can be changed whilst it's running).
+class StandInMyRadio:
+    url: str
+    config: StateManager
+    # For talking to it over HTTPS, if it is.
+    cert: Optional[str] = None
+    ssl_context: Optional[ssl.SSLContext] = None
+
+    # What it serves: the file for each key (ie "track-1234"), or None if there isn't one (404).
+    # By default, every track is a second of audio, and there aren't any managed items.
+    file_for: Callable[[str], Optional[StandInFile]]
+    # The payload for each API path (ie "/v2/timeslot/1/showplan"), for GETs and POSTs.
+    api: Dict[str, Any]
+
+    # How long (secs) it takes to start answering each request, as a far away (or busy) server would.
+    delay_s: float = 0.0
+    # Files are sent a chunk (of chunk_bytes) at a time, waiting chunk_delay_s before each.
+    chunk_bytes: int = 64 * 1024
+    chunk_delay_s: float = 0.0
+    # The bandwidth (bytes / sec) of the connection to it, shared between all the requests, if it's limited.
+    link_bytes_per_s: float = 0.0
+
+    # What's been asked for: the path of every request, where each file request asked to start from,
+    # how many connections were made, how many requests were answered at once (at most),
+    # and how many bytes of files have been sent.
+    requests: List[str]
+    starts: List[int]
+    connections: int
+    in_flight: int
+    most_in_flight: int
+    bytes_sent: int
+
+    # Name is for its config. State is anything else the test needs in the config.
+    def __init__(self, name: str, logger: LoggingManager, https: bool = False, **state: Any):
+        self.file_for = lambda key: StandInFile(TRACK) if key.startswith("track-") else None
+        self.api = {}
+        self.lock = Lock()
+        self.__link_free_at = 0.0
+        self.reset()
+
+        # Each stand-in has its own handler class, so it knows which stand-in it's for.
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), type("Handler", (_StandInHandler,), {"stand_in": self}))
+        self.__cert_dir = None
+        if https:
+            self.__use_https()
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "{}://127.0.0.1:{}".format("https" if https else "http", self.server.server_port)
+        self.config = stand_in_config(name, logger, self.url, **state)
+
+    # Serves it over HTTPS, with a certificate made just for it.
+    def __use_https(self):
+        self.__cert_dir = tempfile.mkdtemp()
+        cert = self.cert = os.path.join(self.__cert_dir, "cert.pem")
+        key = os.path.join(self.__cert_dir, "key.pem")
+        try:
+            subprocess.run(
+                [
+                    "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", key, "-out", cert,
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except (OSError, subprocess.CalledProcessError):
+            self.server.server_close()
+            shutil.rmtree(self.__cert_dir, ignore_errors=True)
+            raise unittest.SkipTest("Need openssl to make a certificate for the HTTPS stand-in.")
+
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert, key)
+        self.server.socket = server_context.wrap_socket(self.server.socket, server_side=True)
+        self.ssl_context = ssl.create_default_context(cafile=cert)
+
+    # Forgets what's been asked for so far.
+    def reset(self):
+        with self.lock:
+            self.requests = []
+            self.starts = []
+            self.connections = 0
+            self.in_flight = 0
+            self.most_in_flight = 0
+            self.bytes_sent = 0
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.__cert_dir:
+            shutil.rmtree(self.__cert_dir, ignore_errors=True)
+
+    # Waits (if the link's limited) until there's room on it to send count bytes.
+    def _wait_for_link(self, count: int):
+        if not self.link_bytes_per_s:
+            return
+        with self.lock:
+            now = time.monotonic()
+            send_at = max(now, self.__link_free_at)
+            self.__link_free_at = send_at + count / self.link_bytes_per_s
+        time.sleep(max(0.0, send_at - now))
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # As a real server would, else the body waits for the headers to be ACKed.
+    disable_nagle_algorithm = True
+    stand_in: StandInMyRadio
+
+    def setup(self):
+        if self.stand_in.link_bytes_per_s:
+            # Don't let the OS soak up much of a download the client isn't reading yet.
+            self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.stand_in.chunk_bytes)
+        super().setup()
+        with self.stand_in.lock:
+            self.stand_in.connections += 1
+
+    # Waits as long as it takes the stand-in to start answering.
+    def _delay(self):
+        stand_in = self.stand_in
+        with stand_in.lock:
+            stand_in.requests.append(self.path)
+            stand_in.in_flight += 1
+            stand_in.most_in_flight = max(stand_in.most_in_flight, stand_in.in_flight)
+        time.sleep(stand_in.delay_s)
+        with stand_in.lock:
+            stand_in.in_flight -= 1
+
+    def _respond(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond_api(self, status: int):
+        path = self.path.split("?")[0]
+        for prefix, payload in self.stand_in.api.items():
+            if path.startswith(prefix):
+                self._respond(status, json.dumps({"payload": payload}).encode(), "application/json")
+                return
+        self._respond(404, b"Not found", "text/plain")
+
+    # Sends the file, or the rest of it from the Range asked for, if it's still the same version (If-Range).
+    def _respond_file(self, file: StandInFile):
+        stand_in = self.stand_in
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range") in file.validators.values():
+            start = int(self.headers["Range"][len("bytes="):].split("-")[0])
+        with stand_in.lock:
+            stand_in.starts.append(start)
+
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(file.body) - start))
+        if start:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(file.body) - 1, len(file.body)))
+        for name, value in file.validators.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        # (Without copying it, it could be big.)
+        body = memoryview(file.body)[start:]
+        if file.drop_after is not None and len(body) > file.drop_after:
+            body = body[: file.drop_after]
+            self.close_connection = True
+        try:
+            for i in range(0, len(body), stand_in.chunk_bytes):
+                chunk = body[i:i + stand_in.chunk_bytes]
+                time.sleep(stand_in.chunk_delay_s)
+                stand_in._wait_for_link(len(chunk))
+                self.wfile.write(chunk)
+                with stand_in.lock:
+                    stand_in.bytes_sent += len(chunk)
+        except OSError:
+            # They've gone.
+            self.close_connection = True
+
+    def do_GET(self):
+        self._delay()
+        if self.path.startswith("/NIPSWeb/"):
+            query = self.path.split("?", 1)[-1]
+            key = None
+            for param, item_type in [("trackid=", "track"), ("managedid=", "managed")]:
+                if query.startswith(param):
+                    key = "{}-{}".format(item_type, query[len(param):].split("&")[0])
+            file = self.stand_in.file_for(key) if key else None
+            if file:
+                self._respond_file(file)
+            else:
+                self._respond(404, b"Not found", "text/plain")
+            return
+        self._respond_api(200)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._delay()
+        self._respond_api(201)
+
+    # Don't fill the test output with every request.
+    def log_message(self, format, *args):
+        pass
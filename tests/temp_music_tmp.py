@@ -0,0 +1,17 @@
+import tempfile
+from typing import Callable
+from unittest.mock import patch
+
+from helpers import os_environment
+
+
+# Points music-tmp (see resolve_music_tmp_path()) at a new temporary folder, for this process and any it starts,
+# until it's cleaned up. Add_cleanup is the test's addCleanup (or addClassCleanup, for all its tests).
+# Gives the folder.
+def use_temp_music_tmp(add_cleanup: Callable) -> str:
+    folder = tempfile.TemporaryDirectory()
+    add_cleanup(folder.cleanup)
+    patcher = patch.object(os_environment, "MUSIC_TMP_PATH", folder.name)
+    patcher.start()
+    add_cleanup(patcher.stop)
+    return folder.name
@@ -0,0 +1,163 @@
+import unittest
+import os
+import struct
+import tempfile
+import time
+import wave
+from typing import List, Tuple
+
+from pygame import mixer
+
+from helpers.audio_duration import get_duration
+from helpers.logging_manager import LoggingManager
+
+test_dir = os.path.dirname(os.path.realpath(__file__)) + "/"
+resource_dir = test_dir + "resources/"
+
+# CD quality, as 1h+ recordings of shows etc usually are.
+RATE = 44100
+CHANNELS = 2
+SAMPLE_BYTES = 2
+BYTE_RATE = RATE * CHANNELS * SAMPLE_BYTES
+
+# Lengths (hours) of the long WAVs to benchmark probing, and the length (mins) of one to decode as before.
+BENCHMARK_HOURS = [1, 3]
+BENCHMARK_DECODE_MINS = 5
+BENCHMARK_PROBES = 100
+
+
+# Writes a WAV of silence, with any extra chunks before the data chunk.
+# The audio isn't actually written, so the file is sparse (ie takes no time / space to make).
+def _write_wav(
+    filename: str, data_size: int, extra_chunks: List[Tuple[bytes, bytes]] = [], size_field: int = -1
+):
+    with open(filename, "wb") as file:
+        chunks = b"WAVE" + struct.pack(
+            "<4sIHHIIHH", b"fmt ", 16, 1, CHANNELS, RATE, BYTE_RATE, CHANNELS * SAMPLE_BYTES, SAMPLE_BYTES * 8
+        )
+        for chunk_id, chunk in extra_chunks:
+            chunks += struct.pack("<4sI", chunk_id, len(chunk)) + chunk + b"\0" * (len(chunk) % 2)
+        chunks += struct.pack("<4sI", b"data", data_size if size_field < 0 else size_field)
+        file.write(struct.pack("<4sI", b"RIFF", min(len(chunks) + data_size, 0xFFFFFFFF)) + chunks)
+        file.truncate(file.tell() + data_size)
+
+
+class TestAudioDuration(unittest.TestCase):
+
+    logger: LoggingManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_AudioDuration")
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.temp_path = folder.name + "/"
+
+    def test_mp3(self):
+        for length in [1, 2, 5]:
+            self.assertAlmostEqual(
+                get_duration(resource_dir + "{}sec.mp3".format(length)), length, delta=0.1
+            )
+
+    def test_wav(self):
+        filename = self.temp_path + "written.wav"
+        with wave.open(filename, "wb") as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(8000)
+            file.writeframes(b"\0\0" * 12000)
+        self.assertEqual(get_duration(filename), 1.5)
+
+        # Odd sized chunks before the audio are padded, and should be skipped over.
+        filename = self.temp_path + "chunks.wav"
+        _write_wav(filename, BYTE_RATE * 2, [(b"LIST", b"odd"), (b"bext", b"\0" * 10)])
+        self.assertEqual(get_duration(filename), 2)
+
+    def test_wav_unknown_size(self):
+        # Recorders that are still going (or crashed) leave the data size unset.
+        filename = self.temp_path + "unknown.wav"
+        _write_wav(filename, BYTE_RATE * 3, size_field=0xFFFFFFFF)
+        self.assertEqual(get_duration(filename), 3)
+
+        # Or it says there's more than there actually is.
+        filename = self.temp_path + "truncated.wav"
+        _write_wav(filename, BYTE_RATE * 3, size_field=BYTE_RATE * 10)
+        self.assertEqual(get_duration(filename), 3)
+
+    def test_changed_file(self):
+        filename = self.temp_path + "changing.wav"
+        _write_wav(filename, BYTE_RATE * 2)
+        self.assertEqual(get_duration(filename), 2)
+
+        _write_wav(filename, BYTE_RATE * 4)
+        os.utime(filename, ns=(time.time_ns(), time.time_ns() + 1000000))
+        self.assertEqual(get_duration(filename), 4)
+
+    def test_unknown(self):
+        self.assertIsNone(get_duration(self.temp_path + "missing.wav"))
+
+        filename = self.temp_path + "garbage.ogg"
+        with open(filename, "wb") as file:
+            file.write(b"This isn't audio.")
+        self.assertIsNone(get_duration(filename))
+
+    # Compares probing the headers of long WAV recordings, against decoding them (as the player used to).
+    def test_benchmark_long_wav(self):
+        for hours in BENCHMARK_HOURS:
+            filename = self.temp_path + "{}h.wav".format(hours)
+            _write_wav(filename, BYTE_RATE * 3600 * hours)
+
+            start = time.perf_counter()
+            self.assertEqual(get_duration(filename), 3600 * hours)
+            first = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(BENCHMARK_PROBES):
+                get_duration(filename)
+            remembered = (time.perf_counter() - start) / BENCHMARK_PROBES
+
+            self.logger.log.info(
+                "Probing a {}h WAV: first {:.1f}us, remembered {:.1f}us".format(
+                    hours, first * 1000000, remembered * 1000000
+                )
+            )
+            os.remove(filename)
+
+        # Decoding a whole hour takes too long / too much memory for a test, so decode a bit and scale it up.
+        filename = self.temp_path + "decode.wav"
+        _write_wav(filename, BYTE_RATE * 60 * BENCHMARK_DECODE_MINS)
+        audio_driver = os.environ.get("SDL_AUDIODRIVER")
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+        try:
+            mixer.init(RATE, -16, CHANNELS, 1024)
+            start = time.perf_counter()
+            length = mixer.Sound(filename).get_length()
+            decoded = time.perf_counter() - start
+        finally:
+            mixer.quit()
+            if audio_driver is None:
+                del os.environ["SDL_AUDIODRIVER"]
+            else:
+                os.environ["SDL_AUDIODRIVER"] = audio_driver
+
+        self.assertAlmostEqual(length, 60 * BENCHMARK_DECODE_MINS, delta=0.1)
+        self.logger.log.info(
+            "Decoding a {} min WAV (the old way): {:.0f}ms, ~{:.1f}s and {:.0f}MB of RAM per hour".format(
+                BENCHMARK_DECODE_MINS,
+                decoded * 1000,
+                decoded * 60 / BENCHMARK_DECODE_MINS,
+                BYTE_RATE * 3600 / 1024 / 1024,
+            )
+        )
+        self.assertLess(first, decoded)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
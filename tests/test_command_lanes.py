@@ -0,0 +1,75 @@
+import unittest
+from typing import List
+
+from helpers.command_lanes import CommandLanes
+
+
+class TestCommandLanes(unittest.TestCase):
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        self.lanes = CommandLanes()
+
+    def _add(self, *messages: str):
+        for message in messages:
+            self.lanes.add("TEST", message)
+
+    def _run_all(self) -> List[str]:
+        messages = []
+        while True:
+            command = self.lanes.next()
+            if not command:
+                break
+            messages.append(command[1])
+        self.assertEqual(len(self.lanes), 0)
+        return messages
+
+    def test_in_order(self):
+        self._add("LOAD:0", "SEEK:1.0", "STATUS", "LOAD:1")
+        self.assertEqual(len(self.lanes), 4)
+        self.assertEqual(self._run_all(), ["LOAD:0", "SEEK:1.0", "STATUS", "LOAD:1"])
+        self.assertIsNone(self.lanes.next())
+
+    def test_transport_before_plan_edits(self):
+        self._add("ADD:a", "GETPLAN:1", "PAUSE", "ADD:b", "STOP")
+        self.assertEqual(self._run_all(), ["PAUSE", "STOP", "ADD:a", "GETPLAN:1", "ADD:b"])
+        self.assertEqual(self.lanes.prioritised, 2)
+
+    def test_transport_stays_after_others(self):
+        # Playing has to wait for the load, which has to wait for the item to be added.
+        self._add("ADD:a", "LOAD:0", "ADD:b", "PLAY")
+        self.assertEqual(self._run_all(), ["ADD:a", "LOAD:0", "PLAY", "ADD:b"])
+
+        self._add("STATUS", "STOP")
+        self.assertEqual(self._run_all(), ["STATUS", "STOP"])
+
+    def test_coalesce(self):
+        self._add("SEEK:1.0", "SEEK:2.0", "SEEK:3.0")
+        self.assertEqual(len(self.lanes), 1)
+        self.assertEqual(
+            self.lanes.next(),
+            ("TEST", "SEEK:3.0", [("TEST", "SEEK:1.0"), ("TEST", "SEEK:2.0")]),
+        )
+
+        self._add("LOAD:0", "LOAD:1")
+        self.assertEqual(self._run_all(), ["LOAD:1"])
+        self.assertEqual(self.lanes.coalesced, 3)
+
+    def test_only_coalesce_runs(self):
+        self._add("SEEK:1.0", "LOAD:0", "SEEK:2.0", "ADD:a", "SEEK:3.0", "STOP", "SEEK:4.0")
+        self.assertEqual(
+            self._run_all(), ["SEEK:1.0", "LOAD:0", "SEEK:2.0", "ADD:a", "SEEK:3.0", "STOP", "SEEK:4.0"]
+        )
+
+        # Once it's been run, it can't be replaced.
+        self._add("SEEK:1.0")
+        self.lanes.next()
+        self._add("SEEK:2.0")
+        self.assertEqual(self._run_all(), ["SEEK:2.0"])
+        self.assertEqual(self.lanes.coalesced, 0)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
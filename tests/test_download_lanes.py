@@ -0,0 +1,220 @@
+import unittest
+import asyncio
+import os
+import time
+from typing import List
+
+from baps_types.plan import PlanItem
+from helpers.download_lanes import FOREGROUND_FILE_PATH, FOREGROUND_HOLD_S, DownloadLanes, TokenBucket
+from helpers.logging_manager import LoggingManager
+from helpers.myradio_api import MyRadioAPI
+from helpers.os_environment import resolve_music_tmp_path
+from helpers.preloader import Preloader
+from helpers.state_manager import StateManager
+from tests.stand_in_myradio import StandInFile, StandInMyRadio
+from tests.temp_music_tmp import use_temp_music_tmp
+
+# The studio's connection, shared between everything downloading from the stand-in MyRadio.
+LINK_BYTES_PER_S = 32 * 1024 * 1024
+# Background preloads going when a player wants something, and how big they are.
+BACKGROUND_FILES = 4
+BACKGROUND_FILE_BYTES = 24 * 1024 * 1024
+FOREGROUND_FILE_BYTES = 4 * 1024 * 1024
+FIRST_MANAGEDID = 970000
+FOREGROUND_MANAGEDID = FIRST_MANAGEDID + BACKGROUND_FILES
+# How long (secs) the background downloads have had going before the foreground one starts.
+BACKGROUND_HEAD_START_S = 0.2
+# Limit (KB/s) to hold background downloads to.
+BACKGROUND_LIMIT_KBPS = 4096
+
+
+def _item(managedid: int) -> PlanItem:
+    return PlanItem(
+        {
+            "timeslotitemid": managedid,
+            "weight": 0,
+            "managedid": managedid,
+            "type": "aux",
+            "title": "Recording {}".format(managedid),
+            "length": "00:10:00",
+        }
+    )
+
+
+def _filename(managedid: int) -> str:
+    return resolve_music_tmp_path("managed-{}.mp3".format(managedid))
+
+
+class TestDownloadLanes(unittest.TestCase):
+
+    logger: LoggingManager
+    myradio: StandInMyRadio
+    config: StateManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_DownloadLanes")
+        # On the other end of a limited connection, shared between all the downloads.
+        cls.myradio = StandInMyRadio("Test_DownloadLanes", cls.logger, preload_bandwidth_kbps=0)
+        cls.myradio.link_bytes_per_s = LINK_BYTES_PER_S
+        foreground = StandInFile(bytes(FOREGROUND_FILE_BYTES))
+        background = StandInFile(bytes(BACKGROUND_FILE_BYTES))
+        cls.myradio.file_for = lambda key: foreground if key == "managed-{}".format(FOREGROUND_MANAGEDID) else background
+        cls.config = cls.myradio.config
+
+    # clean up logic for the test suite declared in the test module
+    # code that is executed after all tests in one test run
+    @classmethod
+    def tearDownClass(cls):
+        cls.myradio.close()
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        use_temp_music_tmp(self.addCleanup)
+        self.config.update("preload_bandwidth_kbps", 0)
+
+    def _remove_files(self):
+        filenames = [resolve_music_tmp_path(FOREGROUND_FILE_PATH)]
+        for managedid in range(FIRST_MANAGEDID, FOREGROUND_MANAGEDID + 1):
+            filename = _filename(managedid)
+            filenames += [filename, filename + ".partial", filename + ".partial.meta"]
+        for filename in filenames:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(1024 * 1024)
+        start = time.monotonic()
+        waited = 0.0
+        for _ in range(8):
+            waited += asyncio.run(bucket.take(64 * 1024))
+        took = time.monotonic() - start
+        self.assertAlmostEqual(took, 0.5, delta=0.15)
+        self.assertAlmostEqual(waited, took, delta=0.05)
+
+        # Unlimited.
+        bucket.set_rate(0)
+        self.assertEqual(asyncio.run(bucket.take(1024 * 1024 * 1024)), 0)
+
+    # Another process downloading something it needs right now pauses background downloads.
+    def test_foreground_pauses_background(self):
+        foreground = DownloadLanes()
+        background = DownloadLanes()
+        self.assertFalse(background.foreground_active())
+
+        asyncio.run(foreground.start(False))
+        time.sleep(0.1)
+        self.assertTrue(background.foreground_active())
+
+        # Once it stops saying it's going, background ones carry on.
+        start = time.time()
+        asyncio.run(background.chunk(True, 1))
+        self.assertGreater(time.time() - start, FOREGROUND_HOLD_S / 2)
+        self.assertFalse(background.foreground_active())
+        self.assertGreater(background.get_stats()["background_paused_s"], 0)
+
+    def test_background_limit(self):
+        self.config.update("preload_bandwidth_kbps", BACKGROUND_LIMIT_KBPS)
+        api = MyRadioAPI(self.logger, self.config)
+        start = time.perf_counter()
+        self.assertEqual(
+            api.run(api.get_filename(_item(FOREGROUND_MANAGEDID), background=True)), _filename(FOREGROUND_MANAGEDID)
+        )
+        took = time.perf_counter() - start
+
+        # Not much quicker than the limit allows, even though the link could do it a lot quicker.
+        limited_s = FOREGROUND_FILE_BYTES / (BACKGROUND_LIMIT_KBPS * 1024)
+        self.logger.log.info(
+            "Background download of {:.0f}MB limited to {}KB/s: {:.0f}ms".format(
+                FOREGROUND_FILE_BYTES / 1024 / 1024, BACKGROUND_LIMIT_KBPS, took * 1000
+            )
+        )
+        self.assertGreater(took, limited_s * 0.8)
+        self.assertGreater(api.lanes.get_stats()["background_limited_s"], 0)
+
+    # A player needing a file the file manager is preloading (limited) gets it as quick as it would have on its own.
+    def test_wanted_background_download(self):
+        self.config.update("preload_bandwidth_kbps", BACKGROUND_LIMIT_KBPS)
+        file_manager_api = MyRadioAPI(self.logger, self.config)
+        player_api = MyRadioAPI(self.logger, self.config)
+        preload = file_manager_api.pool.submit(
+            file_manager_api.get_filename(_item(FIRST_MANAGEDID), background=True)
+        )
+        time.sleep(BACKGROUND_HEAD_START_S)
+
+        start = time.perf_counter()
+        self.assertEqual(player_api.run(player_api.get_filename(_item(FIRST_MANAGEDID))), _filename(FIRST_MANAGEDID))
+        took = time.perf_counter() - start
+        self.assertEqual(preload.result(timeout=30), _filename(FIRST_MANAGEDID))
+
+        limited_s = BACKGROUND_FILE_BYTES / (BACKGROUND_LIMIT_KBPS * 1024)
+        self.logger.log.info(
+            "Player waiting for a {:.0f}MB preload limited to {}KB/s: {:.0f}ms (limited the whole way ~{:.0f}ms)".format(
+                BACKGROUND_FILE_BYTES / 1024 / 1024, BACKGROUND_LIMIT_KBPS, took * 1000, limited_s * 1000
+            )
+        )
+        self.assertLess(took, limited_s / 2)
+        self.assertGreater(file_manager_api.lanes.get_stats()["background_promoted_bytes"], 0)
+        # The time spent waiting for the preload counts towards the player's wait.
+        stats = player_api.lanes.get_stats()
+        self.assertEqual(stats["foreground_downloads"], 1)
+        self.assertAlmostEqual(stats["foreground_wait_max_s"], took, delta=0.1)
+
+    # Times a player's download, whilst the file manager is busy preloading.
+    # The players and file manager are different processes, each with their own API (and lanes).
+    def _time_foreground(self, lanes: bool) -> float:
+        file_manager_api = MyRadioAPI(self.logger, self.config)
+        player_api = MyRadioAPI(self.logger, self.config)
+        preloader = Preloader(self.logger, file_manager_api, BACKGROUND_FILES)
+        background: List = []
+        for managedid in range(FIRST_MANAGEDID, FIRST_MANAGEDID + BACKGROUND_FILES):
+            if lanes:
+                preloader.add(_item(managedid))
+            else:
+                # As it was, the same as anything else.
+                background.append(file_manager_api.pool.submit(file_manager_api.get_filename(_item(managedid))))
+        time.sleep(BACKGROUND_HEAD_START_S)
+
+        self.assertEqual(
+            player_api.run(player_api.get_filename(_item(FOREGROUND_MANAGEDID))), _filename(FOREGROUND_MANAGEDID)
+        )
+        took = player_api.lanes.get_stats()["foreground_wait_max_s"]
+
+        # Let the background ones finish, so they don't get in the way of the next go.
+        for future in background:
+            self.assertIsNotNone(future.result(timeout=30))
+        give_up_at = time.time() + 30
+        while preloader.get_stats()["queued"] or preloader.get_stats()["in_flight"]:
+            self.assertLess(time.time(), give_up_at)
+            time.sleep(0.05)
+        if lanes:
+            self.assertEqual(preloader.get_stats()["done"], BACKGROUND_FILES)
+            self.assertGreater(file_manager_api.lanes.get_stats()["background_paused_s"], 0)
+        self._remove_files()
+        return took
+
+    # Compares how long a player waits for its download whilst preloading is going, with and without the lanes.
+    def test_benchmark_foreground_wait(self):
+        shared = self._time_foreground(lanes=False)
+        laned = self._time_foreground(lanes=True)
+        alone_s = FOREGROUND_FILE_BYTES / LINK_BYTES_PER_S
+        self.logger.log.info(
+            "Player downloading {:.0f}MB whilst {} files preload, over a {:.0f}MB/s link: "
+            "sharing the link {:.0f}ms, with preloads paused {:.0f}ms (on its own it'd be ~{:.0f}ms)".format(
+                FOREGROUND_FILE_BYTES / 1024 / 1024,
+                BACKGROUND_FILES,
+                LINK_BYTES_PER_S / 1024 / 1024,
+                shared * 1000,
+                laned * 1000,
+                alone_s * 1000,
+            )
+        )
+        self.assertLess(laned, shared)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import multiprocessing
+import os
+import tempfile
+import time
+from threading import Thread
+
+from helpers.file_lock import FileLock
+from helpers.os_environment import isWindows
+
+
+# Holds the lock in another process until told to let go, or killed.
+def _hold_lock(filename: str, holding, release):
+    lock = FileLock(filename)
+    lock.acquire()
+    holding.set()
+    release.wait()
+    lock.release()
+
+
+class TestFileLock(unittest.TestCase):
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.filename = os.path.join(folder.name, "test.lock")
+        self.holding = multiprocessing.Event()
+        self.release = multiprocessing.Event()
+        self.holder = multiprocessing.Process(
+            target=_hold_lock, args=(self.filename, self.holding, self.release)
+        )
+
+    # clean up logic
+    # code that is executed after each test
+    def tearDown(self):
+        if self.holder.is_alive():
+            self.holder.terminate()
+
+    def test_exclusive_between_processes(self):
+        self.holder.start()
+        self.assertTrue(self.holding.wait(10))
+
+        lock = FileLock(self.filename)
+        self.assertFalse(lock.try_acquire())
+        if not isWindows():
+            # (Windows doesn't let anyone else read the locked file.)
+            self.assertEqual(lock.owner(), self.holder.pid)
+        start = time.time()
+        self.assertFalse(lock.acquire(timeout=0.2))
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+        self.release.set()
+        self.assertTrue(lock.acquire(timeout=10))
+        self.assertTrue(lock.locked)
+        lock.release()
+        self.assertFalse(lock.locked)
+
+    def test_released_when_holder_dies(self):
+        self.holder.start()
+        self.assertTrue(self.holding.wait(10))
+        self.holder.kill()
+        self.holder.join()
+
+        with FileLock(self.filename) as lock:
+            self.assertTrue(lock.locked)
+        self.assertTrue(os.path.isfile(self.filename))
+
+    def test_exclusive_in_process(self):
+        with FileLock(self.filename):
+            self.assertFalse(FileLock(self.filename).try_acquire())
+        lock = FileLock(self.filename)
+        self.assertTrue(lock.try_acquire())
+        lock.release()
+
+    # Anyone waiting when it's removed gets a new lock file, which is the one everyone else then uses.
+    @unittest.skipIf(isWindows(), "Windows doesn't let open files be removed.")
+    def test_removed_on_release(self):
+        lock = FileLock(self.filename)
+        lock.acquire()
+        waiter = FileLock(self.filename)
+        waiting = Thread(target=waiter.acquire, args=(10,))
+        waiting.start()
+        time.sleep(0.1)
+        lock.release(remove=True)
+        waiting.join()
+
+        self.assertTrue(waiter.locked)
+        self.assertFalse(FileLock(self.filename).try_acquire())
+        waiter.release(remove=True)
+        self.assertFalse(os.path.exists(self.filename))
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import unittest
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from baps_types.plan import PlanItem
+from helpers import audio_duration
+from helpers.audio_duration import get_duration
+from helpers.logging_manager import LoggingManager
+from helpers.media_index import MEDIA_INDEX_FILENAME, MediaIndex, file_sha1, media_key
+from helpers.normalisation import get_normalised_filename_if_available
+
+test_dir = os.path.dirname(os.path.realpath(__file__)) + "/"
+resource_dir = test_dir + "resources/"
+
+# How many files to look up when benchmarking, half of them normalised.
+BENCHMARK_FILES = 200
+
+
+# Adds a file to the index (in path), from another process.
+def _add(path: str, key: str, filename: str):
+    MediaIndex(path).add(key, filename)
+
+
+class TestMediaIndex(unittest.TestCase):
+
+    logger: LoggingManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_MediaIndex")
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = folder.name
+        self.index = MediaIndex(self.path)
+
+    # clean up logic
+    # code that is executed after each test
+    def tearDown(self):
+        self.index.close()
+
+    # Copies one of the test tracks in, as if it was downloaded.
+    def _download(self, key: str, length: int = 5) -> str:
+        filename = os.path.join(self.path, "{}.mp3".format(key))
+        shutil.copyfile(resource_dir + "{}sec.mp3".format(length), filename)
+        return filename
+
+    def _normalise(self, key: str) -> str:
+        normalised_filename = os.path.join(self.path, "{}-normalised.mp3".format(key))
+        shutil.copyfile(os.path.join(self.path, "{}.mp3".format(key)), normalised_filename)
+        self.index.set_normalised(key, normalised_filename, -14.5)
+        return normalised_filename
+
+    def test_media_key(self):
+        def item(**ids) -> PlanItem:
+            return PlanItem({"timeslotitemid": 0, "weight": 0, "title": "Item", "length": "00:00:01", **ids})
+
+        self.assertEqual(media_key(item(trackid=12)), "track-12")
+        self.assertEqual(media_key(item(managedid=3)), "managed-3")
+        self.assertIsNone(media_key(item()))
+
+    def test_add(self):
+        self.assertIsNone(self.index.get("track-1"))
+        filename = self._download("track-1")
+        media = self.index.add("track-1", filename)
+        self.assertEqual(media.filename, filename)
+        self.assertEqual(media.best_filename, filename)
+        self.assertEqual(media.size, os.path.getsize(filename))
+        self.assertEqual(media.sha1, file_sha1(filename))
+        self.assertAlmostEqual(media.duration, 5, delta=0.1)
+        self.assertIsNone(media.normalised_filename)
+
+        normalised_filename = self._normalise("track-1")
+        media = self.index.get("track-1")
+        self.assertEqual(media.best_filename, normalised_filename)
+        self.assertEqual(media.loudness, -14.5)
+
+        # Adding it again doesn't change anything, apart from it being used.
+        self.assertEqual(self.index.add("track-1", filename).normalised_filename, normalised_filename)
+
+        # Different contents, so the normalised version (made from the old ones) is no good.
+        self._download("track-1", 1)
+        media = self.index.add("track-1", filename)
+        self.assertAlmostEqual(media.duration, 1, delta=0.1)
+        self.assertIsNone(media.normalised_filename)
+        self.assertFalse(os.path.exists(normalised_filename))
+
+        self.index.set_duration("track-1", 1.5)
+        self.assertEqual(self.index.get("track-1").duration, 1.5)
+        self.assertEqual(list(self.index.get_all()), ["track-1"])
+        self.index.remove("track-1")
+        self.assertEqual(self.index.get_all(), {})
+
+        # Nothing to add.
+        self.assertIsNone(self.index.add("track-2", os.path.join(self.path, "track-2.mp3")))
+
+    def test_counters(self):
+        self.assertEqual(self.index.get_counters(), {})
+        self.index.count("hits")
+        self.index.count("hits", 2)
+        self.index.count("misses")
+        self.assertEqual(self.index.get_counters(), {"hits": 3, "misses": 1})
+
+    # Every process sees what the others have added.
+    def test_processes(self):
+        # (Connected before forking, so the child has to make its own.)
+        self.assertIsNone(self.index.get("managed-1"))
+        filename = self._download("managed-1")
+        process = multiprocessing.Process(target=_add, args=(self.path, "managed-1", filename))
+        process.start()
+        process.join(timeout=10)
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.index.get("managed-1").filename, filename)
+
+    # An index from another version is started again.
+    def test_version(self):
+        self.index.add("track-1", self._download("track-1"))
+        self.index.close()
+        connection = sqlite3.connect(os.path.join(self.path, MEDIA_INDEX_FILENAME))
+        connection.execute("PRAGMA user_version = 0")
+        connection.close()
+
+        self.assertIsNone(MediaIndex(self.path).get("track-1"))
+
+    # Compares what loading an item used to do to find out about its file (is it there, is there a normalised
+    # version, how long is it), against asking the index.
+    def test_benchmark_lookup(self):
+        keys = ["track-{}".format(i) for i in range(BENCHMARK_FILES)]
+        for i, key in enumerate(keys):
+            self.index.add(key, self._download(key))
+            if i % 2:
+                self._normalise(key)
+
+        def chain():
+            for key in keys:
+                filename = os.path.join(self.path, "{}.mp3".format(key))
+                self.assertTrue(os.path.exists(filename))
+                filename = get_normalised_filename_if_available(filename)
+                self.assertIsNotNone(get_duration(filename))
+
+        def index():
+            for key in keys:
+                media = self.index.get(key)
+                self.assertIsNotNone(media.best_filename)
+                self.assertIsNotNone(media.duration)
+
+        # Durations are only remembered by the process that probed them, so a new player has to probe again.
+        audio_duration._probe.cache_clear()
+        start = time.perf_counter()
+        chain()
+        chain_cold_s = time.perf_counter() - start
+        start = time.perf_counter()
+        chain()
+        chain_warm_s = time.perf_counter() - start
+
+        # A new connection, as a new player would have.
+        self.index.close()
+        start = time.perf_counter()
+        index()
+        index_cold_s = time.perf_counter() - start
+        start = time.perf_counter()
+        index()
+        index_warm_s = time.perf_counter() - start
+
+        self.logger.log.info(
+            "Looking up {} files (half normalised), per file: exists / normalised / duration checks {:.1f}us "
+            "({:.1f}us once the durations are remembered), media index {:.1f}us ({:.1f}us once connected)".format(
+                BENCHMARK_FILES,
+                chain_cold_s / BENCHMARK_FILES * 1000000,
+                chain_warm_s / BENCHMARK_FILES * 1000000,
+                index_cold_s / BENCHMARK_FILES * 1000000,
+                index_warm_s / BENCHMARK_FILES * 1000000,
+            )
+        )
+        self.assertLess(index_cold_s, chain_cold_s)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,250 @@
+import unittest
+import os
+import random
+import shutil
+import time
+from typing import List
+
+from baps_types.plan import PlanItem
+from helpers.file_lock import FileLock
+from helpers.logging_manager import LoggingManager
+from helpers.music_cache import MUSIC_CACHE_PARTIAL_MAX_AGE_S, MusicCache
+from helpers.myradio_api import DOWNLOAD_LOCK_PATH, MyRadioAPI
+from helpers.preloader import Preloader
+from tests.stand_in_myradio import stand_in_config
+from tests.temp_music_tmp import use_temp_music_tmp
+
+FILE_BYTES = 256 * 1024
+
+# A day's worth of shows, each with some of the station's regulars (jingles, beds, the playlist) and some of its own.
+SHOWS = 8
+ITEMS_PER_SHOW = 60
+REGULARS = 60
+REGULARS_PER_SHOW = 30
+# Room for a few shows worth of files.
+BENCHMARK_MAX_BYTES = 3 * ITEMS_PER_SHOW * FILE_BYTES
+
+
+class TestMusicCache(unittest.TestCase):
+
+    logger: LoggingManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_MusicCache")
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        self.path = use_temp_music_tmp(self.addCleanup)
+        self.cache = MusicCache(4 * FILE_BYTES)
+
+    # clean up logic
+    # code that is executed after each test
+    def tearDown(self):
+        self.cache.index.close()
+
+    # "Downloads" a file, as MyRadioAPI would.
+    def _download(self, key: str, contents: bytes = b"") -> str:
+        filename = os.path.join(self.path, "{}.mp3".format(key))
+        with open(filename, "wb") as file:
+            file.write(contents or key.encode().ljust(FILE_BYTES, b"\0"))
+        return filename
+
+    def test_get_add(self):
+        self.assertIsNone(self.cache.get("track-1"))
+        filename = self._download("track-1")
+        self.cache.add("track-1")
+        self.assertEqual(self.cache.get("track-1"), filename)
+
+        stats = self.cache.get_stats()
+        self.assertEqual(stats["files"], 1)
+        self.assertEqual(stats["bytes"], FILE_BYTES)
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+        # Gone behind our back, noticed next time we look.
+        os.remove(filename)
+        self.cache.sync()
+        self.assertIsNone(self.cache.get("track-1"))
+        self.assertEqual(self.cache.get_stats()["files"], 0)
+
+    # The index (and what's in it) survives a restart.
+    def test_persists(self):
+        filename = self._download("managed-2")
+        self.cache.add("managed-2")
+        self.cache.get("managed-2")
+        self.cache.index.close()
+
+        cache = MusicCache(4 * FILE_BYTES, self.path)
+        self.assertEqual(cache.get_stats()["hits"], 1)
+        self.assertEqual(cache.get("managed-2"), filename)
+        self.assertEqual(cache.get_stats()["hits"], 2)
+
+        # Files from before there was an index are picked up too.
+        cache.index.close()
+        for name in os.listdir(self.path):
+            if name.startswith("media.db"):
+                os.remove(os.path.join(self.path, name))
+        cache = MusicCache(4 * FILE_BYTES, self.path)
+        self.assertEqual(cache.get_stats()["files"], 0)
+        cache.sync()
+        self.assertEqual(cache.get_stats()["files"], 1)
+
+    def test_evict(self):
+        for i in range(6):
+            self._download("track-{}".format(i))
+            self.cache.add("track-{}".format(i))
+            time.sleep(0.01)
+        # Used recently, so kept.
+        self.cache.get("track-0")
+
+        # In a loaded plan, so kept, even though it's not been used for a while.
+        self.assertEqual(self.cache.evict(pinned=["track-1"]), 2)
+        kept = sorted(name for name in os.listdir(self.path) if name.endswith(".mp3"))
+        self.assertEqual(kept, ["track-0.mp3", "track-1.mp3", "track-4.mp3", "track-5.mp3"])
+        self.assertEqual(self.cache.get_stats()["bytes"], 4 * FILE_BYTES)
+
+        # Too much in loaded plans to get it small enough, but we can't remove them.
+        self.cache.max_bytes = 0
+        self.assertEqual(self.cache.evict(pinned=["track-0", "track-1", "track-4", "track-5"]), 0)
+
+    def test_normalised(self):
+        self._download("track-1")
+        self.cache.add("track-1")
+        normalised = os.path.join(self.path, "track-1-normalised.mp3")
+        with open(normalised, "wb") as file:
+            file.write(bytes(FILE_BYTES))
+
+        # Picked up (and counted) as they're made.
+        self.cache.sync()
+        self.assertEqual(self.cache.get_stats()["bytes"], 2 * FILE_BYTES)
+
+        # Made from what used to be there, so removed when it changes.
+        self._download("track-1", b"Something else")
+        self.cache.sync()
+        self.assertFalse(os.path.exists(normalised))
+        self.assertIsNone(self.cache.index.get("track-1").normalised_filename)
+
+        # And removed along with it.
+        with open(normalised, "wb") as file:
+            file.write(bytes(FILE_BYTES))
+        self.cache.max_bytes = 0
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertEqual([name for name in os.listdir(self.path) if name.endswith(".mp3")], [])
+
+        # Ones with nothing to have been made from are removed.
+        with open(normalised, "wb") as file:
+            file.write(bytes(FILE_BYTES))
+        self.cache.sync()
+        self.assertFalse(os.path.exists(normalised))
+
+    def test_partial_downloads(self):
+        partial = self._download("track-1") + ".partial"
+        os.rename(partial[: -len(".partial")], partial)
+        self.cache.sync()
+        self.assertTrue(os.path.exists(partial))
+
+        # Nobody's carried on with it for a while.
+        old = time.time() - MUSIC_CACHE_PARTIAL_MAX_AGE_S - 1
+        os.utime(partial, (old, old))
+        self.cache.sync()
+        self.assertFalse(os.path.exists(partial))
+
+    # Download locks left behind (ie by a downloader that died) are removed, unless someone's holding them.
+    def test_locks_removed(self):
+        path = os.path.join(self.path, DOWNLOAD_LOCK_PATH)
+        held = FileLock(os.path.join(path, "track-1.lock"))
+        self.assertTrue(held.try_acquire())
+        self.addCleanup(held.release)
+        for name in ["track-2.lock", "foreground"]:
+            open(os.path.join(path, name), "wb").close()
+
+        self.cache.sync()
+        self.assertEqual(sorted(os.listdir(path)), ["foreground", "track-1.lock"])
+
+    # Files in the cache don't need preloading.
+    def test_preloader(self):
+        filename = self._download("track-1")
+        self.cache.add("track-1")
+        api = MyRadioAPI(self.logger, stand_in_config("Test_MusicCache", self.logger))
+        preloader = Preloader(self.logger, api, 1, self.cache)
+        item = PlanItem(
+            {"timeslotitemid": 0, "weight": 0, "trackid": 1, "type": "central", "title": "Track", "length": "00:00:01"}
+        )
+        self.assertFalse(preloader.add(item))
+        self.assertEqual(preloader.get_finished(), {"track-1": filename})
+        stats = preloader.get_stats()
+        self.assertEqual((stats["cached"], stats["queued"], stats["in_flight"]), (1, 0, 0))
+
+    # The files for each show in a day, with the regulars for each drawn from the same few.
+    def _day(self) -> List[List[str]]:
+        shows = []
+        picker = random.Random(0)
+        for show in range(SHOWS):
+            regulars = picker.sample(range(REGULARS), REGULARS_PER_SHOW)
+            keys = ["managed-{}".format(i) for i in regulars]
+            keys += ["track-{}".format(show * ITEMS_PER_SHOW + i) for i in range(ITEMS_PER_SHOW - len(keys))]
+            shows.append(keys)
+        return shows
+
+    # Compares how much needs downloading over a day of shows, emptying music-tmp for each (as we used to),
+    # against keeping the files in the cache.
+    def test_benchmark_day_of_shows(self):
+        # As it was.
+        downloads_before = 0
+        for show in self._day():
+            for name in os.listdir(self.path):
+                os.remove(os.path.join(self.path, name))
+            for key in set(show):
+                if not os.path.isfile(os.path.join(self.path, "{}.mp3".format(key))):
+                    self._download(key)
+                    downloads_before += 1
+        shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+        cache = MusicCache(BENCHMARK_MAX_BYTES, self.path)
+        downloads = 0
+        upkeep_s = 0.0
+        for show in self._day():
+            start = time.perf_counter()
+            cache.evict(pinned=[])
+            upkeep_s += time.perf_counter() - start
+            for key in show:
+                if not cache.get(key):
+                    self._download(key)
+                    downloads += 1
+                    start = time.perf_counter()
+                    cache.add(key)
+                    upkeep_s += time.perf_counter() - start
+            start = time.perf_counter()
+            cache.evict(pinned=show)
+            upkeep_s += time.perf_counter() - start
+            self.assertLessEqual(cache.get_stats()["bytes"], cache.max_bytes)
+
+        stats = cache.get_stats()
+        self.logger.log.info(
+            "{} shows of {} files ({} regulars shared between them), {:.0f}MB cache: "
+            "emptying music-tmp for each show {} downloads ({:.0f}MB), with the cache {} downloads ({:.0f}MB), "
+            "{:.0%} hit rate, {:.1f}ms upkeep per show".format(
+                SHOWS,
+                ITEMS_PER_SHOW,
+                REGULARS,
+                BENCHMARK_MAX_BYTES / 1024 / 1024,
+                downloads_before,
+                downloads_before * FILE_BYTES / 1024 / 1024,
+                downloads,
+                downloads * FILE_BYTES / 1024 / 1024,
+                stats["hit_rate"],
+                upkeep_s / SHOWS * 1000,
+            )
+        )
+        self.assertEqual(downloads, stats["misses"])
+        self.assertLess(downloads, downloads_before * 0.75)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,555 @@
+import unittest
+import aiohttp
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import ssl
+import time
+import tracemalloc
+from typing import List, Optional, Tuple
+
+from baps_types.plan import PlanItem
+from helpers.http_pool import HTTP_POOL_MAX_CONNECTIONS, HTTPPool, close_http_pool, get_http_pool
+from helpers.logging_manager import LoggingManager
+from helpers.myradio_api import (
+    DOWNLOAD_ATTEMPTS,
+    DOWNLOAD_LOCK_PATH,
+    PARTIAL_META_SUFFIX,
+    PARTIAL_SUFFIX,
+    PLAN_CACHE_MAX_AGE_S,
+    PLAN_CACHE_PATH,
+    MyRadioAPI,
+)
+from helpers.os_environment import resolve_music_tmp_path
+from helpers.state_manager import StateManager
+from tests.stand_in_myradio import TRACK, StandInFile, StandInMyRadio
+from tests.temp_music_tmp import use_temp_music_tmp
+
+# How many channels (processes) load the show plan at once.
+CHANNELS = 4
+# How long (secs) the stand-in MyRadio takes to answer, so the channels' requests would overlap.
+API_DELAY_S = 0.3
+TIMESLOTID = 999999
+
+PLAN = {
+    str(channel): [
+        {"timeslotitemid": channel, "trackid": channel, "weight": 0, "title": "Track", "length": "00:03:00"}
+    ]
+    for channel in range(CHANNELS)
+}
+
+# How many tracks to download one after another, as the file manager preloading a show would.
+PRELOAD_TRACKS = 40
+PRELOAD_TRACKID = 990000
+# How many requests to make at once, to check they're kept to the pool's limit.
+CONCURRENT_REQUESTS = 3 * HTTP_POOL_MAX_CONNECTIONS
+
+# A long show recording to download, served a chunk at a time.
+LARGE_FILE_CHUNK = bytes(range(256)) * 4096
+LARGE_FILE_CHUNKS = 64
+LARGE_FILE_BYTES = len(LARGE_FILE_CHUNK) * LARGE_FILE_CHUNKS
+LARGE_MANAGEDID = 990000
+# A download that's cut off halfway through.
+TRUNCATED_MANAGEDID = LARGE_MANAGEDID + 1
+# A file served over a connection that keeps dropping, which can be carried on from with a Range request.
+FLAKY_MANAGEDID = LARGE_MANAGEDID + 2
+FLAKY_FILES = [LARGE_FILE_CHUNK * 8, LARGE_FILE_CHUNK[::-1] * 8]
+FLAKY_ETAGS = ['"flaky-1"', '"flaky-2"']
+FLAKY_LAST_MODIFIED = ["Mon, 12 Oct 2026 09:00:00 GMT", "Tue, 13 Oct 2026 09:00:00 GMT"]
+# How much of it gets through before each connection drops.
+FLAKY_DROP_BYTES = len(LARGE_FILE_CHUNK)
+
+LARGE_FILE = LARGE_FILE_CHUNK * LARGE_FILE_CHUNKS
+
+
+# Downloads a file as it used to be, with a new session (and event loop, as syncer gave them) for every request.
+def _download_unpooled(url: str, filename: str, ssl_context: ssl.SSLContext):
+    async def download() -> bytes:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=ssl_context)) as session:
+            async with session.get(url) as response:
+                return await response.read()
+
+    with open(filename, "wb") as file:
+        file.write(asyncio.run(download()))
+
+
+# Gets an item's file as a channel would, in its own process.
+def _get_filename(config: StateManager, cafile: str, item: PlanItem, results: multiprocessing.Queue):
+    pool = HTTPPool(ssl.create_default_context(cafile=cafile))
+    api = MyRadioAPI(LoggingManager("Test_MyRadioAPI"), config, pool)
+    results.put(api.run(api.get_filename(item)))
+    pool.close()
+
+
+# Loads the show plan as a channel would, in its own process.
+def _get_showplan(config: StateManager, timeslotid: int, results: multiprocessing.Queue):
+    api = MyRadioAPI(LoggingManager("Test_MyRadioAPI"), config)
+    results.put(asyncio.run(api.get_showplan(timeslotid)))
+
+
+class TestMyRadioAPI(unittest.TestCase):
+
+    logger: LoggingManager
+    myradio: StandInMyRadio
+    config: StateManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_MyRadioAPI")
+        # Slow to answer, so the channels' requests would overlap.
+        cls.myradio = StandInMyRadio("Test_MyRadioAPI", cls.logger)
+        cls.myradio.api = {"/v2/timeslot/{}/showplan".format(TIMESLOTID): PLAN}
+        cls.myradio.delay_s = API_DELAY_S
+        cls.config = cls.myradio.config
+
+    # clean up logic for the test suite declared in the test module
+    # code that is executed after all tests in one test run
+    @classmethod
+    def tearDownClass(cls):
+        cls.myradio.close()
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        use_temp_music_tmp(self.addCleanup)
+        self.myradio.reset()
+        self.api = MyRadioAPI(self.logger, self.config)
+
+    # Every channel loading the show at once should only make one request to MyRadio.
+    def test_plan_fetched_once(self):
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        channels = [
+            multiprocessing.Process(target=_get_showplan, args=(self.config, TIMESLOTID, results))
+            for _ in range(CHANNELS)
+        ]
+        start = time.time()
+        for channel in channels:
+            channel.start()
+        plans = [results.get(timeout=10) for _ in channels]
+        elapsed = time.time() - start
+        for channel in channels:
+            channel.join()
+
+        self.assertEqual(plans, [PLAN] * CHANNELS)
+        self.logger.log.info(
+            "{} channels loading a show plan: {} request(s) to MyRadio (was {}), took {:.0f}ms".format(
+                CHANNELS, len(self.myradio.requests), CHANNELS, elapsed * 1000
+            )
+        )
+        self.assertEqual(len(self.myradio.requests), 1)
+
+    def test_plan_cache_expires(self):
+        self.assertEqual(asyncio.run(self.api.get_showplan(TIMESLOTID)), PLAN)
+        self.assertEqual(asyncio.run(self.api.get_showplan(TIMESLOTID)), PLAN)
+        self.assertEqual(len(self.myradio.requests), 1)
+
+        # Not interested in old plans, so ask again.
+        self.assertEqual(asyncio.run(self.api.get_showplan(TIMESLOTID, max_age_s=0)), PLAN)
+        self.assertEqual(len(self.myradio.requests), 2)
+
+    # Plans cached (or tried) too long ago to be given out are cleared up when another is cached.
+    def test_old_plans_removed(self):
+        path = resolve_music_tmp_path(PLAN_CACHE_PATH)
+        # One that failed, and one that was cached.
+        self.assertIsNone(asyncio.run(self.api.get_showplan(TIMESLOTID + 1)))
+        self.api._cache_showplan(os.path.join(path, "{}.json".format(TIMESLOTID + 2)), PLAN)
+        open(os.path.join(path, "{}.lock".format(TIMESLOTID + 2)), "w").close()
+        old = time.time() - PLAN_CACHE_MAX_AGE_S - 1
+        for name in ["{}.lock".format(TIMESLOTID + 1), "{}.json".format(TIMESLOTID + 2)]:
+            os.utime(os.path.join(path, name), (old, old))
+
+        self.assertEqual(asyncio.run(self.api.get_showplan(TIMESLOTID)), PLAN)
+        names = ["{}{}".format(TIMESLOTID + i, extension) for i in range(3) for extension in [".json", ".lock"]]
+        self.assertEqual(
+            [name for name in names if os.path.exists(os.path.join(path, name))],
+            ["{}.json".format(TIMESLOTID), "{}.lock".format(TIMESLOTID)],
+        )
+
+    def test_failures_not_shared(self):
+        self.assertIsNone(asyncio.run(self.api.get_showplan(TIMESLOTID + 1)))
+        self.assertIsNone(asyncio.run(self.api.get_showplan(TIMESLOTID + 1)))
+        self.assertEqual(len(self.myradio.requests), 2)
+
+
+class TestMyRadioAPIPool(unittest.TestCase):
+
+    logger: LoggingManager
+    myradio: StandInMyRadio
+    config: StateManager
+    cert: str
+    ssl_context: ssl.SSLContext
+    pool: Optional[HTTPPool] = None
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_MyRadioAPI")
+        # Over HTTPS, with keep-alive.
+        cls.myradio = StandInMyRadio("Test_MyRadioAPIPool", cls.logger, https=True)
+        cls.myradio.api = {"/v2/tracklistItem": {"audiologid": 1}}
+        cls.myradio.chunk_bytes = len(LARGE_FILE_CHUNK)
+        cls.config = cls.myradio.config
+        cls.cert = cls.myradio.cert
+        cls.ssl_context = cls.myradio.ssl_context
+
+    # clean up logic for the test suite declared in the test module
+    # code that is executed after all tests in one test run
+    @classmethod
+    def tearDownClass(cls):
+        cls.myradio.close()
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        use_temp_music_tmp(self.addCleanup)
+        self.myradio.reset()
+        self.myradio.delay_s = 0
+        self.myradio.chunk_delay_s = 0
+        self.myradio.file_for = self._file_for
+        # Which version of the flaky file to serve, which of its ETag / Last-Modified to send and whether to drop.
+        self.flaky_version = 0
+        self.flaky_validators = ["ETag", "Last-Modified"]
+        self.flaky_drops = True
+        self.pool = HTTPPool(self.ssl_context)
+        self.api = MyRadioAPI(self.logger, self.config, self.pool)
+
+    # clean up logic
+    # code that is executed after each test
+    def tearDown(self):
+        self.pool.close()
+
+    # Every track is a second of audio. There's a long show recording, one that's cut off halfway through,
+    # and one served over a connection that keeps dropping, which can be carried on from with a Range request.
+    def _file_for(self, key: str) -> Optional[StandInFile]:
+        if key.startswith("track-"):
+            return StandInFile(TRACK)
+        if key == "managed-{}".format(LARGE_MANAGEDID):
+            return StandInFile(LARGE_FILE)
+        if key == "managed-{}".format(TRUNCATED_MANAGEDID):
+            return StandInFile(LARGE_FILE, drop_after=LARGE_FILE_BYTES // 2)
+        if key == "managed-{}".format(FLAKY_MANAGEDID):
+            validators = {"ETag": FLAKY_ETAGS[self.flaky_version], "Last-Modified": FLAKY_LAST_MODIFIED[self.flaky_version]}
+            return StandInFile(
+                FLAKY_FILES[self.flaky_version],
+                {name: validators[name] for name in self.flaky_validators},
+                FLAKY_DROP_BYTES if self.flaky_drops else None,
+            )
+        return None
+
+    def _track_filename(self, i: int) -> str:
+        return resolve_music_tmp_path("track-{}.mp3".format(PRELOAD_TRACKID + i))
+
+    def _managed_filename(self, managedid: int) -> str:
+        return resolve_music_tmp_path("managed-{}.mp3".format(managedid))
+
+    def _managed_item(self, managedid: int) -> PlanItem:
+        return PlanItem(
+            {
+                "timeslotitemid": managedid,
+                "weight": 0,
+                "managedid": managedid,
+                "type": "aux",
+                "title": "Recording",
+                "length": "01:00:00",
+            }
+        )
+
+    def _item(self, i: int) -> PlanItem:
+        return PlanItem(
+            {
+                "timeslotitemid": i,
+                "weight": i,
+                "trackid": PRELOAD_TRACKID + i,
+                "type": "central",
+                "title": "Track",
+                "length": "00:00:01",
+            }
+        )
+
+    # Compares preloading a show's tracks one after another over the pool, against a new session for each.
+    def test_benchmark_sequential_preload(self):
+        start = time.perf_counter()
+        for i in range(PRELOAD_TRACKS):
+            filename = self.api.run(self.api.get_filename(self._item(i)))
+            self.assertEqual(filename, self._track_filename(i))
+        pooled = time.perf_counter() - start
+        pooled_connections = self.myradio.connections
+        for i in range(PRELOAD_TRACKS):
+            with open(self._track_filename(i), "rb") as file:
+                self.assertEqual(file.read(), TRACK)
+            os.remove(self._track_filename(i))
+
+        self.myradio.reset()
+        start = time.perf_counter()
+        for i in range(PRELOAD_TRACKS):
+            _download_unpooled(
+                "{}/NIPSWeb/secure_play?trackid={}&mp3&api_key=test".format(
+                    self.config.get()["myradio_base_url"], PRELOAD_TRACKID + i
+                ),
+                self._track_filename(i),
+                self.ssl_context,
+            )
+        unpooled = time.perf_counter() - start
+
+        self.logger.log.info(
+            "Preloading {} tracks over HTTPS: pooled {:.1f}ms each ({:.0f}/s, {} connection(s)), "
+            "new session each {:.1f}ms each ({:.0f}/s, {} connections)".format(
+                PRELOAD_TRACKS,
+                pooled * 1000 / PRELOAD_TRACKS,
+                PRELOAD_TRACKS / pooled,
+                pooled_connections,
+                unpooled * 1000 / PRELOAD_TRACKS,
+                PRELOAD_TRACKS / unpooled,
+                self.myradio.connections,
+            )
+        )
+        self.assertEqual(pooled_connections, 1)
+        self.assertEqual(self.myradio.connections, PRELOAD_TRACKS)
+
+    # Large files are streamed to disk, rather than being held in memory and written at the end.
+    def test_benchmark_download_memory(self):
+        filename = self._managed_filename(LARGE_MANAGEDID)
+        progress: List[int] = []
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            self.assertEqual(
+                self.api.run(
+                    self.api.get_filename(
+                        self._managed_item(LARGE_MANAGEDID),
+                        progress=lambda downloaded, total: progress.append(downloaded),
+                    )
+                ),
+                filename,
+            )
+            streamed = time.perf_counter() - start
+            streamed_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.assertEqual(os.path.getsize(filename), LARGE_FILE_BYTES)
+            self.assertEqual(progress[-1], LARGE_FILE_BYTES)
+            os.remove(filename)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            _download_unpooled(
+                "{}/NIPSWeb/managed_play?managedid={}&api_key=test".format(
+                    self.config.get()["myradio_base_url"], LARGE_MANAGEDID
+                ),
+                filename,
+                self.ssl_context,
+            )
+            buffered = time.perf_counter() - start
+            buffered_peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.logger.log.info(
+            "Downloading a {:.0f}MB file: streamed peak {:.1f}MB in {:.0f}ms, "
+            "read whole (the old way) peak {:.1f}MB in {:.0f}ms".format(
+                LARGE_FILE_BYTES / 1024 / 1024,
+                streamed_peak / 1024 / 1024,
+                streamed * 1000,
+                buffered_peak / 1024 / 1024,
+                buffered * 1000,
+            )
+        )
+        self.assertLess(streamed_peak, LARGE_FILE_BYTES / 8)
+        self.assertGreater(buffered_peak, LARGE_FILE_BYTES)
+
+    def test_download_checksum(self):
+        filename = self._managed_filename(LARGE_MANAGEDID)
+        checksum = hashlib.sha1()
+        for _ in range(LARGE_FILE_CHUNKS):
+            checksum.update(LARGE_FILE_CHUNK)
+        self.assertEqual(
+            self.api.run(
+                self.api.async_api_download(
+                    "/NIPSWeb/managed_play?managedid={}".format(LARGE_MANAGEDID), filename
+                )
+            ),
+            checksum.hexdigest(),
+        )
+
+    # A download cut off part way through shouldn't leave half a file to be loaded.
+    def test_download_truncated(self):
+        filename = self._managed_filename(TRUNCATED_MANAGEDID)
+        self.assertIsNone(self.api.run(self.api.get_filename(self._managed_item(TRUNCATED_MANAGEDID))))
+        self.assertFalse(os.path.exists(filename))
+        self.assertFalse(os.path.exists(filename + ".downloading"))
+        self.assertFalse(os.path.exists(filename + PARTIAL_SUFFIX))
+
+    # Gets the flaky file, asserting it's ended up with all of it, and the whole of it was only sent once.
+    def _assert_flaky_download(self, expected_bytes_sent: int):
+        filename = self._managed_filename(FLAKY_MANAGEDID)
+        item = self._managed_item(FLAKY_MANAGEDID)
+
+        # The connection drops more times than it'll try in one go, so it'll need another go.
+        self.assertIsNone(self.api.run(self.api.get_filename(item)))
+        self.assertFalse(os.path.exists(filename))
+        self.assertFalse(os.path.exists(filename + ".downloading"))
+        self.assertEqual(os.path.getsize(filename + PARTIAL_SUFFIX), FLAKY_DROP_BYTES * DOWNLOAD_ATTEMPTS)
+
+        self.assertEqual(self.api.run(self.api.get_filename(item)), filename)
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(), FLAKY_FILES[0])
+        self.assertFalse(os.path.exists(filename + PARTIAL_SUFFIX))
+        self.assertFalse(os.path.exists(filename + PARTIAL_SUFFIX + PARTIAL_META_SUFFIX))
+        self.assertEqual(self.myradio.bytes_sent, expected_bytes_sent)
+
+    def test_download_resumed(self):
+        self._assert_flaky_download(len(FLAKY_FILES[0]))
+
+    def test_download_resumed_last_modified(self):
+        self.flaky_validators = ["Last-Modified"]
+        self._assert_flaky_download(len(FLAKY_FILES[0]))
+
+    # Without an ETag / Last-Modified, there's no knowing if it's the same file, so it starts again.
+    def test_download_not_resumable(self):
+        self.flaky_validators = []
+        self.flaky_drops = False
+        filename = self._managed_filename(FLAKY_MANAGEDID)
+        with open(filename + PARTIAL_SUFFIX, "wb") as file:
+            file.write(b"Something else")
+        self.assertEqual(self.api.run(self.api.get_filename(self._managed_item(FLAKY_MANAGEDID))), filename)
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(), FLAKY_FILES[0])
+
+    # If the file's changed since, the old part is thrown away, rather than being joined to the new one.
+    def test_download_changed(self):
+        filename = self._managed_filename(FLAKY_MANAGEDID)
+        item = self._managed_item(FLAKY_MANAGEDID)
+        self.assertIsNone(self.api.run(self.api.get_filename(item)))
+        self.assertTrue(os.path.exists(filename + PARTIAL_SUFFIX))
+
+        self.flaky_version = 1
+        self.flaky_drops = False
+        self.assertEqual(self.api.run(self.api.get_filename(item)), filename)
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(), FLAKY_FILES[1])
+
+    # Starts getting the flaky file in another process, waiting until it's part way through.
+    def _start_downloader(self) -> Tuple[multiprocessing.Process, multiprocessing.Queue]:
+        partial_filename = self._managed_filename(FLAKY_MANAGEDID) + PARTIAL_SUFFIX
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        downloader = multiprocessing.Process(
+            target=_get_filename, args=(self.config, self.cert, self._managed_item(FLAKY_MANAGEDID), results)
+        )
+        downloader.start()
+        self.addCleanup(lambda: downloader.is_alive() and downloader.kill())
+
+        give_up_at = time.time() + 10
+        while not os.path.isfile(partial_filename) or os.path.getsize(partial_filename) < FLAKY_DROP_BYTES:
+            self.assertLess(time.time(), give_up_at)
+            time.sleep(0.01)
+        return downloader, results
+
+    # Others wanting the file wait for the one downloading it, and are told as soon as it's done.
+    def test_download_shared(self):
+        self.flaky_drops = False
+        self.myradio.chunk_delay_s = 0.1
+        filename = self._managed_filename(FLAKY_MANAGEDID)
+        downloader, results = self._start_downloader()
+
+        self.assertEqual(self.api.run(self.api.get_filename(self._managed_item(FLAKY_MANAGEDID))), filename)
+        told_after = time.time() - os.path.getmtime(filename)
+        self.assertEqual(results.get(timeout=10), filename)
+        downloader.join()
+
+        self.logger.log.info("Waiting for another process's download: told {:.0f}ms after it finished".format(
+            told_after * 1000
+        ))
+        self.assertEqual(self.myradio.starts, [0])
+        self.assertLess(told_after, 1)
+        # Nothing to lock until it's downloaded again.
+        lock_filename = os.path.join(resolve_music_tmp_path(DOWNLOAD_LOCK_PATH), "managed-{}.lock".format(FLAKY_MANAGEDID))
+        self.assertFalse(os.path.exists(lock_filename))
+
+    # A downloader dying part way through shouldn't leave anyone waiting for it.
+    def test_download_holder_killed(self):
+        self.flaky_drops = False
+        self.myradio.chunk_delay_s = 0.1
+        filename = self._managed_filename(FLAKY_MANAGEDID)
+        downloader, _ = self._start_downloader()
+        downloader.kill()
+        downloader.join()
+
+        self.myradio.chunk_delay_s = 0
+        start = time.perf_counter()
+        self.assertEqual(self.api.run(self.api.get_filename(self._managed_item(FLAKY_MANAGEDID))), filename)
+        took = time.perf_counter() - start
+        with open(filename, "rb") as file:
+            self.assertEqual(file.read(), FLAKY_FILES[0])
+
+        self.logger.log.info(
+            "Taking over from a killed download: done in {:.0f}ms (used to wait 20s first), "
+            "carried on from {} bytes".format(took * 1000, self.myradio.starts[-1])
+        )
+        # It carries on from what they got.
+        self.assertGreater(self.myradio.starts[-1], 0)
+        self.assertLess(took, 5)
+
+    # A forced redownload (ie the file was bad) doesn't carry on from anything left from before.
+    def test_redownload_not_resumed(self):
+        filename = self._managed_filename(FLAKY_MANAGEDID)
+        item = self._managed_item(FLAKY_MANAGEDID)
+        self.assertIsNone(self.api.run(self.api.get_filename(item)))
+
+        self.flaky_drops = False
+        self.myradio.reset()
+        self.assertEqual(self.api.run(self.api.get_filename(item, redownload=True)), filename)
+        self.assertEqual(self.myradio.bytes_sent, len(FLAKY_FILES[0]))
+
+    # The sync calls (ie tracklisting) share the connections too.
+    def test_sync_calls_share_connections(self):
+        self.assertEqual(self.api.run(self.api.get_filename(self._item(0))), self._track_filename(0))
+        self.assertEqual(self.api.post_tracklist_start(self._item(1)), 1)
+        self.assertEqual(self.api.api_call("/tracklistItem/", method="POST", data={"trackid": 1}), {
+            "payload": {"audiologid": 1}
+        })
+        self.assertEqual(self.myradio.connections, 1)
+
+    def test_concurrency_bounded(self):
+        self.myradio.delay_s = 0.1
+
+        async def download_all():
+            return await asyncio.gather(
+                *[self.api.async_api_call("/NIPSWeb/secure_play?trackid=1", api_version="non")
+                  for _ in range(CONCURRENT_REQUESTS)]
+            )
+
+        self.assertEqual(asyncio.run(download_all()), [TRACK] * CONCURRENT_REQUESTS)
+        self.assertLessEqual(self.myradio.most_in_flight, HTTP_POOL_MAX_CONNECTIONS)
+        self.assertLessEqual(self.myradio.connections, HTTP_POOL_MAX_CONNECTIONS)
+
+    def test_bad_status(self):
+        self.assertIsNone(self.api.run(self.api.async_api_call("/missing", api_version="non")))
+        # The connection's still good for the next one.
+        self.assertEqual(self.api.run(self.api.get_filename(self._item(0))), self._track_filename(0))
+        self.assertEqual(self.myradio.connections, 1)
+
+    # Each process has one pool, that's started again if it's closed.
+    def test_process_pool(self):
+        pool = get_http_pool()
+        self.assertIs(get_http_pool(), pool)
+        self.assertIs(MyRadioAPI(self.logger, self.config).pool, pool)
+
+        # Blocking on the pool from itself would never finish.
+        async def run_on_pool():
+            return pool.run(asyncio.sleep(0))
+
+        with self.assertRaises(RuntimeError):
+            pool.run(run_on_pool())
+
+        close_http_pool()
+        self.assertTrue(pool.closed)
+        self.assertIsNot(get_http_pool(), pool)
+        close_http_pool()
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
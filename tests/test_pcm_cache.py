@@ -0,0 +1,163 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+from pygame import mixer
+
+from helpers.logging_manager import LoggingManager
+from helpers.media_index import MediaIndex
+from helpers.pcm_cache import PCMCache
+
+test_dir = os.path.dirname(os.path.realpath(__file__)) + "/"
+resource_dir = test_dir + "resources/"
+
+# How many loads to time for each of cold / warm when benchmarking.
+BENCHMARK_LOADS = 20
+
+
+class TestPCMCache(unittest.TestCase):
+
+    logger: LoggingManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_PCMCache")
+
+        # Use a null audio output, we only need the mixer for decoding.
+        audio_driver = os.environ.get("SDL_AUDIODRIVER")
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+        try:
+            mixer.init(44100, -16, 2, 1024)
+        finally:
+            if audio_driver is None:
+                del os.environ["SDL_AUDIODRIVER"]
+            else:
+                os.environ["SDL_AUDIODRIVER"] = audio_driver
+
+    # clean up logic for the test suite declared in the test module
+    # code that is executed after all tests in one test run
+    @classmethod
+    def tearDownClass(cls):
+        mixer.quit()
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = folder.name
+        self.cache = PCMCache(self.path)
+
+    def test_get_or_add(self):
+        filename = resource_dir + "5sec.mp3"
+        self.assertIsNone(self.cache.get(filename))
+
+        pcm = self.cache.add(filename)
+        self.assertTrue(os.path.isfile(pcm.filename))
+        self.assertAlmostEqual(pcm.length, 5, delta=0.1)
+
+        cached = self.cache.get(filename)
+        self.assertEqual(cached.filename, pcm.filename)
+        self.assertAlmostEqual(cached.length, pcm.length)
+
+        # Other processes (with their own cache instance) share the same files.
+        self.assertEqual(PCMCache(self.path).get(filename).filename, pcm.filename)
+
+    # Only files we've already hashed are looked for, unless asked to hash them.
+    def test_get_without_hashing(self):
+        filename = resource_dir + "2sec.mp3"
+        PCMCache(self.path).add(filename)
+        self.assertIsNone(self.cache.get(filename, hash_file=False))
+        self.assertIsNotNone(self.cache.get(filename))
+        self.assertIsNotNone(self.cache.get(filename, hash_file=False))
+
+    # Files from MyRadio were hashed as they were downloaded, so any player can find them straight away.
+    def test_get_from_index(self):
+        filename = os.path.join(self.path, "5sec.mp3")
+        normalised_filename = os.path.join(self.path, "5sec-normalised.mp3")
+        shutil.copy(resource_dir + "5sec.mp3", filename)
+        shutil.copy(resource_dir + "2sec.mp3", normalised_filename)
+        index = MediaIndex(self.path)
+        index.add("track-1", filename)
+        index.set_normalised("track-1", normalised_filename)
+
+        pcm_path = os.path.join(self.path, "pcm")
+        pcm = PCMCache(pcm_path, index=index).add(filename)
+        normalised_pcm = PCMCache(pcm_path, index=index).add(normalised_filename)
+        self.assertNotEqual(pcm.filename, normalised_pcm.filename)
+
+        cache = PCMCache(pcm_path, index=index)
+        self.assertEqual(cache.get(filename, hash_file=False).filename, pcm.filename)
+        self.assertEqual(cache.get(normalised_filename, hash_file=False).filename, normalised_pcm.filename)
+
+        # Once it's changed, it's no longer the file in the index.
+        shutil.copy(resource_dir + "1sec.mp3", filename)
+        self.assertIsNone(PCMCache(pcm_path, index=index).get(filename, hash_file=False))
+
+    # WAVs are already decoded, and long files would take too much memory.
+    def test_should_cache(self):
+        filename = resource_dir + "5sec.mp3"
+        self.assertTrue(self.cache.should_cache(filename))
+        self.assertFalse(self.cache.should_cache(self.cache.add(filename).filename))
+        with patch("helpers.pcm_cache.PCM_CACHE_MAX_DURATION_S", 2):
+            self.assertFalse(self.cache.should_cache(filename))
+            self.assertTrue(self.cache.should_cache(resource_dir + "1sec.mp3"))
+            with self.assertRaises(ValueError):
+                self.cache.add(filename)
+
+    def test_mixer_can_play(self):
+        if not PCMCache.is_supported():
+            self.skipTest("This SDL_mixer can't seek in decoded files.")
+        pcm = self.cache.get_or_add(resource_dir + "2sec.mp3")
+        mixer.music.load(pcm.filename)
+        mixer.music.play(0, 1.0)
+        self.assertTrue(mixer.music.get_busy())
+        mixer.music.stop()
+        mixer.music.unload()
+
+    def test_evicts_least_recently_used(self):
+        one = self.cache.add(resource_dir + "1sec.mp3")
+        two = self.cache.add(resource_dir + "2sec.mp3")
+        # Use the older one again, so it's the most recently used.
+        past = time.time() - 10
+        os.utime(two.filename, (past, past))
+        self.cache.get(resource_dir + "1sec.mp3")
+
+        # Room for the 5 sec one, but only if the 2 sec one goes.
+        self.cache.max_bytes = os.path.getsize(one.filename) + os.path.getsize(two.filename) * 3
+        five = self.cache.add(resource_dir + "5sec.mp3")
+
+        self.assertTrue(os.path.isfile(one.filename))
+        self.assertFalse(os.path.isfile(two.filename))
+        self.assertTrue(os.path.isfile(five.filename))
+
+    # Compares how long it takes to get an item ready for the mixer the first (cold) time vs when cached (warm).
+    def test_benchmark_load(self):
+        filename = resource_dir + "5sec.mp3"
+        cold = []
+        warm = []
+        for _ in range(BENCHMARK_LOADS):
+            shutil.rmtree(self.path, ignore_errors=True)
+            # Different instances, so the file hash isn't remembered either.
+            for times, cache in [(cold, PCMCache(self.path)), (warm, PCMCache(self.path))]:
+                start = time.perf_counter()
+                pcm = cache.get_or_add(filename)
+                mixer.music.load(pcm.filename)
+                times.append(time.perf_counter() - start)
+                mixer.music.unload()
+
+        cold_ms = sum(cold) / len(cold) * 1000
+        warm_ms = sum(warm) / len(warm) * 1000
+        self.logger.log.info(
+            "Load latency of a 5 sec MP3: cold {:.2f}ms, warm {:.2f}ms".format(cold_ms, warm_ms)
+        )
+        self.assertLess(warm_ms, cold_ms)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+import copy
+import json
+import pickle
+import time
+import tracemalloc
+
+from baps_types.marker import Marker
+from baps_types.plan import PlanItem
+from helpers.logging_manager import LoggingManager
+
+# Plan sizes to benchmark status serialisation with, and how many statuses to time for each.
+BENCHMARK_PLAN_SIZES = [10, 50, 200, 1000]
+BENCHMARK_STATUSES = 50
+# How many items to make when benchmarking construction / memory use.
+BENCHMARK_ITEMS = 10000
+
+
+def _plan_item(weight: int) -> PlanItem:
+    return PlanItem(
+        {
+            "timeslotitemid": weight,
+            "trackid": weight,
+            "weight": weight,
+            "title": "Track {}".format(weight),
+            "artist": "Artist {}".format(weight),
+            "length": "00:03:30",
+            "intro": 5,
+            "cue": 10,
+        }
+    )
+
+
+class TestPlanItem(unittest.TestCase):
+
+    logger: LoggingManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_Plan")
+
+    def test_serialisation_is_cached(self):
+        item = _plan_item(0)
+        self.assertIs(item.__dict__, item.__dict__)
+        self.assertIs(item.json, item.json)
+        self.assertEqual(json.loads(item.json), item.__dict__)
+
+    def test_changes_invalidate_cache(self):
+        item = _plan_item(0)
+
+        def check_changed(change, key, value):
+            before = item.__dict__
+            before_json = item.json
+            change()
+            self.assertIsNot(item.__dict__, before)
+            self.assertEqual(item.__dict__[key], value)
+            self.assertEqual(json.loads(item.json)[key], value)
+            self.assertNotEqual(item.json, before_json)
+
+        check_changed(lambda: setattr(item, "weight", 3), "weight", 3)
+        check_changed(lambda: setattr(item, "filename", "/music-tmp/0.mp3"), "filename", "/music-tmp/0.mp3")
+        check_changed(item.play_count_increment, "play_count", 1)
+        check_changed(item.play_count_decrement, "play_count", 0)
+        item.play_count_increment()
+        check_changed(item.play_count_reset, "play_count", 0)
+        check_changed(
+            lambda: item.set_marker(
+                Marker({"name": "Cue", "time": 20, "position": "mid", "section": None})
+            ),
+            "cue",
+            20,
+        )
+
+    def test_equality(self):
+        item = _plan_item(0)
+        other = _plan_item(0)
+        self.assertEqual(item, other)
+        other.play_count_increment()
+        self.assertNotEqual(item, other)
+
+    def test_markers_resolved(self):
+        item = _plan_item(0)
+        self.assertEqual((item.intro, item.cue, item.outro), (5, 10, 0))
+        item.set_marker(Marker({"name": "Outro", "time": 200, "position": "end", "section": None}))
+        self.assertEqual((item.intro, item.cue, item.outro), (5, 10, 200))
+        # Markers in a section aren't the main intro / cue / outro.
+        item.set_marker(Marker({"name": "Cue", "time": 30, "position": "mid", "section": "Verse"}))
+        self.assertEqual(item.cue, 10)
+
+    def test_slots(self):
+        item = _plan_item(0)
+        marker = Marker({"name": "Cue", "time": 20, "position": "mid", "section": None})
+        with self.assertRaises(AttributeError):
+            item.something = 1
+        with self.assertRaises(AttributeError):
+            marker.something = 1
+
+    def test_pickle_and_copy(self):
+        item = _plan_item(0)
+        item.play_count_increment()
+        for other in [pickle.loads(pickle.dumps(item)), copy.copy(item), copy.deepcopy(item)]:
+            self.assertEqual(other, item)
+            self.assertEqual(other.cue, item.cue)
+
+        marker = Marker({"name": "Cue", "time": 20, "position": "mid", "section": None})
+        self.assertEqual(pickle.loads(pickle.dumps(marker)).__dict__, marker.__dict__)
+
+    # Measures how much memory each item takes, and how quickly they can be made.
+    def test_benchmark_items(self):
+        items_json = [_plan_item(i).__dict__ for i in range(BENCHMARK_ITEMS)]
+        for item_json in items_json:
+            item_json["outro"] = 200
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        items = [PlanItem(item_json) for item_json in items_json]
+        duration = time.perf_counter() - start
+        per_item = (tracemalloc.get_traced_memory()[0] - before) / BENCHMARK_ITEMS
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for item in items:
+            item.intro, item.cue, item.outro
+        lookups = time.perf_counter() - start
+
+        self.logger.log.info(
+            "{} items with intro/cue/outro: {:.0f} bytes/item, {:.0f} items/s made, {:.0f} intro/cue/outro lookups/s".format(
+                BENCHMARK_ITEMS, per_item, BENCHMARK_ITEMS / duration, BENCHMARK_ITEMS * 3 / lookups
+            )
+        )
+        self.assertEqual(items[0].outro, 200)
+
+    # Compares how long it takes to serialise a plan for a status, with and without the cache.
+    def test_benchmark_status_serialisation(self):
+        for plan_size in BENCHMARK_PLAN_SIZES:
+            plan = [_plan_item(i) for i in range(plan_size)]
+
+            # Without the cache (the old behaviour), every item is rebuilt and encoded for every status.
+            start = time.perf_counter()
+            for _ in range(BENCHMARK_STATUSES):
+                json.dumps([item._to_dict() for item in plan])
+            uncached = (time.perf_counter() - start) / BENCHMARK_STATUSES
+
+            # With it, only changed items are, so change one item per status.
+            start = time.perf_counter()
+            for i in range(BENCHMARK_STATUSES):
+                plan[i % plan_size].play_count_increment()
+                "[{}]".format(", ".join([item.json for item in plan]))
+            cached = (time.perf_counter() - start) / BENCHMARK_STATUSES
+
+            self.logger.log.info(
+                "Status serialisation of a {} item plan: uncached {:.0f}us, cached {:.0f}us".format(
+                    plan_size, uncached * 1000000, cached * 1000000
+                )
+            )
+            if plan_size >= 50:
+                self.assertLess(cached, uncached)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,56 @@
 from typing import Optional
 from queue import Empty
 import unittest
+from unittest.mock import patch
 import multiprocessing
 import time
 import os
 import json
+import psutil
+from mutagen.mp3 import MP3
 
 from player import Player
 from helpers.logging_manager import LoggingManager
+from helpers.media_index import MediaIndex
+from helpers.pcm_cache import PCMCache
 from helpers.state_manager import StateManager
-from helpers.os_environment import isMacOS
+from helpers.os_environment import isMacOS, resolve_music_tmp_path
+from helpers.status_stream import StatusTracker
+from tests.stand_in_myradio import StandInFile, StandInMyRadio
+from tests.temp_music_tmp import use_temp_music_tmp
 
 # How long to wait (by default) in secs for the player to respond.
 TIMEOUT_MSG_MAX_S = 10
 TIMEOUT_QUIT_S = 10
 
+# The timings below are only held to when benchmarking (with BAPSICLE_BENCHMARKS set), as busy / shared
+# machines are too noisy for them. Otherwise they just need to be within an order of magnitude.
+BENCHMARKING = bool(os.environ.get("BAPSICLE_BENCHMARKS"))
+BENCHMARK_SLACK = 1 if BENCHMARKING else 10
+
+# How many round trips / how long to sample for when benchmarking the player.
+BENCHMARK_ROUNDS = 20
+IDLE_CPU_SAMPLE_S = 5
+# The most (secs) we'll accept for a transport command to be answered, on average.
+COMMAND_MAX_MEAN_LATENCY_S = 0.05
+# The most CPU (%) we'll accept a channel using when it's got nothing to do.
+IDLE_CPU_MAX_PERCENT = 5
+# How many show plan items are thrown at the player at once, when testing transport commands jump the queue.
+FLOOD_ADDS = 500
+# The most (secs) we'll accept for a STOP to be answered whilst the player's busy with a flood of ADDs.
+FLOOD_STOP_MAX_LATENCY_S = 0.1
+# The most (secs) we'll accept between one item ending and the next starting on auto advance.
+AUTO_ADVANCE_MAX_GAP_S = 0.05
+# How many times to time auto advancing, the timings are noisy so the median is used.
+AUTO_ADVANCE_ROUNDS = 3
+
+# How slowly the stand-in MyRadio sends files, bytes every so many secs. (~2s for the 5 sec item.)
+SLOW_DOWNLOAD_CHUNK_BYTES = 8192
+SLOW_DOWNLOAD_INTERVAL_S = 0.15
+# The most (secs) we'll accept for the channel to answer a command, whilst it's downloading an item to load.
+LOADING_MAX_LATENCY_S = 0.5
+SLOW_TRACKID = 999999
+
 test_dir = dir_path = os.path.dirname(os.path.realpath(__file__)) + "/"
 resource_dir = test_dir + "resources/"
 
@@ -68,6 +104,7 @@ class TestPlayer(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.logger = LoggingManager("Test_Player")
+        use_temp_music_tmp(cls.addClassCleanup)
         cls.server_state = StateManager(
             "BAPSicleServer", cls.logger, default_state={"tracklist_mode": "off"}
         )  # Mostly dummy here.
@@ -125,6 +162,8 @@ class TestPlayer(unittest.TestCase):
                         )
                     )
                     got_anything = True
+                    # Responses are prefixed by the channel number, we don't care about that.
+                    response = response[response.index(":") + 1:]
                     source = response[: response.index(":")]
                     if source in sources_filter:
                         return response[
@@ -160,6 +199,66 @@ class TestPlayer(unittest.TestCase):
             return response[1]
         return None
 
+    # Sends a message, blocking until the player replies to it. Returns the round trip time in secs.
+    def _time_msg(self, msg: str, timeout: int = TIMEOUT_MSG_MAX_S) -> float:
+        start = time.time()
+        self._send_msg(msg)
+        while True:
+            response: str = self.player_from_q.get(timeout=timeout)
+            if response.split(":", 1)[1].startswith("TEST:{}:OKAY".format(msg)):
+                return time.time() - start
+
+    # Sends a message and counts how many status updates are broadcast because of it.
+    def _count_status_updates(self, msg: str, wait_s: float = 0.5) -> int:
+        # Clear out anything from previous commands first.
+        time.sleep(wait_s)
+        while not self.player_from_q.empty():
+            self.player_from_q.get()
+
+        self._send_msg(msg)
+        count = 0
+        got_response = False
+        deadline = time.time() + TIMEOUT_MSG_MAX_S
+        while time.time() < deadline:
+            try:
+                response: str = self.player_from_q.get(timeout=wait_s)
+            except Empty:
+                if got_response:
+                    break
+                continue
+            response = response[response.index(":") + 1:]
+            if response.startswith("ALL:STATUSDELTA:"):
+                count += 1
+            elif response.startswith("TEST:{}:OKAY".format(msg)):
+                got_response = True
+
+        self.assertTrue(got_response)
+        return count
+
+    # Restarts the player, with it getting its files from a stand-in MyRadio, serving them over a really slow
+    # connection. (There aren't any managed items, for testing failed downloads.)
+    def _use_slow_myradio(self):
+        myradio = StandInMyRadio("Test_SlowMyRadio", self.logger, tracklist_mode="off")
+        with open(resource_dir + "5sec.mp3", "rb") as file:
+            track = StandInFile(file.read())
+        myradio.file_for = lambda key: track if key.startswith("track-") else None
+        myradio.chunk_bytes = SLOW_DOWNLOAD_CHUNK_BYTES
+        myradio.chunk_delay_s = SLOW_DOWNLOAD_INTERVAL_S
+        self.addCleanup(myradio.close)
+
+        # Make sure it's actually downloaded, and isn't carrying on from a download in an earlier test.
+        media_index = MediaIndex()
+        for item_type in ["track", "managed"]:
+            media_index.remove("{}-{}".format(item_type, SLOW_TRACKID))
+            filename = resolve_music_tmp_path("{}-{}.mp3".format(item_type, SLOW_TRACKID))
+            for suffix in ["", ".partial", ".partial.meta"]:
+                if os.path.isfile(filename + suffix):
+                    os.remove(filename + suffix)
+
+        self.tearDown()
+        self.server_state = myradio.config
+        self.setUp()
+
     def test_player_running(self):
         response = self._send_msg_wait_OKAY("STATUS")
 
@@ -306,6 +405,325 @@ class TestPlayer(unittest.TestCase):
 
             time.sleep(5)
 
+    # Measures the gap between one item ending and the next one starting on auto advance.
+    def test_auto_advance_gap(self):
+        self._test_auto_advance_gap()
+
+    # Without the decoded versions (ie older SDL_mixers), the original files are queued up instead.
+    def test_auto_advance_gap_without_pcm_cache(self):
+        with patch.object(PCMCache, "is_supported", return_value=False):
+            self._test_auto_advance_gap()
+
+    def _test_auto_advance_gap(self):
+        # Restart the player with a null audio output, so the timings are down to the player, not the sound card.
+        # (It's forked, so it gets whatever's patched now.)
+        self.tearDown()
+        audio_driver = os.environ.get("SDL_AUDIODRIVER")
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+        try:
+            self.setUp()
+        finally:
+            if audio_driver is None:
+                del os.environ["SDL_AUDIODRIVER"]
+            else:
+                os.environ["SDL_AUDIODRIVER"] = audio_driver
+
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(1, 0))
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(2, 1))
+        self._send_msg_wait_OKAY("PLAYONLOAD:True")
+        lengths = [MP3(getPlanItem(length, 0)["filename"]).info.length for length in [1, 2]]
+
+        # How long from loading the item until it's finished playing, however many items auto advance.
+        def play_until_stopped(weight: int) -> float:
+            self._send_msg_wait_OKAY("LOAD:{}".format(weight))
+            start = time.time()
+            while True:
+                response: str = self.player_from_q.get(timeout=TIMEOUT_MSG_MAX_S)
+                if response.endswith(":ALL:STOPPED"):
+                    return time.time() - start
+
+        overheads = []
+        gaps = []
+        for _ in range(AUTO_ADVANCE_ROUNDS):
+            # Playing just the last item tells us how long the player / null output take to notice it ending.
+            overheads.append(play_until_stopped(1) - lengths[1])
+            # Both items play back to back, so any more time than that on top of their lengths is the gap.
+            gaps.append(play_until_stopped(0) - sum(lengths))
+        overhead = sorted(overheads)[AUTO_ADVANCE_ROUNDS // 2]
+        gap = sorted(gaps)[AUTO_ADVANCE_ROUNDS // 2] - overhead
+
+        json_obj = json.loads(self._send_msg_wait_OKAY("STATUS"))
+        self.assertEqual(json_obj["loaded_item"]["weight"], 1)
+        self.logger.log.info(
+            "Auto advance gap: {:.1f}ms (after {:.1f}ms of end of playback overhead)".format(
+                gap * 1000, overhead * 1000
+            )
+        )
+        self.assertLess(gap, AUTO_ADVANCE_MAX_GAP_S * BENCHMARK_SLACK)
+
+    # Loading an item that needs downloading shouldn't stop the channel answering other commands.
+    def test_load_in_background(self):
+        self._use_slow_myradio()
+        self._send_msg_wait_OKAY(
+            "ADD:" + json.dumps(
+                {"timeslotitemid": 0, "trackid": SLOW_TRACKID, "weight": 0, "title": "Slow", "length": "00:00:05"}
+            )
+        )
+
+        start = time.time()
+        self._send_msg_wait_OKAY("LOAD:0")
+        load_reply = time.time() - start
+
+        # Whilst it's downloading, the channel should still answer straight away.
+        latencies = []
+        for command in ["STATUS", "STOP"] * 5:
+            latencies.append(self._time_msg(command))
+            time.sleep(0.05)
+        self.assertEqual(self._send_msg_and_wait("LOADED?"), "FAIL")
+
+        # Then clients should be told how the download's going, and when it's loaded.
+        progress = []
+        while True:
+            response: str = self.player_from_q.get(timeout=TIMEOUT_MSG_MAX_S)
+            response = response[response.index(":") + 1:]
+            self.assertNotEqual(response, "ALL:LOADFAILED:0")
+            if response.startswith("ALL:LOADPROGRESS:0:"):
+                progress.append([int(size) for size in response.split(":")[3:]])
+            elif response == "ALL:LOADED:0":
+                break
+        loaded = time.time() - start
+
+        self.assertTrue(progress)
+        self.assertEqual(progress[-1][0], progress[-1][1])
+        self._send_msg_wait_OKAY("LOADED?")
+        self._send_msg_wait_OKAY("PLAY")
+        # How long it had to be waited for is in the status.
+        status = json.loads(self._send_msg_wait_OKAY("STATUS"))
+        self.assertEqual(status["foreground_downloads"], 1)
+        self.assertGreater(status["foreground_wait_max_s"], 0)
+
+        self.logger.log.info(
+            "Background load: LOAD answered in {:.1f}ms, loaded after {:.2f}s. "
+            "STATUS / STOP whilst downloading: mean {:.2f}ms, max {:.2f}ms".format(
+                load_reply * 1000,
+                loaded,
+                sum(latencies) / len(latencies) * 1000,
+                max(latencies) * 1000,
+            )
+        )
+        self.assertLess(max(latencies), LOADING_MAX_LATENCY_S)
+
+        # Don't leave the next test's player trying to reload it from the stand-in MyRadio.
+        self._send_msg_wait_OKAY("STOP")
+        self._send_msg_wait_OKAY("UNLOAD")
+
+    def test_load_download_failed(self):
+        self._use_slow_myradio()
+        self._send_msg_wait_OKAY(
+            "ADD:" + json.dumps(
+                {"timeslotitemid": 0, "managedid": SLOW_TRACKID, "weight": 0, "title": "Missing", "length": "00:00:05"}
+            )
+        )
+        self._send_msg_wait_OKAY("LOAD:0")
+        while True:
+            response: str = self.player_from_q.get(timeout=TIMEOUT_MSG_MAX_S)
+            response = response[response.index(":") + 1:]
+            self.assertNotEqual(response, "ALL:LOADED:0")
+            if response == "ALL:LOADFAILED:0":
+                break
+        self.assertEqual(self._send_msg_and_wait("LOADED?"), "FAIL")
+        self._send_msg_wait_OKAY("UNLOAD")
+
+    # Each command from a client should only result in one status update being sent out.
+    def test_one_status_per_command(self):
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(5, 0))
+
+        for command in [
+            "ADD:" + getPlanItemJSON(5, 1),
+            "LOAD:0",
+            "SEEK:1.0",
+            "SETMARKER:0:" + getMarkerJSON("Intro Name", 2.0, "start", None),
+            "REMOVE:1",
+        ]:
+            self.assertEqual(self._count_status_updates(command), 1, command)
+
+    # Following the status deltas should give the same status as asking for it.
+    def test_status_deltas(self):
+        tracker = StatusTracker()
+        tracker.apply_full(json.loads(self._send_msg_wait_OKAY("STATUS")))
+
+        self._send_msg("ADD:" + getPlanItemJSON(5, 0))
+        self._send_msg("ADD:" + getPlanItemJSON(2, 1))
+        self._send_msg("LOAD:1")
+        self._send_msg("REMOVE:0")
+        self._send_msg("STATUS")
+        while True:
+            response: str = self.player_from_q.get(timeout=TIMEOUT_MSG_MAX_S)
+            response = response[response.index(":") + 1:]
+            if response.startswith("ALL:STATUSDELTA:OKAY:"):
+                self.assertTrue(tracker.apply_delta(json.loads(response.split(":", 3)[3])))
+            elif response.startswith("TEST:STATUS:OKAY:"):
+                status = json.loads(response.split(":", 3)[3])
+                break
+
+        self.assertEqual(tracker.status, status)
+        self.assertEqual(len(status["show_plan"]), 1)
+
+    # Playing an item marks it as played in the show plan, which anyone following the deltas should hear about.
+    def test_played_deltas(self):
+        tracker = StatusTracker()
+        tracker.apply_full(json.loads(self._send_msg_wait_OKAY("STATUS")))
+
+        self._send_msg("ADD:" + getPlanItemJSON(1, 0))
+        self._send_msg("ADD:" + getPlanItemJSON(2, 1))
+        self._send_msg("PLAYONLOAD:True")
+        self._send_msg("LOAD:0")
+        # The first item plays, then the second is auto advanced onto.
+        while True:
+            response: str = self.player_from_q.get(timeout=TIMEOUT_MSG_MAX_S)
+            response = response[response.index(":") + 1:]
+            if response.startswith("ALL:STATUSDELTA:OKAY:"):
+                self.assertTrue(tracker.apply_delta(json.loads(response.split(":", 3)[3])))
+            elif response == "ALL:STOPPED":
+                break
+
+        self.assertEqual([item["played"] for item in tracker.status["show_plan"]], [True, True])
+        self.assertEqual(tracker.status["show_plan"], json.loads(self._send_msg_wait_OKAY("STATUS"))["show_plan"])
+
+    # Benchmarks how long it takes for transport commands to reach the mixer and be replied to.
+    def test_command_latency(self):
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(5, 0))
+        self._send_msg_wait_OKAY("LOAD:0")
+
+        # Let the player settle into waiting for new commands.
+        time.sleep(1)
+
+        latencies = []
+        for i in range(BENCHMARK_ROUNDS):
+            for command in ["PLAY", "STOP"]:
+                latencies.append(self._time_msg(command))
+                time.sleep(0.1)
+
+        mean_ms = sum(latencies) / len(latencies) * 1000
+        max_ms = max(latencies) * 1000
+        self.logger.log.info(
+            "Command latency over {} commands: mean {:.2f}ms, max {:.2f}ms".format(
+                len(latencies), mean_ms, max_ms
+            )
+        )
+        self.assertLess(mean_ms, COMMAND_MAX_MEAN_LATENCY_S * 1000 * BENCHMARK_SLACK)
+
+    # Benchmarks how long a STATUS request takes with an item loaded (but not playing).
+    def test_status_latency(self):
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(5, 0))
+        self._send_msg_wait_OKAY("LOAD:0")
+
+        # Let the player settle into waiting for new commands.
+        time.sleep(1)
+
+        latencies = []
+        for i in range(BENCHMARK_ROUNDS):
+            latencies.append(self._time_msg("STATUS"))
+            time.sleep(0.1)
+
+        mean_ms = sum(latencies) / len(latencies) * 1000
+        max_ms = max(latencies) * 1000
+        self.logger.log.info(
+            "STATUS latency over {} requests: mean {:.2f}ms, max {:.2f}ms".format(
+                len(latencies), mean_ms, max_ms
+            )
+        )
+        self.assertLess(mean_ms, COMMAND_MAX_MEAN_LATENCY_S * 1000 * BENCHMARK_SLACK)
+
+        # Asking for the status shouldn't have stopped the item being loaded.
+        self._send_msg_wait_OKAY("LOADED?")
+
+    # A STOP should be answered straight away, even if the player's got lots of show plan edits to get through.
+    def test_stop_under_add_flood(self):
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(5, 0))
+        self._send_msg_wait_OKAY("LOAD:0")
+        self._send_msg_wait_OKAY("PLAY")
+
+        start = time.time()
+        for i in range(FLOOD_ADDS):
+            self._send_msg("ADD:" + getPlanItemJSON(1, i + 1))
+        stop_sent = time.time()
+        self._send_msg("STOP")
+
+        adds = 0
+        adds_before_stop = None
+        while adds < FLOOD_ADDS or adds_before_stop is None:
+            response: str = self.player_from_q.get(timeout=TIMEOUT_MSG_MAX_S)
+            response = response[response.index(":") + 1:]
+            if response.startswith("TEST:ADD:"):
+                self.assertTrue(response.endswith(":OKAY"))
+                adds += 1
+            elif response.startswith("TEST:STOP:OKAY"):
+                stop_latency = time.time() - stop_sent
+                adds_before_stop = adds
+        flood = time.time() - start
+
+        json_obj = json.loads(self._send_msg_wait_OKAY("STATUS"))
+        self.assertFalse(json_obj["playing"])
+        self.assertEqual(len(json_obj["show_plan"]), FLOOD_ADDS + 1)
+        self.assertGreater(json_obj["commands_prioritised"], 0)
+
+        self.logger.log.info(
+            "STOP during a flood of {} ADDs: answered in {:.1f}ms, after {} ADDs. The flood took {:.0f}ms.".format(
+                FLOOD_ADDS, stop_latency * 1000, adds_before_stop, flood * 1000
+            )
+        )
+        self.assertLess(adds_before_stop, FLOOD_ADDS)
+        self.assertLess(stop_latency, FLOOD_STOP_MAX_LATENCY_S * BENCHMARK_SLACK)
+
+    # A burst of SEEKs should only be run once, but every one should still be answered.
+    def test_seek_coalescing(self):
+        self._send_msg_wait_OKAY("ADD:" + getPlanItemJSON(5, 0))
+        self._send_msg_wait_OKAY("LOAD:0")
+
+        # Keep the player busy, so the SEEKs pile up.
+        for i in range(FLOOD_ADDS):
+            self._send_msg("ADD:" + getPlanItemJSON(1, i + 1))
+        seeks = ["SEEK:{}".format(pos / 2) for pos in range(1, 9)]
+        for seek in seeks:
+            self._send_msg(seek)
+
+        answers = {}
+        while len(answers) < len(seeks):
+            response: str = self.player_from_q.get(timeout=TIMEOUT_MSG_MAX_S)
+            response = response[response.index(":") + 1:]
+            for seek in seeks:
+                if response.startswith("TEST:{}:".format(seek)):
+                    answers[seek] = response.split(":", 3)[3]
+        self.assertEqual(list(answers.values()), ["OKAY"] * len(seeks))
+
+        json_obj = json.loads(self._send_msg_wait_OKAY("STATUS"))
+        self.assertEqual(json_obj["pos_true"], 4.0)
+        self.assertGreater(json_obj["commands_coalesced"], 0)
+        self.logger.log.info(
+            "Coalesced {} of a burst of {} SEEKs.".format(json_obj["commands_coalesced"], len(seeks))
+        )
+
+    # Benchmarks how much CPU time a channel burns when it's got nothing to do.
+    def test_idle_cpu(self):
+        process = psutil.Process(self.player.pid)
+
+        # Let the player settle into waiting for new commands.
+        time.sleep(1)
+
+        before = process.cpu_times()
+        time.sleep(IDLE_CPU_SAMPLE_S)
+        after = process.cpu_times()
+
+        cpu_s = (after.user + after.system) - (before.user + before.system)
+        cpu_percent = cpu_s / IDLE_CPU_SAMPLE_S * 100
+        self.logger.log.info(
+            "Idle CPU usage over {}s: {:.3f}s ({:.2f}%)".format(
+                IDLE_CPU_SAMPLE_S, cpu_s, cpu_percent
+            )
+        )
+        self.assertLess(cpu_percent, IDLE_CPU_MAX_PERCENT * BENCHMARK_SLACK)
+
     # TODO: Test validation of trying to break this.
     # TODO: Test cue behaviour.
     def test_markers(self):
@@ -0,0 +1,177 @@
+import unittest
+import os
+import time
+from typing import Dict, List
+
+from baps_types.plan import PlanItem
+from helpers.logging_manager import LoggingManager
+from helpers.media_index import media_key
+from helpers.myradio_api import MyRadioAPI
+from helpers.os_environment import resolve_music_tmp_path
+from helpers.preloader import Preloader
+from tests.stand_in_myradio import StandInMyRadio
+from tests.temp_music_tmp import use_temp_music_tmp
+
+# A three channel show, with some of the same tracks in more than one channel.
+CHANNELS = 3
+ITEMS_PER_CHANNEL = 20
+SHARED_TRACKS = 5
+FIRST_TRACKID = 980000
+# How long (secs) the stand-in MyRadio takes to start sending each file, as a far away server would.
+LATENCY_S = 0.05
+CONCURRENCIES = [1, 4, 8]
+
+
+def _show() -> List[List[PlanItem]]:
+    show = []
+    for channel in range(CHANNELS):
+        items = []
+        for weight in range(ITEMS_PER_CHANNEL):
+            # The first few tracks are in every channel.
+            if weight < SHARED_TRACKS:
+                trackid = FIRST_TRACKID + weight
+            else:
+                trackid = FIRST_TRACKID + SHARED_TRACKS + channel * ITEMS_PER_CHANNEL + weight
+            items.append(
+                PlanItem(
+                    {
+                        "timeslotitemid": channel * ITEMS_PER_CHANNEL + weight,
+                        "weight": weight,
+                        "trackid": trackid,
+                        "type": "central",
+                        "title": "Track {}".format(trackid),
+                        "length": "00:00:01",
+                    }
+                )
+            )
+        show.append(items)
+    return show
+
+
+class TestPreloader(unittest.TestCase):
+
+    logger: LoggingManager
+    myradio: StandInMyRadio
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_Preloader")
+        cls.myradio = StandInMyRadio("Test_Preloader", cls.logger)
+        cls.myradio.delay_s = LATENCY_S
+
+    # clean up logic for the test suite declared in the test module
+    # code that is executed after all tests in one test run
+    @classmethod
+    def tearDownClass(cls):
+        cls.myradio.close()
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        use_temp_music_tmp(self.addCleanup)
+        self.myradio.reset()
+        self.api = MyRadioAPI(self.logger, self.myradio.config)
+
+    def _remove_tracks(self):
+        for channel in _show():
+            for item in channel:
+                filename = resolve_music_tmp_path("track-{}.mp3".format(item.trackid))
+                if os.path.isfile(filename):
+                    os.remove(filename)
+
+    # Waits for the preloader to have nothing left to do, giving its stats.
+    def _wait_for(self, preloader: Preloader) -> Dict[str, float]:
+        give_up_at = time.time() + 30
+        while True:
+            stats = preloader.get_stats()
+            if not stats["queued"] and not stats["in_flight"]:
+                return stats
+            self.assertLess(time.time(), give_up_at)
+            time.sleep(0.01)
+
+    def _preload_show(self, concurrency: int) -> Dict[str, float]:
+        preloader = Preloader(self.logger, self.api, concurrency)
+        show = _show()
+        start = time.perf_counter()
+        queued = [preloader.add(item) for channel in show for item in channel]
+        stats = self._wait_for(preloader)
+        took = time.perf_counter() - start
+
+        # The same track in another channel isn't queued again.
+        unique = CHANNELS * (ITEMS_PER_CHANNEL - SHARED_TRACKS) + SHARED_TRACKS
+        self.assertEqual(queued.count(True), unique)
+        self.assertEqual(len(self.myradio.requests), unique)
+        self.assertEqual(len(set(self.myradio.requests)), unique)
+        self.assertLessEqual(self.myradio.most_in_flight, concurrency)
+        self.assertEqual(stats["done"], unique)
+        self.assertEqual(stats["downloaded"], unique)
+        self.assertEqual(stats["failed"], 0)
+
+        finished = preloader.get_finished()
+        for channel in show:
+            for item in channel:
+                filename = finished[media_key(item)]
+                self.assertEqual(filename, resolve_music_tmp_path("track-{}.mp3".format(item.trackid)))
+                self.assertTrue(os.path.isfile(filename))
+
+        self.logger.log.info(
+            "Preloading a {} channel, {} item show ({} files) {} at once: {:.0f}ms, {:.1f} files/s, "
+            "most at once {}".format(
+                CHANNELS,
+                CHANNELS * ITEMS_PER_CHANNEL,
+                unique,
+                concurrency,
+                took * 1000,
+                stats["files_per_s"],
+                self.myradio.most_in_flight,
+            )
+        )
+        return stats
+
+    # Compares preloading a show one file at a time (as the file manager used to), against a few at once.
+    def test_benchmark_preload_show(self):
+        rates = []
+        for concurrency in CONCURRENCIES:
+            rates.append(self._preload_show(concurrency)["files_per_s"])
+            self._remove_tracks()
+            self.myradio.reset()
+        self.assertGreater(rates[1], rates[0] * 2)
+
+    def test_already_preloaded(self):
+        preloader = Preloader(self.logger, self.api, 2)
+        item = _show()[0][0]
+        self.assertTrue(preloader.add(item))
+        self._wait_for(preloader)
+        self.assertFalse(preloader.add(item))
+        self.assertEqual(len(self.myradio.requests), 1)
+
+        # Unless it's been forgotten about for a new show. The file's already there though.
+        preloader.clear()
+        self.assertEqual(preloader.get_finished(), {})
+        self.assertTrue(preloader.add(item))
+        stats = self._wait_for(preloader)
+        self.assertEqual(stats["done"], 1)
+        self.assertEqual(stats["downloaded"], 0)
+        self.assertEqual(len(self.myradio.requests), 1)
+
+    def test_failed(self):
+        preloader = Preloader(self.logger, self.api, 2)
+        item = PlanItem(
+            {"timeslotitemid": 0, "weight": 0, "managedid": 1, "type": "aux", "title": "Missing", "length": "00:00:01"}
+        )
+        self.assertTrue(preloader.add(item))
+        stats = self._wait_for(preloader)
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(preloader.get_finished(), {"managed-1": None})
+
+        # Things that don't come from MyRadio can't be preloaded.
+        self.assertFalse(
+            preloader.add(PlanItem({"timeslotitemid": 1, "weight": 1, "title": "Local", "length": "00:00:01"}))
+        )
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import unittest
+import multiprocessing
+import multiprocessing.managers as m
+import os
+import time
+
+from helpers.logging_manager import LoggingManager
+from helpers.os_environment import resolve_external_file_path
+from helpers.shared_config import (
+    SHARED_CONFIG_WATCH_PERIOD_S,
+    SharedConfig,
+    create_shared_config_memory,
+    create_shared_state_manager,
+)
+
+STATE_NAME = "Test_SharedConfig"
+
+# How many other processes read the config while benchmarking (same as a 3 channel server has).
+BENCHMARK_PROCESSES = 7
+BENCHMARK_READS = 1000
+
+
+class TestManager(m.BaseManager):
+    pass
+
+
+TestManager.register("StateManager", create_shared_state_manager)
+
+
+# Run in a separate process, to read a value from the config.
+def _read_config(config: SharedConfig, key: str, result_q: multiprocessing.Queue):
+    result_q.put(config.get()[key])
+
+
+# Run in a separate process, to keep another process busy reading the config.
+def _keep_reading(config, stop):
+    while not stop.is_set():
+        config.get()
+
+
+class TestSharedConfig(unittest.TestCase):
+
+    logger: LoggingManager
+    manager: TestManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_SharedConfig")
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        self.filepath = resolve_external_file_path("/state/{}.json".format(STATE_NAME))
+        if os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+
+        self.memory = create_shared_config_memory()
+        self.manager = TestManager()
+        self.manager.start()
+        self.proxy = self.manager.StateManager(
+            STATE_NAME, self.logger, {"serial_port": None, "num_channels": 3}, self.memory.name
+        )
+        self.config = SharedConfig(self.proxy, self.memory.name)
+
+    # clean up logic
+    # code that is executed after each test
+    def tearDown(self):
+        self.manager.shutdown()
+        self.memory.close()
+        self.memory.unlink()
+        if os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+
+    def test_get(self):
+        self.assertEqual(self.config.get()["num_channels"], 3)
+        # Nothing changed, so no need to read it again.
+        self.assertIs(self.config.get(), self.config.get())
+
+    def test_update(self):
+        version = self.config.version()
+        self.config.update("serial_port", "/dev/ttyUSB0")
+
+        # We should see our own changes straight away.
+        self.assertEqual(self.config.get()["serial_port"], "/dev/ttyUSB0")
+        self.assertGreater(self.config.version(), version)
+        self.assertEqual(self.proxy.get()["serial_port"], "/dev/ttyUSB0")
+
+    def test_other_process(self):
+        self.config.update("num_channels", 4)
+
+        result_q = multiprocessing.Queue()
+        reader = multiprocessing.Process(
+            target=_read_config, args=(self.config, "num_channels", result_q)
+        )
+        reader.start()
+        self.assertEqual(result_q.get(timeout=10), 4)
+        reader.join()
+
+    def test_callback(self):
+        changes = []
+        self.config.add_callback(changes.append, keys=["serial_port"])
+        self.config.update("num_channels", 4)
+
+        # Changes made via the proxy directly (ie by another process) should be noticed too.
+        self.proxy.update("serial_port", "/dev/ttyUSB1")
+        time.sleep(SHARED_CONFIG_WATCH_PERIOD_S * 3)
+        # Only told about the keys it cares about.
+        self.assertEqual(changes, [{"serial_port": (None, "/dev/ttyUSB1")}])
+
+    # Reading the config (ie elsewhere in the same process) before the watcher gets to it doesn't hide the change.
+    def test_callback_after_get(self):
+        changes = []
+        self.config.add_callback(changes.append, keys=["serial_port"])
+        self.config.update("serial_port", "/dev/ttyUSB2")
+        self.assertEqual(self.config.get()["serial_port"], "/dev/ttyUSB2")
+
+        time.sleep(SHARED_CONFIG_WATCH_PERIOD_S * 3)
+        self.assertEqual(changes, [{"serial_port": (None, "/dev/ttyUSB2")}])
+
+    # Compares how long a config read takes via the proxy vs shared memory,
+    # with every other process hammering the config the same way.
+    def test_benchmark_get_latency(self):
+        results = {}
+        for name, config in [("proxy", self.proxy), ("shared memory", self.config)]:
+            stop = multiprocessing.Event()
+            loaders = [
+                multiprocessing.Process(target=_keep_reading, args=(config, stop))
+                for _ in range(BENCHMARK_PROCESSES)
+            ]
+            for loader in loaders:
+                loader.start()
+            time.sleep(0.5)
+
+            latencies = []
+            for i in range(BENCHMARK_READS):
+                start = time.time()
+                config.get()
+                latencies.append(time.time() - start)
+
+            stop.set()
+            for loader in loaders:
+                loader.join()
+
+            results[name] = sum(latencies) / len(latencies)
+            self.logger.log.info(
+                "Config get() via {} with {} other processes reading: mean {:.1f}us, max {:.1f}us".format(
+                    name, BENCHMARK_PROCESSES, results[name] * 1000000, max(latencies) * 1000000
+                )
+            )
+
+        self.assertLess(results["shared memory"], results["proxy"])
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
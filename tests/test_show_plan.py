@@ -0,0 +1,182 @@
+import unittest
+import time
+from typing import List
+
+from baps_types.plan import PlanItem
+from baps_types.show_plan import ShowPlan
+from helpers.logging_manager import LoggingManager
+
+# Plan sizes to benchmark with, long-form automation plans can be thousands of items.
+BENCHMARK_PLAN_SIZES = [1000, 5000]
+# How many single item edits / lookups to time for each plan size.
+BENCHMARK_EDITS = 200
+
+
+def _plan_item(weight: int, timeslotitemid=None) -> PlanItem:
+    return PlanItem(
+        {
+            "timeslotitemid": weight if timeslotitemid is None else timeslotitemid,
+            "trackid": weight,
+            "weight": weight,
+            "title": "Track {}".format(weight),
+            "artist": "Artist {}".format(weight),
+            "length": "00:03:30",
+        }
+    )
+
+
+# The old way the player added items: shift every item after each new one, then sort and renumber.
+def _old_add_to_plan(plan: List[PlanItem], new_items: List[PlanItem]) -> List[PlanItem]:
+    plan = list(plan)
+    for new_item in new_items:
+        for item in plan:
+            if item.weight >= new_item.weight:
+                item.weight += 1
+        plan += [new_item]
+    plan.sort(key=lambda e: e.weight)
+    for i in range(len(plan)):
+        plan[i].weight = i
+    return plan
+
+
+# The old way the player found an item for a marker / to load.
+def _old_find(plan: List[PlanItem], timeslotitemid: str) -> PlanItem:
+    for item in plan:
+        if str(item.timeslotitemid) == str(timeslotitemid):
+            return item
+    raise KeyError(timeslotitemid)
+
+
+class TestShowPlan(unittest.TestCase):
+
+    logger: LoggingManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_ShowPlan")
+
+    def _check_plan(self, plan: ShowPlan, timeslotitemids: List[str]):
+        self.assertEqual([item.timeslotitemid for item in plan], timeslotitemids)
+        for weight, item in enumerate(plan):
+            self.assertEqual(item.weight, weight)
+            self.assertIs(plan.get(weight), item)
+            self.assertEqual(plan.weight_of(item.timeslotitemid), weight)
+            self.assertIs(plan.find(item.timeslotitemid), item)
+
+    def test_fixes_weights(self):
+        plan = ShowPlan([_plan_item(5, "a"), _plan_item(2, "b"), _plan_item(2, "c")])
+        self._check_plan(plan, ["b", "c", "a"])
+
+    def test_insert(self):
+        plan = ShowPlan([_plan_item(0, "a"), _plan_item(1, "b")])
+        plan.insert([_plan_item(1, "c"), _plan_item(0, "d"), _plan_item(100, "e")])
+        self._check_plan(plan, ["d", "c", "a", "b", "e"])
+
+    # Items given out of order still end up at their weights.
+    def test_insert_out_of_order(self):
+        plan = ShowPlan()
+        plan.insert([_plan_item(2, "c"), _plan_item(1, "b"), _plan_item(0, "a")])
+        self._check_plan(plan, ["a", "b", "c"])
+
+        plan.insert([_plan_item(4, "e"), _plan_item(1, "d")])
+        self._check_plan(plan, ["a", "d", "b", "c", "e"])
+
+    def test_insert_same_as_before(self):
+        new_items = [(0, "d"), (1, "c"), (2, "e"), (5, "f")]
+        old = _old_add_to_plan(
+            [_plan_item(0, "a"), _plan_item(1, "b")],
+            [_plan_item(weight, id) for weight, id in new_items],
+        )
+        plan = ShowPlan([_plan_item(0, "a"), _plan_item(1, "b")])
+        plan.insert([_plan_item(weight, id) for weight, id in new_items])
+        self._check_plan(plan, [item.timeslotitemid for item in old])
+
+    def test_remove(self):
+        plan = ShowPlan([_plan_item(i, id) for i, id in enumerate("abcd")])
+        self.assertEqual(plan.remove(1).timeslotitemid, "b")
+        self.assertIsNone(plan.remove(3))
+        self.assertIsNone(plan.weight_of("b"))
+        self._check_plan(plan, ["a", "c", "d"])
+
+    def test_move(self):
+        plan = ShowPlan([_plan_item(i, id) for i, id in enumerate("abcd")])
+        self.assertTrue(plan.move(0, 2))
+        self._check_plan(plan, ["b", "c", "a", "d"])
+        self.assertTrue(plan.move(3, 0))
+        self._check_plan(plan, ["d", "b", "c", "a"])
+        self.assertFalse(plan.move(4, 0))
+
+    def test_replace(self):
+        plan = ShowPlan([_plan_item(i, id) for i, id in enumerate("abc")])
+        new_item = _plan_item(10, "b")
+        plan.replace(1, new_item)
+        self.assertIs(plan.find("b"), new_item)
+        self._check_plan(plan, ["a", "b", "c"])
+
+    def test_items_is_a_copy(self):
+        plan = ShowPlan([_plan_item(i) for i in range(3)])
+        items = plan.items()
+        plan.remove(0)
+        self.assertEqual(len(items), 3)
+
+    # Compares the old list based show plan edits / lookups against ShowPlan, for big plans.
+    def test_benchmark_show_plan(self):
+        for plan_size in BENCHMARK_PLAN_SIZES:
+            # Loading a whole plan (as get_plan does).
+            start = time.perf_counter()
+            old_plan = _old_add_to_plan([], [_plan_item(i) for i in range(plan_size)])
+            old_load = time.perf_counter() - start
+
+            start = time.perf_counter()
+            plan = ShowPlan()
+            plan.insert([_plan_item(i) for i in range(plan_size)])
+            new_load = time.perf_counter() - start
+
+            # Adding single items into the middle of the plan.
+            start = time.perf_counter()
+            for i in range(BENCHMARK_EDITS):
+                old_plan = _old_add_to_plan(old_plan, [_plan_item(plan_size // 2, "new{}".format(i))])
+            old_insert = (time.perf_counter() - start) / BENCHMARK_EDITS
+
+            start = time.perf_counter()
+            for i in range(BENCHMARK_EDITS):
+                plan.insert([_plan_item(plan_size // 2, "new{}".format(i))])
+                plan.items()
+            new_insert = (time.perf_counter() - start) / BENCHMARK_EDITS
+
+            # Finding items by timeslotitemid (as set_marker does).
+            ids = [str(i * plan_size // BENCHMARK_EDITS) for i in range(BENCHMARK_EDITS)]
+            start = time.perf_counter()
+            for id in ids:
+                _old_find(old_plan, id)
+            old_find = (time.perf_counter() - start) / BENCHMARK_EDITS
+
+            start = time.perf_counter()
+            for id in ids:
+                plan.find(id)
+            new_find = (time.perf_counter() - start) / BENCHMARK_EDITS
+
+            self.assertEqual(
+                [item.timeslotitemid for item in plan], [item.timeslotitemid for item in old_plan]
+            )
+            self.logger.log.info(
+                "{} item plan: load {:.1f}ms -> {:.1f}ms, insert {:.0f}us -> {:.0f}us, find {:.1f}us -> {:.2f}us".format(
+                    plan_size,
+                    old_load * 1000,
+                    new_load * 1000,
+                    old_insert * 1000000,
+                    new_insert * 1000000,
+                    old_find * 1000000,
+                    new_find * 1000000,
+                )
+            )
+            self.assertLess(new_load, old_load)
+            self.assertLess(new_insert, old_insert)
+            self.assertLess(new_find, old_find)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
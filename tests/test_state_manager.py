@@ -0,0 +1,487 @@
+import unittest
+import multiprocessing
+import os
+import json
+import pickle
+import time
+import tracemalloc
+from copy import copy
+from typing import List
+from unittest.mock import patch
+
+from baps_types.plan import PlanItem
+from helpers.logging_manager import LoggingManager
+from helpers.state_manager import StateChanges, StateManager
+from helpers.os_environment import resolve_external_file_path
+
+STATE_NAME = "Test_StateManager"
+JOURNAL_STATE_NAME = "Test_StateManager_Journal"
+
+# How many items to put in the show plan / how many writes to do when benchmarking.
+BENCHMARK_PLAN_ITEMS = 200
+BENCHMARK_WRITES = 500
+# How many Player loop iterations to time, and how many times the Player reads the state in each.
+BENCHMARK_LOOPS = 10000
+BENCHMARK_READS_PER_LOOP = 8
+
+
+def _state_path(name: str, extension: str = ".json"):
+    return resolve_external_file_path("/state/{}{}".format(name, extension))
+
+
+def _remove_state_files(name: str):
+    for extension in [".json", ".json.tmp", ".journal", ".journal.compacting"]:
+        if os.path.isfile(_state_path(name, extension)):
+            os.remove(_state_path(name, extension))
+
+
+# A player-like state, with a decent sized show plan.
+def _player_state(plan_items: int):
+    return {
+        "channel": 0,
+        "loaded_item": None,
+        "paused": False,
+        "pos": 0,
+        "show_plan": [
+            PlanItem(
+                {
+                    "timeslotitemid": i,
+                    "trackid": i,
+                    "weight": i,
+                    "title": "Track {}".format(i),
+                    "artist": "Artist {}".format(i),
+                    "length": "00:03:30",
+                }
+            )
+            for i in range(plan_items)
+        ],
+    }
+
+
+# Run in a separate process, to keep writing to a journal until it is killed.
+def _journal_writer(acked_q: multiprocessing.Queue):
+    logger = LoggingManager("Test_StateManager")
+    state = StateManager(
+        JOURNAL_STATE_NAME,
+        logger,
+        default_state={"count": 0},
+        journal=True,
+        journal_fsync_period_s=0,
+        journal_compact_entries=50,
+    )
+    count = 0
+    while True:
+        count += 1
+        state.update("count", count)
+        acked_q.put(count)
+
+
+class TestStateManager(unittest.TestCase):
+
+    logger: LoggingManager
+    state: StateManager
+    callback_count: int
+    callback_changes: List[StateChanges]
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_StateManager")
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        self.filepath = resolve_external_file_path("/state/{}.json".format(STATE_NAME))
+        if os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+
+        self.state = StateManager(
+            STATE_NAME, self.logger, default_state={"a": 0, "b": 0, "c": 0}
+        )
+        self.callback_count = 0
+        self.callback_changes = []
+        self.state.add_callback(self._callback)
+
+    # clean up logic
+    # code that is executed after each test
+    def tearDown(self):
+        self.state.remove_callback(self._callback)
+        if os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+
+    def _callback(self, changes: StateChanges):
+        self.callback_count += 1
+        self.callback_changes.append(changes)
+
+    def _read_file(self):
+        with open(self.filepath, "r") as file:
+            return json.loads(file.read())
+
+    def test_update_without_transaction(self):
+        with patch.object(self.state, "write_to_file", wraps=self.state.write_to_file) as write:
+            self.state.update("a", 1)
+            self.state.update("b", 2)
+
+            self.assertEqual(write.call_count, 2)
+            self.assertEqual(self.callback_count, 2)
+
+    def test_transaction_commits_once(self):
+        with patch.object(self.state, "write_to_file", wraps=self.state.write_to_file) as write:
+            with self.state.transaction():
+                self.state.update("a", 1)
+                self.state.update("b", 2)
+                self.state.update("c", 3)
+
+                # Changes are visible straight away, but nothing is written / announced yet.
+                self.assertEqual(self.state.get()["b"], 2)
+                self.assertEqual(write.call_count, 0)
+                self.assertEqual(self.callback_count, 0)
+
+            self.assertEqual(write.call_count, 1)
+            self.assertEqual(self.callback_count, 1)
+
+        file_state = self._read_file()
+        self.assertEqual((file_state["a"], file_state["b"], file_state["c"]), (1, 2, 3))
+
+    def test_nested_transactions(self):
+        with patch.object(self.state, "write_to_file", wraps=self.state.write_to_file) as write:
+            with self.state.transaction():
+                self.state.update("a", 1)
+                with self.state.transaction():
+                    self.state.update("b", 2)
+                # The inner transaction shouldn't have committed.
+                self.assertEqual(write.call_count, 0)
+                self.state.update("c", 3)
+
+            self.assertEqual(write.call_count, 1)
+            self.assertEqual(self.callback_count, 1)
+
+    def test_transaction_without_changes(self):
+        with patch.object(self.state, "write_to_file", wraps=self.state.write_to_file) as write:
+            with self.state.transaction():
+                # Same value as the default, so this isn't a change.
+                self.state.update("a", 0)
+
+            self.assertEqual(write.call_count, 0)
+            self.assertEqual(self.callback_count, 0)
+
+    def test_transaction_commits_on_exception(self):
+        with self.assertRaises(ValueError):
+            with self.state.transaction():
+                self.state.update("a", 1)
+                raise ValueError("Something went wrong mid command.")
+
+        self.assertEqual(self.callback_count, 1)
+        self.assertEqual(self._read_file()["a"], 1)
+
+    def test_callback_changes(self):
+        self.state.update("a", 1)
+        self.assertEqual(self.callback_changes, [{"a": (0, 1)}])
+
+    def test_callback_transaction_changes(self):
+        with self.state.transaction():
+            self.state.update("a", 1)
+            self.state.update("b", 1)
+            self.state.update("a", 2)
+
+        # Should be told what it was before the transaction, and what it is now.
+        self.assertEqual(self.callback_changes, [{"a": (0, 2), "b": (0, 1)}])
+
+    def test_callback_keys(self):
+        b_changes = []
+        self.state.add_callback(b_changes.append, keys=["b"])
+
+        self.state.update("a", 1)
+        self.assertEqual(b_changes, [])
+
+        with self.state.transaction():
+            self.state.update("a", 2)
+            self.state.update("b", 1)
+        # Only told about the keys it cares about.
+        self.assertEqual(b_changes, [{"b": (0, 1)}])
+        self.assertEqual(self.callback_changes[-1], {"a": (1, 2), "b": (0, 1)})
+
+    def test_callbacks_are_per_state_manager(self):
+        other_state = StateManager(
+            JOURNAL_STATE_NAME, self.logger, default_state={"a": 0}
+        )
+        other_changes = []
+        other_state.add_callback(other_changes.append)
+
+        self.state.update("a", 1)
+        self.assertEqual(other_changes, [])
+        other_state.update("a", 1)
+        self.assertEqual(self.callback_count, 1)
+        self.assertEqual(other_changes, [{"a": (0, 1)}])
+        _remove_state_files(JOURNAL_STATE_NAME)
+
+    def test_snapshot_is_not_copied(self):
+        self.assertIs(self.state.get(), self.state.get())
+
+    def test_snapshot_is_read_only(self):
+        snapshot = self.state.get()
+        with self.assertRaises(TypeError):
+            snapshot["a"] = 1
+        with self.assertRaises(TypeError):
+            snapshot.update({"a": 1})
+        with self.assertRaises(TypeError):
+            del snapshot["a"]
+        self.assertEqual(self.state.get()["a"], 0)
+
+        # But copies are fair game.
+        snapshot_copy = copy(snapshot)
+        snapshot_copy["a"] = 1
+        self.assertEqual(self.state.get()["a"], 0)
+
+    def test_snapshot_versions(self):
+        before = self.state.get()
+        self.state.update("a", 1)
+        after = self.state.get()
+
+        # Older snapshots don't change underneath whoever is holding them.
+        self.assertEqual(before["a"], 0)
+        self.assertEqual(after["a"], 1)
+        self.assertGreater(after.version, before.version)
+        self.assertEqual(self.state.version(), after.version)
+
+        # No change, no new version.
+        self.state.update("a", 1)
+        self.assertIs(self.state.get(), after)
+
+    def test_snapshot_index_update(self):
+        self.state.update("a", [1, 2, 3])
+        before = self.state.get()
+        self.state.update("a", 4, index=1)
+
+        self.assertEqual(before["a"], [1, 2, 3])
+        self.assertEqual(self.state.get()["a"], [1, 4, 3])
+
+    def test_snapshot_pickles_to_dict(self):
+        # This is what other processes get via the proxy.
+        unpickled = pickle.loads(pickle.dumps(self.state.get()))
+        self.assertIs(type(unpickled), dict)
+        self.assertEqual(unpickled, {"a": 0, "b": 0, "c": 0})
+
+    # Compares how much memory a Player loop's worth of state reads allocates,
+    # copying the state on every read (the old behaviour) vs handing out the snapshot.
+    def test_benchmark_read_allocations(self):
+        state = StateManager(
+            STATE_NAME, self.logger, default_state=_player_state(BENCHMARK_PLAN_ITEMS)
+        )
+        for key in ["playing", "loaded", "initialised", "remaining", "pos_true", "live", "output"]:
+            state.update(key, False)
+
+        results = {}
+        for copy_on_read in [True, False]:
+
+            def read():
+                return copy(state.get()) if copy_on_read else state.get()
+
+            start = time.time()
+            for _ in range(BENCHMARK_LOOPS * BENCHMARK_READS_PER_LOOP):
+                read()
+            reads_per_s = (BENCHMARK_LOOPS * BENCHMARK_READS_PER_LOOP) / (time.time() - start)
+
+            # Keep hold of every read, so everything they allocated is still around to be counted.
+            kept = [None] * BENCHMARK_LOOPS * BENCHMARK_READS_PER_LOOP
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            for i in range(len(kept)):
+                kept[i] = read()
+            bytes_per_read = (tracemalloc.get_traced_memory()[0] - before) / len(kept)
+            tracemalloc.stop()
+            del kept
+
+            results[copy_on_read] = (reads_per_s, bytes_per_read)
+
+        self.logger.log.info(
+            "State reads, {} per Player loop: copy on read {:.0f} reads/s, {:.0f} bytes allocated/s; "
+            "snapshot {:.0f} reads/s, {:.0f} bytes allocated/s".format(
+                BENCHMARK_READS_PER_LOOP,
+                results[True][0],
+                results[True][0] * results[True][1],
+                results[False][0],
+                results[False][0] * results[False][1],
+            )
+        )
+        self.assertLess(results[False][1], 1)
+        self.assertGreater(results[False][0], results[True][0])
+
+
+class TestStateManagerJournal(unittest.TestCase):
+
+    logger: LoggingManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_StateManager")
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        _remove_state_files(JOURNAL_STATE_NAME)
+        self.states: List[StateManager] = []
+
+    # clean up logic
+    # code that is executed after each test
+    def tearDown(self):
+        for state in self.states:
+            state.close()
+        _remove_state_files(JOURNAL_STATE_NAME)
+
+    def _journal_state(self, **kwargs) -> StateManager:
+        state = StateManager(
+            JOURNAL_STATE_NAME,
+            self.logger,
+            default_state=_player_state(3),
+            journal=True,
+            **kwargs
+        )
+        self.states.append(state)
+        return state
+
+    def test_journal_replay(self):
+        state = self._journal_state()
+        state.update("paused", True)
+        state.update("pos", 12.5)
+        item = state.get()["show_plan"][1]
+        item.play_count_increment()
+        state.update("show_plan", item, index=1)
+
+        # Start again without a clean shutdown, the journal should be replayed.
+        state = self._journal_state()
+        self.assertTrue(state.get()["paused"])
+        self.assertEqual(state.get()["pos"], 12.5)
+        self.assertEqual(state.get()["show_plan"][1].play_count, 1)
+        self.assertEqual(state.get()["show_plan"][0].play_count, 0)
+
+    def test_journal_entries_are_deltas(self):
+        state = self._journal_state()
+        state.update("pos", 1)
+        state.update("paused", True)
+
+        with open(_state_path(JOURNAL_STATE_NAME, ".journal"), "r") as file:
+            entries = [json.loads(line) for line in file]
+        self.assertEqual(entries, [[["pos", 1]], [["paused", True]]])
+
+    def test_journal_transaction_is_one_entry(self):
+        state = self._journal_state()
+        with state.transaction():
+            state.update("pos", 1)
+            state.update("paused", True)
+
+        with open(_state_path(JOURNAL_STATE_NAME, ".journal"), "r") as file:
+            entries = [json.loads(line) for line in file]
+        self.assertEqual(entries, [[["pos", 1], ["paused", True]]])
+
+    def test_journal_compaction(self):
+        state = self._journal_state(journal_compact_entries=10)
+        for i in range(1, 26):
+            state.update("pos", i)
+
+        # Let the background compaction finish. If one was skipped because another was still
+        # running, the next write should pick it up.
+        time.sleep(0.5)
+        state.update("pos", 26)
+        time.sleep(0.5)
+        # The journal won't exist at all if the last write was the one that got it compacted.
+        if os.path.isfile(_state_path(JOURNAL_STATE_NAME, ".journal")):
+            with open(_state_path(JOURNAL_STATE_NAME, ".journal"), "r") as file:
+                self.assertLess(len(file.readlines()), 10)
+        self.assertFalse(os.path.isfile(_state_path(JOURNAL_STATE_NAME, ".journal.compacting")))
+
+        state = self._journal_state()
+        self.assertEqual(state.get()["pos"], 26)
+
+    def test_journal_close(self):
+        state = self._journal_state()
+        state.update("pos", 1)
+        state.close()
+        self.assertEqual(self._journal_state().get()["pos"], 1)
+
+        # It can still be written to afterwards.
+        state.update("pos", 2)
+        state.close()
+        self.assertEqual(self._journal_state().get()["pos"], 2)
+
+    def test_journal_truncated_entry(self):
+        state = self._journal_state()
+        state.update("pos", 1)
+        state.update("pos", 2)
+
+        # Pretend we died half way through writing the next entry.
+        with open(_state_path(JOURNAL_STATE_NAME, ".journal"), "a") as file:
+            file.write('[["pos", 3')
+
+        state = self._journal_state()
+        self.assertEqual(state.get()["pos"], 2)
+
+    def test_journal_died_while_compacting(self):
+        state = self._journal_state()
+        state.update("pos", 1)
+
+        # Pretend we died after moving the journal away for compaction, but before the state file was written.
+        os.replace(
+            _state_path(JOURNAL_STATE_NAME, ".journal"),
+            _state_path(JOURNAL_STATE_NAME, ".journal.compacting"),
+        )
+        with open(_state_path(JOURNAL_STATE_NAME, ".journal"), "w") as file:
+            file.write(json.dumps([["paused", True]]) + "\n")
+
+        state = self._journal_state()
+        self.assertEqual(state.get()["pos"], 1)
+        self.assertTrue(state.get()["paused"])
+        # The journals should now be rolled into the state file.
+        self.assertFalse(os.path.isfile(_state_path(JOURNAL_STATE_NAME, ".journal.compacting")))
+
+    # Kill a process mid write, and make sure everything it said it saved is still there.
+    def test_journal_crash_consistency(self):
+        acked_q = multiprocessing.Queue()
+        writer = multiprocessing.Process(target=_journal_writer, args=(acked_q,))
+        writer.start()
+
+        acked = 0
+        while acked < 500:
+            acked = acked_q.get(timeout=10)
+        writer.kill()
+        writer.join()
+        while not acked_q.empty():
+            acked = acked_q.get()
+
+        state = StateManager(
+            JOURNAL_STATE_NAME, self.logger, default_state={"count": 0}, journal=True
+        )
+        self.states.append(state)
+        self.assertGreaterEqual(state.get()["count"], acked)
+
+    # Compares how many non rate limited changes a second we can save with and without the journal.
+    def test_benchmark_writes_per_second(self):
+        results = {}
+        for journal in [False, True]:
+            _remove_state_files(JOURNAL_STATE_NAME)
+            state = StateManager(
+                JOURNAL_STATE_NAME,
+                self.logger,
+                default_state=_player_state(BENCHMARK_PLAN_ITEMS),
+                journal=journal,
+            )
+            self.states.append(state)
+            start = time.time()
+            for i in range(BENCHMARK_WRITES):
+                state.update("paused", i % 2 == 0)
+            results[journal] = BENCHMARK_WRITES / (time.time() - start)
+
+        self.logger.log.info(
+            "Writes per second with a {} item plan: whole file {:.0f}, journal {:.0f}".format(
+                BENCHMARK_PLAN_ITEMS, results[False], results[True]
+            )
+        )
+        self.assertGreater(results[True], results[False])
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
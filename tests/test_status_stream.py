@@ -0,0 +1,193 @@
+import unittest
+import json
+import time
+from typing import Any, Dict
+
+from baps_types.plan import PlanItem
+from helpers.logging_manager import LoggingManager
+from helpers.status_stream import STATUS_SEQ_KEY, StatusDeltaEncoder, StatusTracker
+
+# How many items to put in the show plan / how many status events to time when benchmarking.
+BENCHMARK_PLAN_ITEMS = 200
+BENCHMARK_EVENTS = 200
+
+
+def _plan_item(weight: int) -> PlanItem:
+    return PlanItem(
+        {
+            "timeslotitemid": weight,
+            "trackid": weight,
+            "weight": weight,
+            "title": "Track {}".format(weight),
+            "artist": "Artist {}".format(weight),
+            "length": "00:03:30",
+        }
+    )
+
+
+# A player-like state, with a decent sized show plan.
+def _player_state(plan_items: int) -> Dict[str, Any]:
+    return {
+        "channel": 0,
+        "loaded_item": None,
+        "playing": False,
+        "paused": False,
+        "pos_true": 0,
+        "show_plan": [_plan_item(i) for i in range(plan_items)],
+    }
+
+
+# The same as the Player's full status.
+def _status_json(state: Dict[str, Any]) -> str:
+    status = dict(state)
+    status["loaded_item"] = state["loaded_item"].__dict__ if state["loaded_item"] else None
+    status["show_plan"] = [item.__dict__ for item in state["show_plan"]]
+    return json.dumps(status)
+
+
+class TestStatusStream(unittest.TestCase):
+
+    logger: LoggingManager
+
+    # initialization logic for the test suite declared in the test module
+    # code that is executed before all tests in one test run
+    @classmethod
+    def setUpClass(cls):
+        cls.logger = LoggingManager("Test_StatusStream")
+
+    # initialization logic
+    # code that is executed before each test
+    def setUp(self):
+        self.state = _player_state(5)
+        self.encoder = StatusDeltaEncoder()
+        self.tracker = StatusTracker()
+        self.encoder.delta(self.state)
+        self.tracker.apply_full(json.loads(self.encoder.full(_status_json(self.state))))
+
+    # Makes a delta of the current state, passes it to the tracker and checks they agree.
+    def _check_delta(self, check_plan: bool = True) -> Dict[str, Any]:
+        delta_json = self.encoder.delta(self.state, check_plan)
+        self.assertIsNotNone(delta_json)
+        delta = json.loads(delta_json)
+        self.assertTrue(self.tracker.apply_delta(delta))
+
+        expected = json.loads(self.encoder.full(_status_json(self.state)))
+        self.assertEqual(self.tracker.status, expected)
+        return delta
+
+    def test_full_status_has_seq(self):
+        self.assertEqual(self.tracker.seq, self.encoder.seq)
+        self.assertEqual(self.tracker.status[STATUS_SEQ_KEY], self.encoder.seq)
+
+    def test_no_changes(self):
+        self.assertIsNone(self.encoder.delta(self.state))
+
+    def test_key_change(self):
+        self.state["paused"] = True
+        delta = self._check_delta(check_plan=False)
+        # Only the changed key should be sent.
+        self.assertEqual(delta["changes"], {"paused": True})
+        self.assertNotIn("show_plan", delta)
+
+    def test_plan_item_change(self):
+        self.state["show_plan"] = list(self.state["show_plan"])
+        self.state["show_plan"][2] = _plan_item(2)
+        self.state["show_plan"][2].play_count_increment()
+        delta = self._check_delta()
+        # Only the changed item should be sent.
+        self.assertEqual(len(delta["show_plan"]["items"]), 1)
+        self.assertEqual(delta["show_plan"]["items"][0][0], 2)
+
+    def test_plan_add_and_remove(self):
+        self.state["show_plan"] = self.state["show_plan"] + [_plan_item(5), _plan_item(6)]
+        self._check_delta()
+
+        self.state["show_plan"] = self.state["show_plan"][1:]
+        for weight, item in enumerate(self.state["show_plan"]):
+            item.weight = weight
+        self._check_delta()
+
+        self.state["show_plan"] = []
+        self._check_delta()
+
+    def test_loaded_item_change(self):
+        self.state["loaded_item"] = self.state["show_plan"][1]
+        self.state["loaded"] = True
+        self._check_delta(check_plan=False)
+
+    def test_missed_delta(self):
+        self.state["paused"] = True
+        self.encoder.delta(self.state)
+        self.state["paused"] = False
+
+        self.assertFalse(self.tracker.apply_delta(json.loads(self.encoder.delta(self.state))))
+        self.assertFalse(self.tracker.in_sync)
+
+        # Until we get the full status again, we can't keep up.
+        self.state["playing"] = True
+        self.assertFalse(self.tracker.apply_delta(json.loads(self.encoder.delta(self.state))))
+
+        self.tracker.apply_full(json.loads(self.encoder.full(_status_json(self.state))))
+        self.state["playing"] = False
+        self._check_delta()
+
+    # Compares the bytes sent and CPU time used for each status event,
+    # sending the full status every time (the old way) vs sending deltas.
+    def test_benchmark_status_event(self):
+        for event, check_plan in [("key change", False), ("plan item change", True)]:
+            state = _player_state(BENCHMARK_PLAN_ITEMS)
+
+            def change(i: int):
+                if check_plan:
+                    state["show_plan"] = list(state["show_plan"])
+                    state["show_plan"][i % BENCHMARK_PLAN_ITEMS] = _plan_item(i % BENCHMARK_PLAN_ITEMS)
+                    state["show_plan"][i % BENCHMARK_PLAN_ITEMS].play_count_increment()
+                else:
+                    state["paused"] = i % 2 == 0
+
+            # The old way, the player makes the full status, the websocket server loads / dumps it for the clients.
+            full_bytes = 0
+            full_cpu = 0.0
+            for i in range(BENCHMARK_EVENTS):
+                change(i)
+                start = time.process_time()
+                status = _status_json(state)
+                to_client = json.dumps({"command": "STATUS", "data": json.loads(status), "channel": 0})
+                full_cpu += time.process_time() - start
+                full_bytes += len(status) + len(to_client)
+
+            # The new way, the player makes a delta, the websocket server keeps up with it and passes it on.
+            encoder = StatusDeltaEncoder()
+            tracker = StatusTracker()
+            encoder.delta(state)
+            tracker.apply_full(json.loads(encoder.full(_status_json(state))))
+            delta_bytes = 0
+            delta_cpu = 0.0
+            for i in range(BENCHMARK_EVENTS):
+                change(i)
+                start = time.process_time()
+                delta = encoder.delta(state, check_plan)
+                assert delta
+                tracker.apply_delta(json.loads(delta))
+                to_client = '{{"command": "STATUSDELTA", "data": {}, "channel": 0}}'.format(delta)
+                delta_cpu += time.process_time() - start
+                delta_bytes += len(delta) + len(to_client)
+
+            self.logger.log.info(
+                "Status event ({}) with a {} item plan: full status {:.0f} bytes, {:.0f}us CPU; "
+                "delta {:.0f} bytes, {:.0f}us CPU".format(
+                    event,
+                    BENCHMARK_PLAN_ITEMS,
+                    full_bytes / BENCHMARK_EVENTS,
+                    full_cpu / BENCHMARK_EVENTS * 1000000,
+                    delta_bytes / BENCHMARK_EVENTS,
+                    delta_cpu / BENCHMARK_EVENTS * 1000000,
+                )
+            )
+            self.assertLess(delta_bytes * 10, full_bytes)
+            self.assertLess(delta_cpu, full_cpu)
+
+
+# runs the unit tests in the module
+if __name__ == "__main__":
+    unittest.main()
@@ -20,12 +20,15 @@ from helpers.os_environment import (
     isLinux,
     resolve_external_file_path,
     resolve_local_file_path,
+    resolve_music_tmp_path,
 )
 from helpers.logging_manager import LoggingManager
 from helpers.device_manager import DeviceManager
-from helpers.state_manager import StateManager
+from helpers.shared_config import SharedConfig
 from helpers.the_terminator import Terminator
+from helpers.music_cache import MusicCache
 from helpers.normalisation import get_normalised_filename_if_available
+from helpers.http_pool import close_http_pool
 from helpers.myradio_api import MyRadioAPI
 from helpers.alert_manager import AlertManager
 import package
@@ -104,7 +107,7 @@ def _filter_happytime(date):
 env.filters["happytime"] = _filter_happytime
 
 logger: LoggingManager
-server_state: StateManager
+server_state: SharedConfig
 api: MyRadioAPI
 alerts: AlertManager
 
@@ -150,7 +153,12 @@ def ui_status(request):
     for i in range(server_state.get()["num_channels"]):
         channel_states.append(status(i))
 
-    data = {"channels": channel_states,
+    # The file manager keeps the index up to date, we just have a look.
+    music_cache = MusicCache(
+        server_state.get()["music_cache_max_mb"] * 1024 * 1024, index=api.media_index
+    ).get_stats()
+
+    data = {"channels": channel_states, "music_cache": music_cache,
             "ui_page": "status", "ui_title": "Status"}
     return render_template("status.html", data=data)
 
@@ -229,6 +237,10 @@ def ui_config_server_update(request):
     )
     server_state.update("tracklist_mode", request.form.get("tracklist_mode"))
     server_state.update("normalisation_mode", request.form.get("normalisation_mode"))
+    server_state.update("preload_concurrency", int(request.form.get("preload_concurrency")))
+    server_state.update("preload_bandwidth_kbps", int(request.form.get("preload_bandwidth_kbps") or 0))
+    server_state.update("music_cache_max_mb", int(request.form.get("music_cache_max_mb")))
+    server_state.update("pcm_cache_max_mb", int(request.form.get("pcm_cache_max_mb")))
 
     return redirect("/restart")
 
@@ -426,11 +438,15 @@ def json_status(request):
 async def audio_file(request, type: str, id: int):
     if type not in ["managed", "track"]:
         raise SanicException("Bad Request",400)
-    filename = resolve_external_file_path(
-        "music-tmp/{}-{}.mp3".format(type, id))
+    # The media index knows where it is (and if there's a normalised version), without going to look.
+    media = api.media_index.get("{}-{}".format(type, id))
+    if media:
+        filename = media.best_filename
+    else:
+        filename = resolve_music_tmp_path("{}-{}.mp3".format(type, id))
 
-    # Swap with a normalised version if it's ready, else returns original.
-    filename = get_normalised_filename_if_available(filename)
+        # Swap with a normalised version if it's ready, else returns original.
+        filename = get_normalised_filename_if_available(filename)
 
     # Send file or 404
     try:
@@ -530,7 +546,7 @@ def restart(request):
 
 
 # Don't use reloader, it causes Nested Processes!
-def WebServer(player_to: List[Queue], player_from: Queue, state: StateManager):
+def WebServer(player_to: List[Queue], player_from: Queue, state: SharedConfig):
 
     global player_to_q, player_from_q, server_state, api, app, alerts
     player_to_q = player_to
@@ -558,4 +574,6 @@ def WebServer(player_to: List[Queue], player_from: Queue, state: StateManager):
             )
         except Exception as e:
             logger.log.exception(e)
+            close_http_pool()
             sys.exit(1)
+    close_http_pool()
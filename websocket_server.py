@@ -3,7 +3,7 @@ from asyncio.futures import Future
 from asyncio.tasks import Task, shield
 import multiprocessing
 import queue
-from typing import List
+from typing import Dict, List
 import websockets
 import json
 from os import _exit
@@ -13,6 +13,7 @@ from setproctitle import setproctitle
 from multiprocessing import current_process
 
 from helpers.logging_manager import LoggingManager
+from helpers.status_stream import StatusTracker
 from helpers.the_terminator import Terminator
 
 
@@ -20,6 +21,10 @@ class WebsocketServer:
 
     threads = Future
     baps_clients = set()
+    # Clients that have subscribed to status deltas, instead of full statuses on every change.
+    delta_clients = set()
+    # Keeps up with each channel's status deltas, so we can give out full statuses.
+    status_trackers: Dict[int, StatusTracker]
     player_to_q: List[multiprocessing.Queue]
     player_from_q: multiprocessing.Queue
     server_name: str
@@ -32,6 +37,9 @@ class WebsocketServer:
 
         self.player_to_q = in_q
         self.player_from_q = out_q
+        self.status_trackers = {
+            channel: StatusTracker() for channel in range(len(self.player_to_q))
+        }
 
         process_title = "BAPSicle - Websockets Server"
         setproctitle(process_title)
@@ -69,8 +77,7 @@ class WebsocketServer:
             json.dumps({"message": "Hello", "serverName": self.server_name})
         )
         self.logger.log.info("New Client: {}".format(websocket))
-        for channel in self.player_to_q:
-            channel.put("WEBSOCKET:STATUS")
+        await self.send_statuses(websocket)
 
         self.from_webstudio = asyncio.create_task(
             self.handle_from_webstudio(websocket))
@@ -84,6 +91,15 @@ class WebsocketServer:
         try:
             async for message in websocket:
                 data = json.loads(message)
+                if data.get("command") == "SUBSCRIBE":
+                    # The client can follow status deltas, and knows to SUBSCRIBE again if it misses one.
+                    if data.get("deltas"):
+                        self.delta_clients.add(websocket)
+                    else:
+                        self.delta_clients.discard(websocket)
+                    await self.send_statuses(websocket)
+                    continue
+
                 if "channel" not in data:
                     # Didn't specify a channel, send to all.
                     for channel in range(len(self.player_to_q)):
@@ -106,6 +122,51 @@ class WebsocketServer:
         finally:
             self.logger.log.info("Removing client: {}".format(websocket))
             self.baps_clients.remove(websocket)
+            self.delta_clients.discard(websocket)
+
+    # Sends a client the full status of every channel.
+    async def send_statuses(self, websocket):
+        for channel, tracker in self.status_trackers.items():
+            if tracker.in_sync:
+                await websocket.send(
+                    json.dumps({"command": "STATUS", "data": tracker.status, "channel": channel})
+                )
+            else:
+                # We don't know it either, the reply will go to all clients.
+                self.request_status(channel)
+
+    # Asks a player for its full status, if we haven't already.
+    def request_status(self, channel: int):
+        tracker = self.status_trackers[channel]
+        if not tracker.awaiting_full:
+            tracker.awaiting_full = True
+            self.player_to_q[channel].put("WEBSOCKET:STATUS")
+
+    async def send_to_clients(self, clients, data: str):
+        # Exceptions are typically sending to a dead client, it'll be removed soon.
+        await asyncio.gather(*[conn.send(data) for conn in clients], return_exceptions=True)
+
+    # A status delta from a player, keep up with it and tell the clients.
+    async def handle_status_delta(self, channel: int, delta_json: str):
+        tracker = self.status_trackers[channel]
+        if not tracker.apply_delta(json.loads(delta_json)):
+            self.logger.log.info("Missed a status delta for channel {}, resyncing.".format(channel))
+            self.request_status(channel)
+            return
+
+        # Pass the delta straight on, no need to decode / encode it again.
+        await self.send_to_clients(
+            self.delta_clients,
+            '{{"command": "STATUSDELTA", "data": {}, "channel": {}}}'.format(delta_json, channel),
+        )
+
+        # Everyone else still gets the full status.
+        full_clients = self.baps_clients - self.delta_clients
+        if full_clients:
+            await self.send_to_clients(
+                full_clients,
+                json.dumps({"command": "STATUS", "data": tracker.status, "channel": channel}),
+            )
 
     def sendCommand(self, channel, data):
         if channel not in range(len(self.player_to_q)):
@@ -231,11 +292,19 @@ class WebsocketServer:
                         message = json.loads(message)
                     except Exception:
                         continue  # TODO more logging
+                    self.status_trackers[channel].apply_full(message)
+                elif command == "STATUSDELTA":
+                    if split[3] == "OKAY":
+                        await self.handle_status_delta(channel, message.split(":", 4)[4])
+                    continue
                 elif command == "POS":
                     try:
                         message = split[3]
                     except Exception:
                         continue
+                elif command in ["LOADING", "LOADPROGRESS", "LOADED", "LOADFAILED"]:
+                    # The weight being loaded, (for progress, then bytes downloaded:total bytes)
+                    message = ":".join(split[3:])
                 elif command == "QUIT":
                     self.quit()
                 else:
@@ -244,7 +313,7 @@ class WebsocketServer:
                 data = json.dumps(
                     {"command": command, "data": message, "channel": channel}
                 )
-                await asyncio.wait([conn.send(data) for conn in self.baps_clients])
+                await self.send_to_clients(self.baps_clients, data)
             except queue.Empty:
                 continue
             except ValueError: